@@ -1,42 +1,96 @@
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from contextlib import asynccontextmanager
+from datetime import datetime
 from functools import lru_cache
-from typing import List, Optional
+from itertools import islice
+from typing import AsyncIterator, Iterator, List, Optional, Set, Tuple
 from uuid import UUID, uuid4
 
 import uvicorn
-from fastapi import Depends, FastAPI, HTTPException, Path
-from fastapi.responses import RedirectResponse
-from pydantic import UUID4, EmailStr
+from fastapi import Depends, FastAPI, Header, HTTPException, Path, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import UUID4, BaseModel, EmailStr
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from . import config
+from .cache import (
+    ContactCache,
+    IdentityCache,
+    MemoryCache,
+    RecentWrites,
+    RedisCache,
+    get_cache_backend,
+)
 from .crud import (
-    create_contact,
+    create_contacts_bulk,
+    email_id_exists,
+    get_all_contacts,
+    get_amo_by_email_id,
     get_contact_by_email_id,
+    get_contact_update_timestamp,
+    get_contact_updates,
     get_contacts_by_any_id,
+    get_contacts_by_email_ids,
     get_email_by_email_id,
+    get_fxa_by_email_id,
+    get_newsletter_subscribers,
+    get_vpn_waitlist_by_email_id,
+    update_contact,
+)
+from .database import (
+    ReplicaPool,
+    ReplicaSession,
+    get_async_db_engine,
+    get_db_engine,
+    get_pool_status,
+    get_replica_pool,
+)
+from .metrics import (
+    MetricsMiddleware,
+    add_pool_metrics,
+    get_metrics_registry,
+    update_pool_metrics,
 )
-from .database import get_db_engine
 from .schemas import (
     AddOnsSchema,
     BadRequestResponse,
     ContactInSchema,
+    ContactPatchSchema,
     ContactSchema,
+    ContactUpdate,
+    CTMSBatchRequest,
+    CTMSBatchResponse,
+    CTMSBulkResponse,
+    CTMSBulkResult,
     CTMSResponse,
     EmailSchema,
     FirefoxAccountsSchema,
     IdentityResponse,
     NewsletterSchema,
+    NewsletterSubscribersResponse,
     NotFoundResponse,
+    UpdatesResponse,
     VpnWaitlistSchema,
 )
+from .timing import ServerTimingMiddleware, timed
 
 app = FastAPI(
     title="ConTact Management System (CTMS)",
     description="CTMS API (work in progress)",
     version="0.5.0",
 )
+app.add_middleware(MetricsMiddleware)
+engine = None
 SessionLocal = None
+replica_pool = None
+recent_writes = None
+contact_cache = None
+identity_cache = None
 
 
 @lru_cache()
@@ -44,29 +98,470 @@ def get_settings():
     return config.Settings()
 
 
+def create_caches(
+    settings: config.Settings,
+) -> Tuple[Optional[ContactCache], Optional[IdentityCache]]:
+    """
+    Return the contact and alternate ID caches, or None if caching is disabled.
+
+    Contacts and unknown IDs are only cached in the shared redis backend. A
+    write could not remove them from the memory caches of other workers, which
+    would serve the old contact until it expired. A cached alternate ID is
+    checked against the contact, so the memory backend can keep those.
+    """
+    if not settings.cache_backend:
+        return None, None
+    contact_cache, negative_backend = None, None
+    if settings.cache_backend == "redis":
+        if settings.negative_cache_ttl:
+            negative_backend = RedisCache.from_url(
+                settings.cache_url, settings.negative_cache_ttl
+            )
+        contact_cache = ContactCache(
+            get_cache_backend(settings, settings.cache_size, settings.cache_ttl),
+            negative_backend,
+        )
+    identity_cache = IdentityCache(
+        get_cache_backend(
+            settings, settings.identity_cache_size, settings.identity_cache_ttl
+        ),
+        negative_backend,
+    )
+    return contact_cache, identity_cache
+
+
 @app.on_event("startup")
 def startup_event():
-    global SessionLocal
-    engine, SessionLocal = get_db_engine(get_settings())
+    global engine, SessionLocal, replica_pool, recent_writes
+    global contact_cache, identity_cache
+    settings = get_settings()
+    if settings.db_async:
+        async_engine, SessionLocal = get_async_db_engine(settings)
+        engine = async_engine.sync_engine
+    else:
+        engine, SessionLocal = get_db_engine(settings)
+    replica_pool = get_replica_pool(settings)
+    add_pool_metrics("primary", engine)
+    if replica_pool:
+        for index, replica_engine in enumerate(replica_pool.engines):
+            add_pool_metrics(f"replica-{index}", replica_engine)
+    if replica_pool and settings.db_read_your_writes:
+        size, ttl = settings.cache_size, settings.db_read_your_writes
+        recent_writes = RecentWrites(
+            get_cache_backend(settings, size, ttl) or MemoryCache(size, ttl)
+        )
+    contact_cache, identity_cache = create_caches(settings)
+    if settings.server_timing:
+        app.add_middleware(ServerTimingMiddleware)
+
 
+async def close_session(db) -> None:
+    """Close a session, in the threadpool unless it is an AsyncSession."""
+    if isinstance(db, AsyncSession):
+        await db.close()
+    else:
+        await run_in_threadpool(db.close)
 
-def get_db():
+
+async def get_db():
+    """Return a session on the primary, an AsyncSession in async mode."""
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await close_session(db)
+
+
+async def run_db(db, func, *args):
+    """
+    Return func(session, *args), without blocking the event loop.
+
+    In async mode, db is an AsyncSession, and func gets its Session in a
+    greenlet on the event loop. The crud functions run unchanged, and each
+    statement awaits asyncpg, so a worker isn't limited to one request per
+    thread. Otherwise, func runs in the threadpool, like a "def" endpoint.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(func, *args)
+    return await run_in_threadpool(func, db, *args)
+
+
+async def iterate_in_session(
+    db: AsyncSession, items: Iterator, chunk_size: int
+) -> AsyncIterator:
+    """Yield from a generator that runs statements on the AsyncSession's Session."""
+    while True:
+        chunk = await db.run_sync(lambda _: list(islice(items, chunk_size)))
+        if not chunk:
+            return
+        for item in chunk:
+            yield item
+
+
+def get_replicas() -> Optional[ReplicaPool]:
+    """Return the read replicas, or None if there are none."""
+    return replica_pool
+
+
+def get_recent_writes() -> Optional[RecentWrites]:
+    """Return the recently written email_ids, or None if not tracked."""
+    return recent_writes
+
+
+@asynccontextmanager
+async def read_session(primary, replicas: Optional[ReplicaPool]):
+    """Return a session on the replicas, or the primary session if there are none."""
+    if replicas is None:
+        yield primary
+        return
+    if isinstance(primary, AsyncSession):
+        replica = replicas.async_session(primary.sync_session.get_bind())
+    else:
+        replica = replicas.session(primary.get_bind())
+    try:
+        yield replica
+    finally:
+        await close_session(replica)
+
+
+async def get_read_db(
+    primary: Session = Depends(get_db),
+    replicas: Optional[ReplicaPool] = Depends(get_replicas),
+):
+    """
+    Return a session for a read-only endpoint, on a replica if available.
+
+    The replica session connects on first use, so a request answered from a
+    cache doesn't use a replica connection.
+    """
+    async with read_session(primary, replicas) as db:
+        yield db
+
+
+async def get_contact_read_db(
+    email_id: UUID = Path(...),
+    primary: Session = Depends(get_db),
+    replicas: Optional[ReplicaPool] = Depends(get_replicas),
+    writes: Optional[RecentWrites] = Depends(get_recent_writes),
+):
+    """
+    Return a session for reading a contact by email_id.
+
+    A contact that was just written is read from the primary, so that the
+    writer sees it even if the replicas are behind.
+    """
+    recent = writes is not None and await run_in_threadpool(writes.is_recent, email_id)
+    if recent:
+        yield primary
+        return
+    async with read_session(primary, replicas) as db:
+        yield db
+
+
+def reads_primary(db: Session) -> bool:
+    """
+    Return True if a session reads from the primary, not from a replica.
+
+    A replica may not have a contact that was just created yet, so an ID that
+    is missing from a replica is not remembered as missing.
+    """
+    return not isinstance(db, ReplicaSession)
 
 
-def get_contact_or_404(db: Session, email_id) -> ContactSchema:
+def get_contact_cache() -> Optional[ContactCache]:
+    """Return the contact cache, or None if caching is disabled."""
+    return contact_cache
+
+
+def get_identity_cache() -> Optional[IdentityCache]:
+    """Return the alternate ID cache, or None if caching is disabled."""
+    return identity_cache
+
+
+def make_etag(update_timestamp: datetime) -> str:
+    """Return a strong ETag for a contact, from its latest update_timestamp."""
+    return f'"{update_timestamp.isoformat()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Return True if an If-None-Match header includes the ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def get_contact(
+    db: Session, email_id, cache: Optional[ContactCache] = None
+) -> Optional[ContactSchema]:
+    """
+    Get a contact by email_ID, or None if not found.
+
+    If a cache is passed, it is checked first, and filled on a miss.
+    Unknown email_ids are remembered as well, if read from the primary.
+    """
+    if cache:
+        contact = cache.get(email_id)
+        if contact:
+            return contact
+        if cache.is_missing(email_id):
+            return None
+    data = get_contact_by_email_id(db, email_id)
+    if data is None:
+        if cache and reads_primary(db):
+            cache.set_missing(email_id)
+        return None
+    with timed("validate"):
+        contact = ContactSchema(**data)
+    if cache:
+        cache.set(email_id, contact, make_etag(data["update_timestamp"]))
+    return contact
+
+
+def get_contact_if_changed(
+    db: Session,
+    email_id,
+    if_none_match: Optional[str],
+    cache: Optional[ContactCache] = None,
+) -> Tuple[Optional[ContactSchema], str]:
     """
-    Get a contact by email_ID, or raise a 404 exception.
+    Get a contact and its ETag by email_ID, or raise a 404 exception.
 
+    If the If-None-Match header has the current ETag, the contact is not
+    loaded, and None is returned with the ETag. The ETag is checked with a
+    cheap query on the update timestamps before the full contact is loaded.
     """
+    if cache:
+        entry = cache.get_entry(email_id)
+        if entry and entry[1]:
+            contact, etag = entry
+            return (None if etag_matches(if_none_match, etag) else contact), etag
+        if cache.is_missing(email_id):
+            raise HTTPException(status_code=404, detail="Unknown email_id")
+    if if_none_match:
+        update_timestamp = get_contact_update_timestamp(db, email_id)
+        if update_timestamp is None:
+            if cache and reads_primary(db):
+                cache.set_missing(email_id)
+            raise HTTPException(status_code=404, detail="Unknown email_id")
+        etag = make_etag(update_timestamp)
+        if etag_matches(if_none_match, etag):
+            return None, etag
     data = get_contact_by_email_id(db, email_id)
     if data is None:
+        if cache and reads_primary(db):
+            cache.set_missing(email_id)
+        raise HTTPException(status_code=404, detail="Unknown email_id")
+    with timed("validate"):
+        contact = ContactSchema(**data)
+    etag = make_etag(data["update_timestamp"])
+    if cache:
+        cache.set(email_id, contact, etag)
+    return contact, etag
+
+
+def ctms_response(contact: ContactSchema) -> CTMSResponse:
+    """
+    Convert a contact to a CTMSResponse, with empty groups filled in.
+
+    The contact's groups are already validated, so they are not checked again.
+    """
+    return CTMSResponse.construct(
+        amo=contact.amo or AddOnsSchema(),
+        email=contact.email or EmailSchema(),
+        fxa=contact.fxa or FirefoxAccountsSchema(),
+        newsletters=contact.newsletters or [],
+        vpn_waitlist=contact.vpn_waitlist or VpnWaitlistSchema(),
+        status="ok",
+    )
+
+
+def json_response(model: BaseModel, **kwargs) -> Response:
+    """
+    Return a JSON response for a model built from trusted data.
+
+    When an endpoint returns a model, FastAPI validates it again against the
+    response_model, then converts it with jsonable_encoder before encoding.
+    Models built from database rows or the cache are already valid, so they
+    are encoded directly, in the same compact form as a JSONResponse. The
+    response_model still documents the endpoint.
+    """
+    with timed("serialize"):
+        content = model.json(ensure_ascii=False, separators=(",", ":"))
+    return Response(content=content, media_type="application/json", **kwargs)
+
+
+def encode_cursor(email_id: UUID4) -> str:
+    """Encode an email_id as an opaque pagination cursor."""
+    return urlsafe_b64encode(str(email_id).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> UUID:
+    """Decode a pagination cursor, or raise a 400 exception."""
+    try:
+        return UUID(urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def get_subgroup_or_404(
+    db: Session,
+    email_id,
+    get_subgroup,
+    default,
+    cache: Optional[ContactCache] = None,
+    group: str = "",
+):
+    """
+    Get one group of contact data by email_ID, or raise a 404 exception.
+
+    A cached contact is used if available. Otherwise, only the group's table
+    is queried. If the contact has no data in the group, a cheap check on
+    emails decides between the empty default and a 404.
+    """
+    if cache:
+        contact = cache.get(email_id)
+        if contact:
+            return getattr(contact, group) or default
+        if cache.is_missing(email_id):
+            raise HTTPException(status_code=404, detail="Unknown email_id")
+    subgroup = get_subgroup(db, email_id)
+    if subgroup is not None:
+        return subgroup
+    if not email_id_exists(db, email_id):
+        if cache and reads_primary(db):
+            cache.set_missing(email_id)
+        raise HTTPException(status_code=404, detail="Unknown email_id")
+    return default
+
+
+def get_email_or_404(db: Session, email_id, cache: Optional[ContactCache] = None):
+    """Get a contact's main details by email_ID, or raise a 404 exception."""
+    if cache:
+        contact = cache.get(email_id)
+        if contact:
+            return contact.email
+        if cache.is_missing(email_id):
+            raise HTTPException(status_code=404, detail="Unknown email_id")
+    email = get_email_by_email_id(db, email_id)
+    if email is None:
+        if cache and reads_primary(db):
+            cache.set_missing(email_id)
+        raise HTTPException(status_code=404, detail="Unknown email_id")
+    return email
+
+
+def create_contact_or_409(
+    db: Session,
+    contact: ContactInSchema,
+    cache: Optional[ContactCache] = None,
+    identity_cache: Optional[IdentityCache] = None,
+    writes: Optional[RecentWrites] = None,
+) -> None:
+    """
+    Create a contact, or raise a 409 exception if it already exists.
+
+    A retry of an earlier create, with the same data, is not a conflict.
+    """
+    email_id = contact.email.email_id
+    try:
+        created = create_contacts_bulk(db, [contact])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        if isinstance(e, IntegrityError):
+            raise HTTPException(status_code=409, detail="Contact already exists")
+        else:
+            raise
+    if not created:
+        # A conflict, which is OK if this is a retry of an earlier create
+        existing = get_contact_by_email_id(db, email_id)
+        if existing and ContactInSchema(**existing).idempotent_equal(contact):
+            return
+        raise HTTPException(status_code=409, detail="Contact already exists")
+    if writes:
+        writes.add(email_id)
+        writes.add_identities(contact)
+    if cache:
+        cache.invalidate(email_id)
+    if identity_cache:
+        identity_cache.invalidate(contact)
+
+
+def update_contact_or_404(
+    db: Session,
+    email_id,
+    patch: ContactPatchSchema,
+    cache: Optional[ContactCache] = None,
+    identity_cache: Optional[IdentityCache] = None,
+    writes: Optional[RecentWrites] = None,
+) -> Tuple[ContactSchema, str]:
+    """
+    Update a contact, and return it with its new ETag.
+
+    A 404 exception is raised for an unknown email_id, and a 409 exception if
+    the update conflicts with another contact.
+    """
+    try:
+        found = update_contact(db, email_id, patch)
+        if found:
+            db.commit()
+        else:
+            db.rollback()
+    except Exception as e:
+        db.rollback()
+        if isinstance(e, IntegrityError):
+            detail = "Contact conflicts with an existing contact"
+            raise HTTPException(status_code=409, detail=detail)
+        else:
+            raise
+    if not found:
         raise HTTPException(status_code=404, detail="Unknown email_id")
-    return ContactSchema(**data)
+    if writes:
+        writes.add(email_id)
+    if cache:
+        cache.invalidate(email_id)
+    if identity_cache:
+        identity_cache.invalidate(patch)
+    contact, etag = get_contact_if_changed(db, email_id, None, cache)
+    if writes:
+        writes.add_identities(contact)
+    return contact, etag
+
+
+def create_new_contacts(
+    db: Session,
+    contacts: List[ContactInSchema],
+    cache: Optional[ContactCache] = None,
+    identity_cache: Optional[IdentityCache] = None,
+    writes: Optional[RecentWrites] = None,
+) -> Set[UUID4]:
+    """Create the contacts that don't already exist, and return their email_ids."""
+    try:
+        created = set(create_contacts_bulk(db, contacts))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if writes:
+        writes.add(*created)
+        for contact in contacts:
+            if contact.email.email_id in created:
+                writes.add_identities(contact)
+    if cache and created:
+        cache.invalidate(*created)
+    if identity_cache:
+        for contact in contacts:
+            if contact.email.email_id in created:
+                identity_cache.invalidate(contact)
+    return created
 
 
 def all_ids(
@@ -119,11 +614,57 @@ def get_contacts_by_ids(
         fxa_id,
         fxa_primary_email,
     )
-    return [ContactSchema(**data) for data in rows]
+    with timed("validate"):
+        return [ContactSchema(**data) for data in rows]
+
+
+def get_contacts_by_ids_cached(
+    db: Session,
+    ids: dict,
+    identity_cache: Optional[IdentityCache] = None,
+    contact_cache: Optional[ContactCache] = None,
+) -> List[ContactSchema]:
+    """Get contacts by any ID, using the caches for a single unique ID.
+
+    A cached alternate ID is resolved by fetching the contact by email_id,
+    and is only trusted if that contact still has the alternate ID. A lookup
+    that finds exactly one contact is added to the caches, and a lookup on the
+    primary that finds none is remembered as missing.
+    """
+    given = {name: value for name, value in ids.items() if value is not None}
+    if not identity_cache or len(given) != 1:
+        return get_contacts_by_ids(db, **ids)
+    ((id_type, value),) = given.items()
+    if id_type == "email_id":
+        contact = get_contact(db, value, contact_cache)
+        return [contact] if contact else []
+    if id_type not in IdentityCache.ID_TYPES:
+        # A cached email_id would hide contacts given a shared ID later
+        return get_contacts_by_ids(db, **ids)
+
+    if identity_cache.is_missing(id_type, value):
+        return []
+    email_id = identity_cache.get(id_type, value)
+    if email_id:
+        contact = get_contact(db, email_id, contact_cache)
+        if contact:
+            current = getattr(contact.as_identity_response(), id_type)
+            if current is not None and str(current) == str(value):
+                return [contact]
+
+    contacts = get_contacts_by_ids(db, **ids)
+    if len(contacts) == 1:
+        contact = contacts[0]
+        identity_cache.set(id_type, value, contact.email.email_id)
+        if contact_cache:
+            contact_cache.set(contact.email.email_id, contact)
+    elif not contacts and reads_primary(db):
+        identity_cache.set_missing(id_type, value)
+    return contacts
 
 
 @app.get("/", include_in_schema=False)
-def root():
+async def root():
     """GET via root redirects to /docs.
 
     - Args:
@@ -135,6 +676,37 @@ def root():
     return RedirectResponse(url="./docs")
 
 
+def has_recent_id(writes: RecentWrites, ids: dict) -> bool:
+    """Return True if any of the IDs belongs to a contact that was just written."""
+    return any(
+        writes.is_recent(value)
+        if id_type == "email_id"
+        else writes.is_recent_identity(id_type, value)
+        for id_type, value in ids.items()
+        if value is not None
+    )
+
+
+async def get_ids_read_db(
+    ids=Depends(all_ids),
+    primary: Session = Depends(get_db),
+    replicas: Optional[ReplicaPool] = Depends(get_replicas),
+    writes: Optional[RecentWrites] = Depends(get_recent_writes),
+):
+    """
+    Return a session for reading contacts by any ID.
+
+    If any of the IDs belongs to a contact that was just written, the contacts
+    are read from the primary, as with get_contact_read_db.
+    """
+    recent = writes is not None and await run_in_threadpool(has_recent_id, writes, ids)
+    if recent:
+        yield primary
+        return
+    async with read_session(primary, replicas) as db:
+        yield db
+
+
 @app.get(
     "/ctms",
     summary="Get all contacts matching alternate IDs",
@@ -142,13 +714,20 @@ def root():
     responses={400: {"model": BadRequestResponse}},
     tags=["Public"],
 )
-def read_ctms_by_any_id(db: Session = Depends(get_db), ids=Depends(all_ids)):
+async def read_ctms_by_any_id(
+    db: Session = Depends(get_ids_read_db),
+    ids=Depends(all_ids),
+    identity_cache: Optional[IdentityCache] = Depends(get_identity_cache),
+    contact_cache: Optional[ContactCache] = Depends(get_contact_cache),
+):
     if not any(ids.values()):
         detail = (
             f"No identifiers provided, at least one is needed: {', '.join(ids.keys())}"
         )
         raise HTTPException(status_code=400, detail=detail)
-    contacts = get_contacts_by_ids(db, **ids)
+    contacts = await run_db(
+        db, get_contacts_by_ids_cached, ids, identity_cache, contact_cache
+    )
     return [
         ContactSchema(
             amo=contact.amo or AddOnsSchema(),
@@ -168,45 +747,194 @@ def read_ctms_by_any_id(db: Session = Depends(get_db), ids=Depends(all_ids)):
     responses={404: {"model": NotFoundResponse}},
     tags=["Public"],
 )
-def read_ctms_by_email_id(
-    email_id: UUID = Path(..., title="The Email ID"), db: Session = Depends(get_db)
+async def read_ctms_by_email_id(
+    email_id: UUID = Path(..., title="The Email ID"),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_contact_read_db),
+    cache: Optional[ContactCache] = Depends(get_contact_cache),
 ):
-    contact = get_contact_or_404(db, email_id)
-    return CTMSResponse(
-        amo=contact.amo or AddOnsSchema(),
-        email=contact.email or EmailSchema(),
-        fxa=contact.fxa or FirefoxAccountsSchema(),
-        newsletters=contact.newsletters or [],
-        vpn_waitlist=contact.vpn_waitlist or VpnWaitlistSchema(),
-        status="ok",
+    contact, etag = await run_db(
+        db, get_contact_if_changed, email_id, if_none_match, cache
     )
+    if contact is None:
+        return Response(status_code=304, headers={"ETag": etag})
+    return json_response(ctms_response(contact), headers={"ETag": etag})
+
+
+@app.post(
+    "/ctms/batch",
+    summary="Get several contacts by email_id",
+    response_model=CTMSBatchResponse,
+    responses={400: {"model": BadRequestResponse}},
+    tags=["Public"],
+)
+async def read_ctms_batch(
+    batch: CTMSBatchRequest,
+    db: Session = Depends(get_read_db),
+    settings: config.Settings = Depends(get_settings),
+):
+    email_ids = list(dict.fromkeys(batch.email_ids))
+    if len(email_ids) > settings.batch_lookup_max:
+        detail = (
+            f"Too many email_ids, the limit is {settings.batch_lookup_max}"
+            f" but {len(email_ids)} were requested"
+        )
+        raise HTTPException(status_code=400, detail=detail)
+    rows = await run_db(db, get_contacts_by_email_ids, email_ids)
+    with timed("validate"):
+        found = {
+            str(data["email"].email_id): ctms_response(ContactSchema(**data))
+            for data in rows
+        }
+    missing = [email_id for email_id in email_ids if str(email_id) not in found]
+    return json_response(CTMSBatchResponse.construct(contacts=found, missing=missing))
 
 
 @app.post(
     "/ctms",
     summary="Create a contact, generating an id",
 )
-def create_ctms_contact(
+async def create_ctms_contact(
     contact: ContactInSchema,
     db: Session = Depends(get_db),
+    cache: Optional[ContactCache] = Depends(get_contact_cache),
+    identity_cache: Optional[IdentityCache] = Depends(get_identity_cache),
+    writes: Optional[RecentWrites] = Depends(get_recent_writes),
 ):
     contact.email.email_id = contact.email.email_id or uuid4()
-    email_id = contact.email.email_id
-    existing = get_contact_by_email_id(db, email_id)
-    if existing:
-        if ContactInSchema(**existing) == contact:
-            return
-        else:
-            raise HTTPException(status_code=409, detail="Contact already exists")
-    try:
-        create_contact(db, email_id, contact)
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        if isinstance(e, IntegrityError):
-            raise HTTPException(status_code=409, detail="Contact already exists")
+    await run_db(db, create_contact_or_409, contact, cache, identity_cache, writes)
+
+
+@app.patch(
+    "/ctms/{email_id}",
+    summary="Update a contact, changing only the fields that are set",
+    response_model=CTMSResponse,
+    responses={404: {"model": NotFoundResponse}},
+    tags=["Public"],
+)
+async def partial_update_ctms_contact(
+    patch: ContactPatchSchema,
+    email_id: UUID = Path(..., title="The Email ID"),
+    db: Session = Depends(get_db),
+    cache: Optional[ContactCache] = Depends(get_contact_cache),
+    identity_cache: Optional[IdentityCache] = Depends(get_identity_cache),
+    writes: Optional[RecentWrites] = Depends(get_recent_writes),
+):
+    contact, etag = await run_db(
+        db, update_contact_or_404, email_id, patch, cache, identity_cache, writes
+    )
+    return json_response(ctms_response(contact), headers={"ETag": etag})
+
+
+@app.post(
+    "/ctms/bulk",
+    summary="Create several contacts, generating ids as needed",
+    response_model=CTMSBulkResponse,
+    responses={400: {"model": BadRequestResponse}},
+)
+async def create_ctms_contacts_bulk(
+    contacts: List[ContactInSchema],
+    db: Session = Depends(get_db),
+    settings: config.Settings = Depends(get_settings),
+    cache: Optional[ContactCache] = Depends(get_contact_cache),
+    identity_cache: Optional[IdentityCache] = Depends(get_identity_cache),
+    writes: Optional[RecentWrites] = Depends(get_recent_writes),
+):
+    if len(contacts) > settings.bulk_create_max:
+        detail = (
+            f"Too many contacts, the limit is {settings.bulk_create_max}"
+            f" but {len(contacts)} were sent"
+        )
+        raise HTTPException(status_code=400, detail=detail)
+    for contact in contacts:
+        contact.email.email_id = contact.email.email_id or uuid4()
+    created = await run_db(
+        db, create_new_contacts, contacts, cache, identity_cache, writes
+    )
+    results = []
+    for contact in contacts:
+        email_id = contact.email.email_id
+        if email_id in created:
+            results.append(CTMSBulkResult(email_id=email_id, status="created"))
+            created.remove(email_id)  # Later duplicates are conflicts
         else:
-            raise
+            results.append(CTMSBulkResult(email_id=email_id, status="conflict"))
+    return CTMSBulkResponse(results=results)
+
+
+@app.get(
+    "/updates",
+    summary="Get contacts changed since a timestamp",
+    response_model=UpdatesResponse,
+    responses={400: {"model": BadRequestResponse}},
+    tags=["Public"],
+)
+async def read_updates(
+    since: datetime = Query(..., description="Return contacts changed at or after"),
+    after: Optional[UUID] = Query(
+        None, description="With since, skip contacts up to this email_id"
+    ),
+    limit: int = Query(100, ge=1, description="Maximum number of contacts"),
+    full: bool = Query(False, description="Include the full contacts"),
+    db: Session = Depends(get_read_db),
+    settings: config.Settings = Depends(get_settings),
+):
+    if limit > settings.updates_max:
+        detail = f"limit is too large, the maximum is {settings.updates_max}"
+        raise HTTPException(status_code=400, detail=detail)
+    changes = await run_db(db, get_contact_updates, since, after, limit)
+    contacts = {}
+    if full and changes:
+        email_ids = [email_id for email_id, _ in changes]
+        rows = await run_db(db, get_contacts_by_email_ids, email_ids)
+        with timed("validate"):
+            contacts = {
+                data["email"].email_id: ctms_response(ContactSchema(**data))
+                for data in rows
+            }
+    updates = [
+        ContactUpdate.construct(
+            email_id=email_id,
+            update_timestamp=update_timestamp,
+            contact=contacts.get(email_id),
+        )
+        for email_id, update_timestamp in changes
+    ]
+    if updates:
+        next_since, next_after = updates[-1].update_timestamp, updates[-1].email_id
+    else:
+        next_since, next_after = since, after
+    return json_response(
+        UpdatesResponse.construct(
+            updates=updates, next_since=next_since, next_after=next_after
+        )
+    )
+
+
+@app.get(
+    "/newsletters/{name}/subscribers",
+    summary="Get the contacts subscribed to a newsletter",
+    response_model=NewsletterSubscribersResponse,
+    responses={400: {"model": BadRequestResponse}},
+    tags=["Public"],
+)
+async def read_newsletter_subscribers(
+    name: str = Path(..., title="The newsletter slug"),
+    subscribed: bool = Query(True, description="False for former subscribers"),
+    cursor: Optional[str] = Query(None, description="next_cursor of previous page"),
+    limit: int = Query(100, ge=1, description="Maximum number of contacts"),
+    db: Session = Depends(get_read_db),
+    settings: config.Settings = Depends(get_settings),
+):
+    if limit > settings.subscribers_max:
+        detail = f"limit is too large, the maximum is {settings.subscribers_max}"
+        raise HTTPException(status_code=400, detail=detail)
+    after = decode_cursor(cursor) if cursor else None
+    email_ids = await run_db(
+        db, get_newsletter_subscribers, name, subscribed, after, limit
+    )
+    next_cursor = encode_cursor(email_ids[-1]) if len(email_ids) == limit else None
+    return NewsletterSubscribersResponse(email_ids=email_ids, next_cursor=next_cursor)
 
 
 @app.get(
@@ -216,13 +944,20 @@ def create_ctms_contact(
     responses={400: {"model": BadRequestResponse}},
     tags=["Private"],
 )
-def read_identities(db: Session = Depends(get_db), ids=Depends(all_ids)):
+async def read_identities(
+    db: Session = Depends(get_ids_read_db),
+    ids=Depends(all_ids),
+    identity_cache: Optional[IdentityCache] = Depends(get_identity_cache),
+    contact_cache: Optional[ContactCache] = Depends(get_contact_cache),
+):
     if not any(ids.values()):
         detail = (
             f"No identifiers provided, at least one is needed: {', '.join(ids.keys())}"
         )
         raise HTTPException(status_code=400, detail=detail)
-    contacts = get_contacts_by_ids(db, **ids)
+    contacts = await run_db(
+        db, get_contacts_by_ids_cached, ids, identity_cache, contact_cache
+    )
     return [contact.as_identity_response() for contact in contacts]
 
 
@@ -233,11 +968,18 @@ def read_identities(db: Session = Depends(get_db), ids=Depends(all_ids)):
     responses={404: {"model": NotFoundResponse}},
     tags=["Private"],
 )
-def read_identity(
-    email_id: UUID = Path(..., title="The email ID"), db: Session = Depends(get_db)
+async def read_identity(
+    email_id: UUID = Path(..., title="The email ID"),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_contact_read_db),
+    cache: Optional[ContactCache] = Depends(get_contact_cache),
 ):
-    contact = get_contact_or_404(db, email_id)
-    return contact.as_identity_response()
+    contact, etag = await run_db(
+        db, get_contact_if_changed, email_id, if_none_match, cache
+    )
+    if contact is None:
+        return Response(status_code=304, headers={"ETag": etag})
+    return json_response(contact.as_identity_response(), headers={"ETag": etag})
 
 
 @app.get(
@@ -247,11 +989,12 @@ def read_identity(
     responses={404: {"model": NotFoundResponse}},
     tags=["Private"],
 )
-def read_contact_main(
-    email_id: UUID = Path(..., title="The email ID"), db: Session = Depends(get_db)
+async def read_contact_main(
+    email_id: UUID = Path(..., title="The email ID"),
+    db: Session = Depends(get_contact_read_db),
+    cache: Optional[ContactCache] = Depends(get_contact_cache),
 ):
-    contact = get_contact_or_404(db, email_id)
-    return contact.email
+    return await run_db(db, get_email_or_404, email_id, cache)
 
 
 @app.get(
@@ -261,11 +1004,20 @@ def read_contact_main(
     responses={404: {"model": NotFoundResponse}},
     tags=["Private"],
 )
-def read_contact_amo(
-    email_id: UUID = Path(..., title="The email ID"), db: Session = Depends(get_db)
+async def read_contact_amo(
+    email_id: UUID = Path(..., title="The email ID"),
+    db: Session = Depends(get_contact_read_db),
+    cache: Optional[ContactCache] = Depends(get_contact_cache),
 ):
-    contact = get_contact_or_404(db, email_id)
-    return contact.amo or AddOnsSchema()
+    return await run_db(
+        db,
+        get_subgroup_or_404,
+        email_id,
+        get_amo_by_email_id,
+        AddOnsSchema(),
+        cache,
+        "amo",
+    )
 
 
 @app.get(
@@ -275,11 +1027,20 @@ def read_contact_amo(
     responses={404: {"model": NotFoundResponse}},
     tags=["Private"],
 )
-def read_contact_fpn(
-    email_id: UUID = Path(..., title="The email ID"), db: Session = Depends(get_db)
+async def read_contact_fpn(
+    email_id: UUID = Path(..., title="The email ID"),
+    db: Session = Depends(get_contact_read_db),
+    cache: Optional[ContactCache] = Depends(get_contact_cache),
 ):
-    contact = get_contact_or_404(db, email_id)
-    return contact.vpn_waitlist or VpnWaitlistSchema()
+    return await run_db(
+        db,
+        get_subgroup_or_404,
+        email_id,
+        get_vpn_waitlist_by_email_id,
+        VpnWaitlistSchema(),
+        cache,
+        "vpn_waitlist",
+    )
 
 
 @app.get(
@@ -289,19 +1050,88 @@ def read_contact_fpn(
     responses={404: {"model": NotFoundResponse}},
     tags=["Private"],
 )
-def read_contact_fxa(
-    email_id: UUID = Path(..., title="The email ID"), db: Session = Depends(get_db)
+async def read_contact_fxa(
+    email_id: UUID = Path(..., title="The email ID"),
+    db: Session = Depends(get_contact_read_db),
+    cache: Optional[ContactCache] = Depends(get_contact_cache),
 ):
-    contact = get_contact_or_404(db, email_id)
-    return contact.fxa or FirefoxAccountsSchema()
+    return await run_db(
+        db,
+        get_subgroup_or_404,
+        email_id,
+        get_fxa_by_email_id,
+        FirefoxAccountsSchema(),
+        cache,
+        "fxa",
+    )
+
+
+@app.get(
+    "/export",
+    summary="Export all contacts as newline-delimited JSON",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    tags=["Private"],
+)
+async def export_contacts(
+    db: Session = Depends(get_read_db),
+    settings: config.Settings = Depends(get_settings),
+):
+    """
+    Stream every contact, one ContactSchema JSON document per line.
+
+    The lines are read in the threadpool, or in chunks in async mode.
+    """
+    chunk_size = settings.export_chunk_size
+    sync_db = db.sync_session if isinstance(db, AsyncSession) else db
+    lines = (
+        ContactSchema(**data).json() + "\n"
+        for data in get_all_contacts(sync_db, chunk_size)
+    )
+    if isinstance(db, AsyncSession):
+        content = iterate_in_session(db, lines, chunk_size)
+        return StreamingResponse(content, media_type="application/x-ndjson")
+    return StreamingResponse(lines, media_type="application/x-ndjson")
 
 
 # NOTE:  This endpoint should provide a better proxy of "health".  It presently is a
 # better proxy for application availability as opposed to health.
 @app.get("/health", tags=["Platform"])
-def health():
+async def health():
     return {"health": "OK"}, 200
 
 
+@app.get("/pool", tags=["Platform"])
+async def pool():
+    """Return the database connection pool usage for this worker."""
+    status = get_pool_status(engine)
+    if replica_pool:
+        status["replicas"] = replica_pool.status()
+    return status
+
+
+@app.get("/metrics", tags=["Platform"])
+def metrics():
+    """Return the Prometheus metrics, for all workers if multi-process."""
+    update_pool_metrics(force=True)
+    return Response(
+        generate_latest(get_metrics_registry()), media_type=CONTENT_TYPE_LATEST
+    )
+
+
+@app.get("/cache", tags=["Platform"])
+async def cache_status():
+    """Return the cache counters for this worker, if enabled."""
+    if not identity_cache:
+        return {}
+    stats = {}
+    if contact_cache:
+        stats["contact"] = contact_cache.stats()
+    stats["identity"] = identity_cache.stats()
+    if identity_cache.negative_backend:
+        stats["missing"] = identity_cache.negative_backend.stats()
+    return stats
+
+
 if __name__ == "__main__":
     uvicorn.run("app:app", host="0.0.0.0", port=80, reload=True)
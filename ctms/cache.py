@@ -0,0 +1,315 @@
+"""Caches for contact data, in process or in a shared Redis server."""
+import json
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+
+from pydantic import UUID4
+
+from .schemas import ContactSchema
+from .timing import timed
+
+# Values of the keys in a negative backend. A write sets EXISTS, and a read
+# that doesn't find the ID only sets MISSING if the key is not set.
+MISSING = "missing"
+EXISTS = "exists"
+
+
+class MemoryCache:
+    """
+    A least-recently-used cache in process memory, with a time to live.
+
+    Values are strings. Once max_size keys are stored, the least recently
+    used key is evicted for each new one. The cache is shared by the
+    threads running the endpoints, so access is serialized with a lock.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires, value = item
+            if expires <= monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._set(key, value)
+
+    def add(self, key: str, value: str) -> None:
+        """Set the key only if it is not set."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= monotonic():
+                self._set(key, value)
+
+    def _set(self, key: str, value: str) -> None:
+        self._data[key] = (monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class RedisCache:
+    """
+    A cache in a Redis server, shared by all workers.
+
+    The client only needs the get, set (with ex and nx) and delete methods
+    of redis.Redis, so a local fake can stand in for tests. Redis handles
+    the time to live and the eviction policy, so evictions are not counted.
+    """
+
+    def __init__(self, client, ttl: int, prefix: str = "ctms:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_url(cls, url: str, ttl: int) -> "RedisCache":
+        import redis
+
+        return cls(redis.Redis.from_url(url), ttl)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key: str, value: str) -> None:
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def add(self, key: str, value: str) -> None:
+        """Set the key only if it is not set, in one atomic command."""
+        self.client.set(self.prefix + key, value, ex=self.ttl, nx=True)
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class ContactCache:
+    """
+    Contacts by email_id, stored as ContactSchema JSON in a cache backend.
+
+    The contact's ETag can be stored with it, so the two are always consistent.
+    If a negative backend is passed, unknown email_ids can be remembered as
+    well, usually with a shorter time to live. A write replaces the missing
+    marker with an exists marker, which a read that missed the contact before
+    the write can't overwrite.
+    """
+
+    def __init__(self, backend, negative_backend=None):
+        self.backend = backend
+        self.negative_backend = negative_backend
+
+    @staticmethod
+    def _key(email_id: UUID4) -> str:
+        return f"contact:{email_id}"
+
+    @staticmethod
+    def _missing_key(email_id: UUID4) -> str:
+        return f"missing:contact:{email_id}"
+
+    def get_entry(
+        self, email_id: UUID4
+    ) -> Optional[Tuple[ContactSchema, Optional[str]]]:
+        """Return the cached contact and its ETag, if any."""
+        value = self.backend.get(self._key(email_id))
+        if value is None:
+            return None
+        with timed("validate"):
+            data = json.loads(value)
+            return ContactSchema.parse_obj(data["contact"]), data["etag"]
+
+    def get(self, email_id: UUID4) -> Optional[ContactSchema]:
+        entry = self.get_entry(email_id)
+        return None if entry is None else entry[0]
+
+    def set(
+        self, email_id: UUID4, contact: ContactSchema, etag: Optional[str] = None
+    ) -> None:
+        value = f'{{"etag": {json.dumps(etag)}, "contact": {contact.json()}}}'
+        self.backend.set(self._key(email_id), value)
+
+    def is_missing(self, email_id: UUID4) -> bool:
+        """Return True if the email_id was recently not found."""
+        if self.negative_backend is None:
+            return False
+        return self.negative_backend.get(self._missing_key(email_id)) == MISSING
+
+    def set_missing(self, email_id: UUID4) -> None:
+        """Remember that the email_id was not found, unless it was just written."""
+        if self.negative_backend is not None:
+            self.negative_backend.add(self._missing_key(email_id), MISSING)
+
+    def invalidate(self, *email_ids: UUID4) -> None:
+        self.backend.delete(*(self._key(email_id) for email_id in email_ids))
+        if self.negative_backend is not None:
+            for email_id in email_ids:
+                self.negative_backend.set(self._missing_key(email_id), EXISTS)
+
+    def stats(self) -> Dict[str, int]:
+        return self.backend.stats()
+
+
+def contact_identities(contact) -> Dict[str, Any]:
+    """
+    Return the alternate IDs that are set on a contact.
+
+    The contact can be a ContactSchema, ContactInSchema or ContactPatchSchema.
+    """
+    identities = {
+        "primary_email": getattr(contact.email, "primary_email", None),
+        "basket_token": getattr(contact.email, "basket_token", None),
+        "sfdc_id": getattr(contact.email, "sfdc_id", None),
+        "mofo_id": getattr(contact.email, "mofo_id", None),
+        "amo_user_id": getattr(contact.amo, "user_id", None),
+        "fxa_id": getattr(contact.fxa, "fxa_id", None),
+        "fxa_primary_email": getattr(contact.fxa, "primary_email", None),
+    }
+    return {id_type: value for id_type, value in identities.items() if value}
+
+
+class IdentityCache:
+    """
+    The email_id for a unique alternate ID, like a basket_token or an fxa_id.
+
+    These mappings rarely change, so they can be cached longer than contacts.
+    Callers should check that the contact still has the alternate ID, since
+    an ID that moves to a different contact may be stale until invalidated.
+    Other alternate IDs, like the mofo_id, can be shared by several contacts,
+    and are not cached.
+    """
+
+    ID_TYPES = ("primary_email", "basket_token", "fxa_id")
+
+    def __init__(self, backend, negative_backend=None):
+        self.backend = backend
+        self.negative_backend = negative_backend
+
+    @staticmethod
+    def _key(id_type: str, value: Any) -> str:
+        return f"identity:{id_type}:{value}"
+
+    @staticmethod
+    def _missing_key(id_type: str, value: Any) -> str:
+        return f"missing:identity:{id_type}:{value}"
+
+    def get(self, id_type: str, value: Any) -> Optional[UUID]:
+        email_id = self.backend.get(self._key(id_type, value))
+        return None if email_id is None else UUID(email_id)
+
+    def set(self, id_type: str, value: Any, email_id: UUID4) -> None:
+        self.backend.set(self._key(id_type, value), str(email_id))
+
+    def is_missing(self, id_type: str, value: Any) -> bool:
+        """Return True if no contact had the alternate ID recently."""
+        if self.negative_backend is None:
+            return False
+        key = self._missing_key(id_type, value)
+        return self.negative_backend.get(key) == MISSING
+
+    def set_missing(self, id_type: str, value: Any) -> None:
+        """Remember that no contact has the ID, unless one was just written."""
+        if self.negative_backend is not None:
+            self.negative_backend.add(self._missing_key(id_type, value), MISSING)
+
+    def invalidate(self, contact) -> None:
+        """Remove the alternate IDs of a contact."""
+        given = [
+            (id_type, value)
+            for id_type, value in contact_identities(contact).items()
+            if id_type in self.ID_TYPES
+        ]
+        self.backend.delete(*(self._key(*identity) for identity in given))
+        if self.negative_backend is not None:
+            for identity in given:
+                self.negative_backend.set(self._missing_key(*identity), EXISTS)
+
+    def stats(self) -> Dict[str, int]:
+        return self.backend.stats()
+
+
+class RecentWrites:
+    """
+    The contacts written recently, which should be read from the primary.
+
+    Contacts are tracked by email_id and by their alternate IDs, so that
+    lookups by either see the write. With the memory backend, each worker
+    only knows its own writes. The Redis backend shares them between workers.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def _key(email_id: UUID4) -> str:
+        return f"written:{email_id}"
+
+    @staticmethod
+    def _identity_key(id_type: str, value: Any) -> str:
+        return f"written:identity:{id_type}:{value}"
+
+    def add(self, *email_ids: UUID4) -> None:
+        for email_id in email_ids:
+            self.backend.set(self._key(email_id), "1")
+
+    def add_identities(self, contact) -> None:
+        """Add the alternate IDs of a contact that was written."""
+        for id_type, value in contact_identities(contact).items():
+            self.backend.set(self._identity_key(id_type, value), "1")
+
+    def is_recent(self, email_id: UUID4) -> bool:
+        return self.backend.get(self._key(email_id)) is not None
+
+    def is_recent_identity(self, id_type: str, value: Any) -> bool:
+        return self.backend.get(self._identity_key(id_type, value)) is not None
+
+
+def get_cache_backend(settings, size: int, ttl: int):
+    """Return the cache backend selected by the settings, or None if disabled."""
+    if settings.cache_backend == "memory":
+        return MemoryCache(size, ttl)
+    if settings.cache_backend == "redis":
+        return RedisCache.from_url(settings.cache_url, ttl)
+    return None
@@ -1,8 +1,34 @@
+from typing import List, Optional
+
 from pydantic import BaseSettings, PostgresDsn
 
 
 class Settings(BaseSettings):
     db_url: PostgresDsn
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30  # Seconds to wait for a pooled connection
+    db_pool_recycle: int = -1  # Seconds until a connection is replaced
+    db_pool_pre_ping: bool = False
+    db_connect_timeout: int = 10  # Seconds
+    db_statement_timeout: int = 0  # Milliseconds, 0 to disable
+    db_replica_urls: List[PostgresDsn] = []  # JSON list, like '["postgresql://..."]'
+    db_replica_retry: int = 30  # Seconds before retrying a failed replica
+    db_read_your_writes: int = 5  # Seconds to read a new contact from the primary
+    db_async: bool = False  # Run queries on the event loop with asyncpg
+    server_timing: bool = False  # Add Server-Timing headers and timing logs
+    cache_backend: str = ""  # "memory", "redis", or empty to disable
+    cache_url: Optional[str] = None  # Redis URL, like redis://localhost:6379/0
+    cache_size: int = 10000  # Recent writes per worker, without redis
+    cache_ttl: int = 60  # Seconds
+    identity_cache_size: int = 100000  # Alternate IDs per worker, for memory
+    identity_cache_ttl: int = 3600  # Seconds
+    negative_cache_ttl: int = 10  # Seconds, 0 to disable, redis backend only
+    batch_lookup_max: int = 1000
+    bulk_create_max: int = 1000
+    export_chunk_size: int = 1000
+    updates_max: int = 1000
+    subscribers_max: int = 1000
 
     class Config:
         env_prefix = "ctms_"
@@ -1,12 +1,30 @@
-from typing import Dict, List, Optional
+from collections import defaultdict
+from datetime import datetime
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
 
 from pydantic import UUID4, EmailStr
+from sqlalchemy import (
+    bindparam,
+    exists,
+    func,
+    literal,
+    literal_column,
+    select,
+    tuple_,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
+from sqlalchemy.ext import baked
 from sqlalchemy.orm import Session
 
+from .database import Base
 from .models import AmoAccount, Email, FirefoxAccount, Newsletter, VpnWaitlist
 from .schemas import (
     AddOnsSchema,
     ContactInSchema,
+    ContactPatchSchema,
     ContactSchema,
     EmailInSchema,
     EmailSchema,
@@ -15,34 +33,187 @@ from .schemas import (
     VpnWaitlistSchema,
 )
 
+# Hot queries are built and compiled to SQL once, then reused with new
+# parameters. Each step of a baked query is cached by its code, so the steps
+# must be lambdas or functions that only use bindparam() for values.
+bakery = baked.bakery()
+
 
 def get_email_by_email_id(db: Session, email_id: UUID4):
     return db.query(Email).filter(Email.email_id == email_id).first()
 
 
-def get_contact_by_email_id(db: Session, email_id: UUID4):
-    """Get all the data for a contact."""
-    result = (
-        db.query(Email, AmoAccount, FirefoxAccount, VpnWaitlist)
-        .outerjoin(AmoAccount, Email.email_id == AmoAccount.email_id)
+def email_id_exists(db: Session, email_id: UUID4) -> bool:
+    """Return True if there is a contact with the email_id."""
+    return db.query(exists().where(Email.email_id == email_id)).scalar()
+
+
+def get_amo_by_email_id(db: Session, email_id: UUID4):
+    return db.query(AmoAccount).filter(AmoAccount.email_id == email_id).first()
+
+
+def get_fxa_by_email_id(db: Session, email_id: UUID4):
+    return db.query(FirefoxAccount).filter(FirefoxAccount.email_id == email_id).first()
+
+
+def get_vpn_waitlist_by_email_id(db: Session, email_id: UUID4):
+    return db.query(VpnWaitlist).filter(VpnWaitlist.email_id == email_id).first()
+
+
+def newsletters_as_json(db: Session):
+    """
+    Return a subquery that aggregates a contact's newsletters as a JSON list.
+
+    The subquery is correlated to the Email in the outer query, so a contact
+    and its newsletters are fetched in one round trip. The items are dicts
+    with the fields of NewsletterSchema, ordered by name.
+    """
+    newsletter = func.json_build_object(
+        "name",
+        Newsletter.name,
+        "subscribed",
+        Newsletter.subscribed,
+        "format",
+        Newsletter.format,
+        "lang",
+        Newsletter.lang,
+        "source",
+        Newsletter.source,
+        "unsub_reason",
+        Newsletter.unsub_reason,
+    )
+    return (
+        db.query(
+            func.coalesce(
+                func.json_agg(aggregate_order_by(newsletter, Newsletter.name)),
+                literal_column("'[]'::json"),
+            )
+        )
+        .filter(Newsletter.email_id == Email.email_id)
+        .correlate(Email)
+        .label("newsletters")
+    )
+
+
+def contact_update_timestamp(db: Session):
+    """
+    Return the latest update_timestamp of a contact's rows, across all tables.
+
+    This is for a query that joins the contact tables like contacts_query.
+    The newsletters are checked with a subquery correlated to the Email.
+    """
+    newsletters_updated = (
+        db.query(func.max(Newsletter.update_timestamp))
+        .filter(Newsletter.email_id == Email.email_id)
+        .correlate(Email)
+        .scalar_subquery()
+    )
+    return func.greatest(
+        Email.update_timestamp,
+        AmoAccount.update_timestamp,
+        FirefoxAccount.update_timestamp,
+        VpnWaitlist.update_timestamp,
+        newsletters_updated,
+    ).label("update_timestamp")
+
+
+def join_contact_tables(query):
+    """Add the outer joins from emails to the other contact tables."""
+    return (
+        query.outerjoin(AmoAccount, Email.email_id == AmoAccount.email_id)
         .outerjoin(FirefoxAccount, Email.email_id == FirefoxAccount.email_id)
         .outerjoin(VpnWaitlist, Email.email_id == VpnWaitlist.email_id)
-        .filter(Email.email_id == email_id)
-        .first()
     )
-    if result is None:
-        return None
-    email, amo, fxa, vpn_waitlist = result
-    newsletters = db.query(Newsletter).filter(Newsletter.email_id == email_id).all()
+
+
+def contacts_query(db: Session):
+    """
+    Return a query for contacts, with newsletters aggregated as JSON.
+
+    The latest update_timestamp across the contact's tables is included.
+    """
+    return join_contact_tables(
+        db.query(
+            Email,
+            AmoAccount,
+            FirefoxAccount,
+            VpnWaitlist,
+            newsletters_as_json(db),
+            contact_update_timestamp(db),
+        )
+    )
+
+
+def contact_data(result) -> Dict:
+    """Convert a row from contacts_query to the contact data dict."""
+    email, amo, fxa, vpn_waitlist, newsletters, update_timestamp = result
     return {
         "amo": amo,
         "email": email,
         "fxa": fxa,
         "newsletters": newsletters,
         "vpn_waitlist": vpn_waitlist,
+        "update_timestamp": update_timestamp,
     }
 
 
+def get_contact_by_email_id(db: Session, email_id: UUID4):
+    """Get all the data for a contact, in a single query."""
+    query = bakery(contacts_query)
+    query += lambda q: q.filter(Email.email_id == bindparam("email_id"))
+    result = query(db).params(email_id=email_id).first()
+    if result is None:
+        return None
+    return contact_data(result)
+
+
+def get_contact_update_timestamp(db: Session, email_id: UUID4) -> Optional[datetime]:
+    """
+    Get the latest update_timestamp of a contact, or None if not found.
+
+    This is much cheaper than loading the contact, and changes whenever a
+    row of the contact is added or updated.
+    """
+    query = bakery(
+        lambda session: join_contact_tables(
+            session.query(contact_update_timestamp(session))
+        )
+    )
+    query += lambda q: q.filter(Email.email_id == bindparam("email_id"))
+    result = query(db).params(email_id=email_id).first()
+    return None if result is None else result.update_timestamp
+
+
+def get_contacts_by_email_ids(db: Session, email_ids: List[UUID4]) -> List[Dict]:
+    """Get all the data for several contacts, in a single query."""
+    if not email_ids:
+        return []
+    results = contacts_query(db).filter(Email.email_id.in_(email_ids)).all()
+    return [contact_data(result) for result in results]
+
+
+# Filters for get_contacts_by_any_id, for the baked query
+ALT_ID_FILTERS = {
+    "email_id": lambda q: q.filter(Email.email_id == bindparam("email_id")),
+    "primary_email": lambda q: q.filter(
+        Email.primary_email == bindparam("primary_email")
+    ),
+    "basket_token": lambda q: q.filter(Email.basket_token == bindparam("basket_token")),
+    "sfdc_id": lambda q: q.filter(Email.sfdc_id == bindparam("sfdc_id")),
+    "mofo_id": lambda q: q.filter(Email.mofo_id == bindparam("mofo_id")),
+    "amo_user_id": lambda q: q.filter(AmoAccount.user_id == bindparam("amo_user_id")),
+    "fxa_id": lambda q: q.filter(FirefoxAccount.fxa_id == bindparam("fxa_id")),
+    "fxa_primary_email": lambda q: q.filter(
+        FirefoxAccount.primary_email == bindparam("fxa_primary_email")
+    ),
+}
+
+
+def contacts_by_any_id_query(db: Session):
+    """Return a query for contacts, without newsletters, for ALT_ID_FILTERS."""
+    return join_contact_tables(db.query(Email, AmoAccount, FirefoxAccount, VpnWaitlist))
+
+
 def get_contacts_by_any_id(
     db: Session,
     email_id: Optional[UUID4] = None,
@@ -54,60 +225,61 @@ def get_contacts_by_any_id(
     fxa_id: Optional[str] = None,
     fxa_primary_email: Optional[EmailStr] = None,
 ) -> List[Dict]:
-    """Get all the data for multiple contacts by IDs."""
-    assert any(
-        (
-            email_id,
-            primary_email,
-            basket_token,
-            sfdc_id,
-            mofo_id,
-            amo_user_id,
-            fxa_id,
-            fxa_primary_email,
-        )
-    )
-    statement = (
-        db.query(Email, AmoAccount, FirefoxAccount, VpnWaitlist)
-        .outerjoin(AmoAccount, Email.email_id == AmoAccount.email_id)
-        .outerjoin(FirefoxAccount, Email.email_id == FirefoxAccount.email_id)
-        .outerjoin(VpnWaitlist, Email.email_id == VpnWaitlist.email_id)
+    """Get all the data for multiple contacts by IDs.
+
+    The query is baked, so each combination of IDs is only compiled once.
+    """
+    ids = {
+        "email_id": email_id,
+        "primary_email": primary_email,
+        "basket_token": None if basket_token is None else str(basket_token),
+        "sfdc_id": sfdc_id,
+        "mofo_id": mofo_id,
+        "amo_user_id": amo_user_id,
+        "fxa_id": fxa_id,
+        "fxa_primary_email": fxa_primary_email,
+    }
+    params = {name: value for name, value in ids.items() if value is not None}
+    assert any(params.values())
+    statement = bakery(contacts_by_any_id_query)
+    for name in params:
+        statement += ALT_ID_FILTERS[name]
+    results = statement(db).params(**params).all()
+    newsletters_by_email_id = get_newsletters_by_email_ids(
+        db, [email.email_id for email, _, _, _ in results]
     )
-    if email_id is not None:
-        statement = statement.filter(Email.email_id == email_id)
-    if primary_email is not None:
-        statement = statement.filter(Email.primary_email == primary_email)
-    if basket_token is not None:
-        statement = statement.filter(Email.basket_token == str(basket_token))
-    if sfdc_id is not None:
-        statement = statement.filter(Email.sfdc_id == sfdc_id)
-    if mofo_id is not None:
-        statement = statement.filter(Email.mofo_id == mofo_id)
-    if amo_user_id is not None:
-        statement = statement.filter(AmoAccount.user_id == amo_user_id)
-    if fxa_id is not None:
-        statement = statement.filter(FirefoxAccount.fxa_id == fxa_id)
-    if fxa_primary_email is not None:
-        statement = statement.filter(FirefoxAccount.primary_email == fxa_primary_email)
-    results = statement.all()
     data = []
     for result in results:
         email, amo, fxa, vpn_waitlist = result
-        newsletters = (
-            db.query(Newsletter).filter(Newsletter.email_id == email.email_id).all()
-        )
         data.append(
             {
                 "amo": amo,
                 "email": email,
                 "fxa": fxa,
-                "newsletters": newsletters,
+                "newsletters": newsletters_by_email_id[email.email_id],
                 "vpn_waitlist": vpn_waitlist,
             }
         )
     return data
 
 
+def get_newsletters_by_email_ids(
+    db: Session, email_ids: List[UUID4]
+) -> Dict[UUID4, List[Newsletter]]:
+    """Get the newsletters for several contacts in one query."""
+    newsletters: Dict[UUID4, List[Newsletter]] = defaultdict(list)
+    if not email_ids:
+        return newsletters
+    query = bakery(lambda session: session.query(Newsletter))
+    query += lambda q: q.filter(
+        Newsletter.email_id.in_(bindparam("email_ids", expanding=True))
+    ).order_by(Newsletter.email_id, Newsletter.name)
+    rows = query(db).params(email_ids=email_ids).all()
+    for newsletter in rows:
+        newsletters[newsletter.email_id].append(newsletter)
+    return newsletters
+
+
 def create_amo(db: Session, email_id: UUID4, amo: AddOnsSchema):
     db_amo = AmoAccount(email_id=email_id, **amo.dict())
     db.add(db_amo)
@@ -133,6 +305,15 @@ def create_newsletter(db: Session, email_id: UUID4, newsletter: NewsletterSchema
     db.add(db_newsletter)
 
 
+def unique_newsletters(newsletters: List[NewsletterSchema]) -> List[NewsletterSchema]:
+    """
+    Return one newsletter per name, the last one listed for that name.
+
+    A contact has one newsletters row per name, enforced by uix_email_name.
+    """
+    return list({newsletter.name: newsletter for newsletter in newsletters}.values())
+
+
 def create_contact(db: Session, email_id: UUID4, contact: ContactInSchema):
     create_email(db, contact.email)
     if contact.amo:
@@ -141,5 +322,273 @@ def create_contact(db: Session, email_id: UUID4, contact: ContactInSchema):
         create_fxa(db, email_id, contact.fxa)
     if contact.vpn_waitlist:
         create_vpn_waitlist(db, email_id, contact.vpn_waitlist)
-    for newsletter in contact.newsletters:
+    for newsletter in unique_newsletters(contact.newsletters):
         create_newsletter(db, email_id, newsletter)
+
+
+def get_all_contacts(db: Session, chunk_size: int = 1000) -> Iterator[Dict]:
+    """
+    Yield the data for all contacts, ordered by email_id.
+
+    Emails are read through a server-side cursor, and the other tables are
+    loaded for a chunk of contacts at a time, so memory use stays flat
+    however many contacts there are.
+    """
+    emails = db.query(Email).order_by(Email.email_id).yield_per(chunk_size)
+    chunk: List[Email] = []
+    for email in emails:
+        chunk.append(email)
+        if len(chunk) == chunk_size:
+            yield from _contacts_for_emails(db, chunk)
+            chunk = []
+    if chunk:
+        yield from _contacts_for_emails(db, chunk)
+
+
+def _contacts_for_emails(db: Session, emails: List[Email]) -> Iterator[Dict]:
+    """Yield the contact data for emails, loading each other table in one query."""
+    email_ids = [email.email_id for email in emails]
+    groups = {}
+    models: Tuple[Tuple[str, Type[Base]], ...] = (
+        ("amo", AmoAccount),
+        ("fxa", FirefoxAccount),
+        ("vpn_waitlist", VpnWaitlist),
+    )
+    for group, model in models:
+        rows = db.query(model).filter(model.email_id.in_(email_ids))
+        groups[group] = {row.email_id: row for row in rows}
+    newsletters = get_newsletters_by_email_ids(db, email_ids)
+    for email in emails:
+        yield {
+            "amo": groups["amo"].get(email.email_id),
+            "email": email,
+            "fxa": groups["fxa"].get(email.email_id),
+            "newsletters": newsletters[email.email_id],
+            "vpn_waitlist": groups["vpn_waitlist"].get(email.email_id),
+        }
+
+
+def get_contact_updates(
+    db: Session, since: datetime, after: Optional[UUID4] = None, limit: int = 100
+) -> List[Tuple[UUID4, datetime]]:
+    """
+    Get the contacts changed since a cursor, as (email_id, update_timestamp).
+
+    Each table is read from its (update_timestamp, email_id) index, starting
+    after the cursor and stopping after limit rows, so a page costs the same
+    however many changes follow it. The rows are merged, and each contact is
+    returned once, at its earliest change. The last pair of a page is the
+    keyset cursor for the next page, as since and after.
+
+    The feed is at-least-once. A contact changed again, or changed in another
+    table after the cursor, is returned again on a later page. A page can have
+    fewer than limit contacts when more follow, so the feed is caught up when
+    a page is empty.
+    """
+    models: Tuple[Type[Base], ...] = (
+        Email,
+        AmoAccount,
+        FirefoxAccount,
+        VpnWaitlist,
+        Newsletter,
+    )
+    pages = []
+    for index, model in enumerate(models):
+        key = tuple_(model.update_timestamp, model.email_id)
+        if after is None:
+            after_cursor = model.update_timestamp >= since
+        else:
+            after_cursor = key > tuple_(since, after)
+        pages.append(
+            select(
+                [literal(index).label("page"), model.email_id, model.update_timestamp]
+            )
+            .distinct()
+            .where(after_cursor)
+            .order_by(model.update_timestamp, model.email_id)
+            .limit(limit)
+        )
+    keys_by_page: Dict[int, List[Tuple[datetime, UUID4]]] = defaultdict(list)
+    for page, email_id, update_timestamp in db.execute(union_all(*pages)):
+        keys_by_page[page].append((update_timestamp, email_id))
+
+    # A full page may stop before changes in other tables, so only the changes
+    # up to the end of the shortest full page are known to be complete.
+    ends = [max(keys) for keys in keys_by_page.values() if len(keys) == limit]
+    complete = min(ends) if ends else None
+    earliest: Dict[UUID4, datetime] = {}
+    for update_timestamp, email_id in sorted(chain(*keys_by_page.values())):
+        if complete is not None and (update_timestamp, email_id) > complete:
+            break
+        earliest.setdefault(email_id, update_timestamp)
+    return list(earliest.items())[:limit]
+
+
+def get_newsletter_subscribers(
+    db: Session,
+    name: str,
+    subscribed: bool = True,
+    after: Optional[UUID4] = None,
+    limit: int = 100,
+) -> List[UUID4]:
+    """
+    Get the email_ids of a newsletter's subscribers, ordered by email_id.
+
+    Pass the last email_id of a page as after to get the next page. This is
+    a range scan of the (name, subscribed, email_id) index, so deep pages
+    cost the same as the first.
+    """
+    query = db.query(Newsletter.email_id).filter(
+        Newsletter.name == name, Newsletter.subscribed == subscribed
+    )
+    if after is not None:
+        query = query.filter(Newsletter.email_id > after)
+    rows = query.order_by(Newsletter.email_id).limit(limit)
+    return [row.email_id for row in rows]
+
+
+def _rows_for_insert(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Use the database time for unset timestamps in a multi-row insert."""
+    for row in rows:
+        for key in ("create_timestamp", "update_timestamp"):
+            if key in row and row[key] is None:
+                row[key] = func.now()
+    return rows
+
+
+def _insert_returning_email_ids(db: Session, model, rows: List[Dict[str, Any]]):
+    """Insert rows, skipping conflicts, and return the inserted email_ids."""
+    statement = (
+        insert(model.__table__)
+        .values(_rows_for_insert(rows))
+        .on_conflict_do_nothing()
+        .returning(model.email_id)
+    )
+    return {row[0] for row in db.execute(statement)}
+
+
+def create_contacts_bulk(db: Session, contacts: List[ContactInSchema]) -> List[UUID4]:
+    """
+    Create several contacts, with one multi-row INSERT per table.
+
+    A contact is skipped if it conflicts with an existing contact, or with an
+    earlier contact in the list, on email_id, primary_email, basket_token, or
+    fxa_id. Returns the email_ids of the created contacts, in the given order.
+    """
+    pending: Dict[UUID4, ContactInSchema] = {}
+    for contact in contacts:
+        pending.setdefault(contact.email.email_id, contact)
+    if not pending:
+        return []
+
+    email_rows = [contact.email.dict() for contact in pending.values()]
+    created = _insert_returning_email_ids(db, Email, email_rows)
+    pending = {
+        email_id: contact
+        for email_id, contact in pending.items()
+        if email_id in created
+    }
+
+    # fxa_id is unique, so a new contact can still conflict here. Remove the
+    # email rows of those contacts before adding any other data for them.
+    fxa_rows = [
+        dict(email_id=email_id, **contact.fxa.dict())
+        for email_id, contact in pending.items()
+        if contact.fxa
+    ]
+    if fxa_rows:
+        fxa_created = _insert_returning_email_ids(db, FirefoxAccount, fxa_rows)
+        fxa_conflicts = {row["email_id"] for row in fxa_rows} - fxa_created
+        if fxa_conflicts:
+            db.query(Email).filter(Email.email_id.in_(fxa_conflicts)).delete(
+                synchronize_session=False
+            )
+            for email_id in fxa_conflicts:
+                del pending[email_id]
+
+    models: Tuple[Tuple[Type[Base], str], ...] = (
+        (AmoAccount, "amo"),
+        (VpnWaitlist, "vpn_waitlist"),
+    )
+    for model, group in models:
+        rows = [
+            dict(email_id=email_id, **getattr(contact, group).dict())
+            for email_id, contact in pending.items()
+            if getattr(contact, group)
+        ]
+        if rows:
+            db.execute(insert(model.__table__).values(_rows_for_insert(rows)))
+
+    newsletter_rows = [
+        dict(email_id=email_id, **newsletter.dict())
+        for email_id, contact in pending.items()
+        for newsletter in unique_newsletters(contact.newsletters)
+    ]
+    if newsletter_rows:
+        db.execute(insert(Newsletter.__table__).values(newsletter_rows))
+
+    return list(pending.keys())
+
+
+# Timestamps are set by the database, not by callers
+TIMESTAMP_FIELDS = {"create_timestamp", "update_timestamp"}
+
+
+def _upsert(db: Session, model, index_elements: List[str], rows, changed_fields):
+    """
+    Insert rows, or update the changed fields of the existing rows.
+
+    New rows get defaults for the fields that were not set, while existing rows
+    keep their values. The update_timestamp is set in both cases.
+    """
+    statement = insert(model.__table__).values(
+        [dict(row, update_timestamp=func.now()) for row in rows]
+    )
+    set_ = {field: statement.excluded[field] for field in changed_fields}
+    set_["update_timestamp"] = func.now()
+    db.execute(
+        statement.on_conflict_do_update(index_elements=index_elements, set_=set_)
+    )
+
+
+def update_contact(db: Session, email_id: UUID4, patch: ContactPatchSchema) -> bool:
+    """
+    Apply changes to a contact, with one statement per changed table.
+
+    The emails row is updated first, even if no email fields changed. This
+    checks that the contact exists, and takes the contact's row locks in the
+    same order for every update. The other groups are upserted, and the
+    newsletters are upserted by name. Returns False if there is no contact.
+    """
+    email_changes = {}
+    if patch.email:
+        email_changes = patch.email.dict(exclude_unset=True, exclude=TIMESTAMP_FIELDS)
+    statement = (
+        update(Email.__table__)
+        .where(Email.email_id == email_id)
+        .values(update_timestamp=func.now(), **email_changes)
+        .returning(Email.email_id)
+    )
+    if db.execute(statement).first() is None:
+        return False
+
+    for model, group in (
+        (AmoAccount, "amo"),
+        (FirefoxAccount, "fxa"),
+        (VpnWaitlist, "vpn_waitlist"),
+    ):
+        data = getattr(patch, group)
+        if data is not None:
+            row = dict(email_id=email_id, **data.dict(exclude=TIMESTAMP_FIELDS))
+            changed = data.dict(exclude_unset=True, exclude=TIMESTAMP_FIELDS).keys()
+            _upsert(db, model, ["email_id"], [row], changed)
+
+    # Newsletters that change the same fields are upserted together. A name
+    # can only appear once per statement, so the last change for it wins.
+    newsletters: Dict[Tuple[str, ...], List[Dict[str, Any]]] = defaultdict(list)
+    for newsletter in unique_newsletters(patch.newsletters):
+        changed = tuple(sorted(newsletter.dict(exclude_unset=True).keys() - {"name"}))
+        newsletters[changed].append(dict(email_id=email_id, **newsletter.dict()))
+    for changed, rows in newsletters.items():
+        _upsert(db, Newsletter, ["email_id", "name"], rows, changed)
+    return True
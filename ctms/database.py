@@ -1,16 +1,276 @@
+import itertools
 import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
 
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from . import config
 
 
-def get_db_engine(settings: config.Settings):
-    engine = create_engine(settings.db_url)
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long requests wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = time.monotonic()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            wait = time.monotonic() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.checkout_timeouts += timed_out
+                self.wait_seconds_total += wait
+                self.wait_seconds_max = max(self.wait_seconds_max, wait)
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """An InstrumentedQueuePool for asyncpg, where requests wait on the event loop."""
+
+
+class QueryStats:
+    """The number of statements run for a request, and the time spent on them."""
+
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Set for each request by the middleware. The endpoints run in a copy of the
+# request's context, in a thread or an AsyncSession's greenlet, so they update
+# the same QueryStats object.
+query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def request_query_stats() -> Iterator[QueryStats]:
+    """Count the statements of a request, sharing the count with outer middleware."""
+    stats = query_stats.get()
+    if stats is not None:
+        yield stats
+        return
+    stats = QueryStats()
+    token = query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        query_stats.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._ctms_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = query_stats.get()
+    start = getattr(context, "_ctms_query_start", None)
+    if stats is not None and start is not None:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - start
+
+
+def track_query_stats(target) -> None:
+    """Add the statements run by an engine or connection to the QueryStats."""
+    event.listen(target, "before_cursor_execute", _before_cursor_execute)
+    event.listen(target, "after_cursor_execute", _after_cursor_execute)
+
+
+def untrack_query_stats(target) -> None:
+    event.remove(target, "before_cursor_execute", _before_cursor_execute)
+    event.remove(target, "after_cursor_execute", _after_cursor_execute)
+
+
+def get_db_engine(
+    settings: config.Settings, db_url: Optional[str] = None, pre_ping: bool = False
+):
+    """
+    Return an engine and a session factory for the database.
+
+    The primary database at db_url in the settings is used by default. The
+    pool and timeout settings are shared by the primary and the replicas.
+    """
+    connect_args: Dict[str, Any] = {"connect_timeout": settings.db_connect_timeout}
+    if settings.db_statement_timeout:
+        connect_args[
+            "options"
+        ] = f"-c statement_timeout={settings.db_statement_timeout}"
+    engine = create_engine(
+        db_url or settings.db_url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping or pre_ping,
+        connect_args=connect_args,
+    )
+    track_query_stats(engine)
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     return engine, SessionLocal
 
 
+def get_async_db_engine(
+    settings: config.Settings, db_url: Optional[str] = None, pre_ping: bool = False
+):
+    """
+    Return an asyncio engine and an AsyncSession factory, using asyncpg.
+
+    The pool and timeouts are configured like get_db_engine. The statements
+    run on the engine's sync_engine, which has the pool and the query stats.
+    """
+    url = make_url(db_url or settings.db_url).set(drivername="postgresql+asyncpg")
+    connect_args: Dict[str, Any] = {"timeout": settings.db_connect_timeout}
+    if settings.db_statement_timeout:
+        connect_args["server_settings"] = {
+            "statement_timeout": str(settings.db_statement_timeout)
+        }
+    engine = create_async_engine(
+        url,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping or pre_ping,
+        connect_args=connect_args,
+    )
+    track_query_stats(engine.sync_engine)
+    AsyncSessionLocal = sessionmaker(class_=AsyncSession, autoflush=False, bind=engine)
+    return engine, AsyncSessionLocal
+
+
+class ReplicaSession(Session):
+    """
+    A session on a read replica, connected on first use.
+
+    Requests answered from a cache never check out a connection. On first
+    use, the session connects to the next available replica, or to the
+    primary if none can connect.
+    """
+
+    def __init__(self, replicas: "ReplicaPool", primary, **kwargs):
+        super().__init__(autocommit=False, autoflush=False, **kwargs)
+        self.replicas = replicas
+        self.primary = primary
+        self._read_bind = None
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._read_bind is None:
+            self._read_bind = self.replicas.connect(self) or self.primary
+        return self._read_bind
+
+
+class ReplicaPool:
+    """
+    Sessions on read replicas, taken in turn.
+
+    Sessions connect on first use, and the connection is pre-pinged. A
+    replica that fails to connect is skipped for retry_after seconds, and
+    the session tries the next one. If no replica is available, the session
+    uses the primary.
+    """
+
+    def __init__(self, engines: List, retry_after: float):
+        self.engines = engines
+        self.retry_after = retry_after
+        self._next = itertools.count()
+        self._down_until = [0.0] * len(engines)
+
+    def session(self, primary) -> ReplicaSession:
+        """Return a session that reads from a replica, or else the primary engine."""
+        return ReplicaSession(self, primary)
+
+    def async_session(self, primary) -> AsyncSession:
+        """Return an AsyncSession that runs a ReplicaSession, for async mode."""
+        return AsyncSession(
+            sync_session_class=ReplicaSession, replicas=self, primary=primary
+        )
+
+    def connect(self, db: Session):
+        """Connect a session to the next available replica, and return its engine."""
+        for _ in range(len(self.engines)):
+            index = next(self._next) % len(self.engines)
+            if self._down_until[index] > time.monotonic():
+                continue
+            try:
+                db.connection(bind=self.engines[index])
+            except exc.DBAPIError:
+                self._down_until[index] = time.monotonic() + self.retry_after
+                continue
+            return self.engines[index]
+        return None
+
+    def status(self) -> List[Dict[str, Any]]:
+        """Return the pool status of each replica, and if it is down."""
+        now = time.monotonic()
+        return [
+            dict(get_pool_status(engine), down=down_until > now)
+            for engine, down_until in zip(self.engines, self._down_until)
+        ]
+
+
+def get_replica_pool(settings: config.Settings) -> Optional[ReplicaPool]:
+    """
+    Return a ReplicaPool for the replica URLs in the settings, if any.
+
+    In async mode, the pool has the sync_engine of each asyncio engine.
+    """
+    if not settings.db_replica_urls:
+        return None
+    if settings.db_async:
+        engines = [
+            get_async_db_engine(settings, url, pre_ping=True)[0].sync_engine
+            for url in settings.db_replica_urls
+        ]
+    else:
+        engines = [
+            get_db_engine(settings, url, pre_ping=True)[0]
+            for url in settings.db_replica_urls
+        ]
+    return ReplicaPool(engines, settings.db_replica_retry)
+
+
+def get_pool_status(engine) -> Dict[str, Any]:
+    """Return the connection pool's current usage and checkout wait times."""
+    pool = engine.pool
+    status = {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+    if isinstance(pool, InstrumentedQueuePool):
+        status.update(
+            {
+                "checkouts": pool.checkouts,
+                "checkout_timeouts": pool.checkout_timeouts,
+                "wait_seconds_total": pool.wait_seconds_total,
+                "wait_seconds_max": pool.wait_seconds_max,
+            }
+        )
+    return status
+
+
 Base = declarative_base()
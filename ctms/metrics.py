@@ -0,0 +1,151 @@
+"""
+Prometheus metrics for requests, database statements and connection pools.
+
+When the environment variable prometheus_multiproc_dir is set, each worker
+writes its metrics to files in that directory, and /metrics reports the
+totals for all workers. See docker/gunicorn_conf.py for the worker hooks.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+)
+from starlette.routing import Match
+
+from .database import QueryStats, get_pool_status, request_query_stats
+
+REQUESTS = Counter(
+    "ctms_requests",
+    "Requests by route and status code",
+    ["method", "path_template", "status_code"],
+)
+REQUEST_DURATION = Histogram(
+    "ctms_request_duration_seconds",
+    "Request latency by route",
+    ["method", "path_template"],
+)
+REQUEST_DB_QUERIES = Histogram(
+    "ctms_request_db_queries",
+    "Database statements run by a request",
+    ["method", "path_template"],
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 32, 64, float("inf")),
+)
+REQUEST_DB_DURATION = Histogram(
+    "ctms_request_db_duration_seconds",
+    "Time spent running database statements for a request",
+    ["method", "path_template"],
+)
+
+# Pool gauges are summed across the live workers. The longest wait is the
+# maximum for all workers, including those that exited.
+POOL_GAUGES = {
+    key: Gauge(
+        f"ctms_db_pool_{key}",
+        description,
+        ["pool"],
+        multiprocess_mode="max" if key == "wait_seconds_max" else "livesum",
+    )
+    for key, description in (
+        ("size", "Connections kept open by the pool"),
+        ("checked_out", "Connections in use"),
+        ("overflow", "Connections open beyond the pool size"),
+        ("checkouts", "Connection checkouts since the worker started"),
+        ("checkout_timeouts", "Checkouts that timed out waiting for a connection"),
+        ("wait_seconds_total", "Time spent waiting for a connection"),
+        ("wait_seconds_max", "Longest wait for a connection"),
+    )
+}
+POOL_UPDATE_INTERVAL = 1.0
+
+_pools: Dict[str, Any] = {}
+_pools_updated = 0.0
+_pools_lock = threading.Lock()
+
+
+def add_pool_metrics(name: str, engine) -> None:
+    """Report the connection pool of an engine, labeled with name."""
+    _pools[name] = engine
+
+
+def update_pool_metrics(force: bool = False) -> None:
+    """Set the pool gauges, at most once per update interval unless forced."""
+    global _pools_updated
+    now = time.monotonic()
+    with _pools_lock:
+        if not force and now - _pools_updated < POOL_UPDATE_INTERVAL:
+            return
+        _pools_updated = now
+    for name, engine in list(_pools.items()):
+        status = get_pool_status(engine)
+        for key, gauge in POOL_GAUGES.items():
+            if key in status:
+                gauge.labels(name).set(status[key])
+
+
+def get_metrics_registry() -> CollectorRegistry:
+    """Return the registry to report, combining the workers if multi-process."""
+    if "prometheus_multiproc_dir" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def get_path_template(scope) -> Optional[str]:
+    """Return the path of the route that handles the request, like /ctms/{email_id}"""
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return None
+
+
+class MetricsMiddleware:
+    """
+    Record the latency, status code and database statements of each request.
+
+    Requests are labeled with the route's path template rather than the
+    path, so that each email_id does not get its own time series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        with request_query_stats() as stats:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                duration = time.perf_counter() - start
+                self.record(scope, status_code, duration, stats)
+
+    @staticmethod
+    def record(scope, status_code: int, duration: float, stats: QueryStats) -> None:
+        method = scope["method"]
+        path_template = get_path_template(scope) or "unknown"
+        REQUESTS.labels(method, path_template, status_code).inc()
+        REQUEST_DURATION.labels(method, path_template).observe(duration)
+        REQUEST_DB_QUERIES.labels(method, path_template).observe(stats.count)
+        REQUEST_DB_DURATION.labels(method, path_template).observe(stats.seconds)
+        update_pool_metrics()
@@ -4,10 +4,11 @@ from sqlalchemy import (
     Column,
     Date,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
-    UniqueConstraint,
+    TypeDecorator,
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
@@ -16,14 +17,25 @@ from sqlalchemy.sql.functions import now
 from .database import Base
 
 
+class UUIDString(TypeDecorator):
+    """A String column that holds UUIDs, like the basket_token, as text."""
+
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        # psycopg2 adapts a UUID to text, but asyncpg needs a str
+        return None if value is None else str(value)
+
+
 class Email(Base):
     __tablename__ = "emails"
 
     email_id = Column(UUID(as_uuid=True), primary_key=True)
     primary_email = Column(String(255), unique=True, nullable=False)
-    basket_token = Column(String(255), unique=True)
-    sfdc_id = Column(String(255))
-    mofo_id = Column(String(255))
+    basket_token = Column(UUIDString(255), unique=True)
+    sfdc_id = Column(String(255), index=True)
+    mofo_id = Column(String(255), index=True)
     first_name = Column(String(255))
     last_name = Column(String(255))
     mailing_country = Column(String(255))
@@ -49,6 +61,10 @@ class Email(Base):
     amo = relationship("AmoAccount", back_populates="email", uselist=False)
     vpn_waitlist = relationship("VpnWaitlist", back_populates="email", uselist=False)
 
+    __table_args__ = (
+        Index("ix_emails_update_timestamp_email_id", "update_timestamp", "email_id"),
+    )
+
 
 class Newsletter(Base):
     __tablename__ = "newsletters"
@@ -74,7 +90,16 @@ class Newsletter(Base):
 
     email = relationship("Email", back_populates="newsletters", uselist=False)
 
-    UniqueConstraint("email_id", "name", name="uix_email_name")
+    __table_args__ = (
+        # Also the index for looking up a contact's newsletters by email_id
+        Index("uix_email_name", "email_id", "name", unique=True),
+        Index(
+            "ix_newsletters_name_subscribed_email_id", "name", "subscribed", "email_id"
+        ),
+        Index(
+            "ix_newsletters_update_timestamp_email_id", "update_timestamp", "email_id"
+        ),
+    )
 
 
 class FirefoxAccount(Base):
@@ -85,7 +110,7 @@ class FirefoxAccount(Base):
     email_id = Column(
         UUID(as_uuid=True), ForeignKey(Email.email_id), unique=True, nullable=False
     )
-    primary_email = Column(String(255))
+    primary_email = Column(String(255), index=True)
     created_date = Column(String(50))
     lang = Column(String(255))
     first_service = Column(String(50))
@@ -103,6 +128,10 @@ class FirefoxAccount(Base):
 
     email = relationship("Email", back_populates="fxa", uselist=False)
 
+    __table_args__ = (
+        Index("ix_fxa_update_timestamp_email_id", "update_timestamp", "email_id"),
+    )
+
 
 class AmoAccount(Base):
     __tablename__ = "amo"
@@ -119,7 +148,7 @@ class AmoAccount(Base):
     location = Column(String(10))
     profile_url = Column(String(40))
     user = Column(Boolean)
-    user_id = Column(String(40))
+    user_id = Column(String(40), index=True)
     username = Column(String(100))
 
     create_timestamp = Column(
@@ -134,6 +163,10 @@ class AmoAccount(Base):
 
     email = relationship("Email", back_populates="amo", uselist=False)
 
+    __table_args__ = (
+        Index("ix_amo_update_timestamp_email_id", "update_timestamp", "email_id"),
+    )
+
 
 class VpnWaitlist(Base):
     __tablename__ = "vpn_waitlist"
@@ -156,3 +189,9 @@ class VpnWaitlist(Base):
     )
 
     email = relationship("Email", back_populates="vpn_waitlist", uselist=False)
+
+    __table_args__ = (
+        Index(
+            "ix_vpn_waitlist_update_timestamp_email_id", "update_timestamp", "email_id"
+        ),
+    )
@@ -1,7 +1,19 @@
 from .addons import AddOnsSchema
-from .contact import ContactInSchema, ContactSchema, CTMSResponse, IdentityResponse
-from .email import EmailInSchema, EmailSchema
+from .contact import (
+    ContactInSchema,
+    ContactPatchSchema,
+    ContactSchema,
+    ContactUpdate,
+    CTMSBatchRequest,
+    CTMSBatchResponse,
+    CTMSBulkResponse,
+    CTMSBulkResult,
+    CTMSResponse,
+    IdentityResponse,
+    UpdatesResponse,
+)
+from .email import EmailInSchema, EmailPatchSchema, EmailSchema
 from .fxa import FirefoxAccountsSchema
-from .newsletter import NewsletterSchema
+from .newsletter import NewsletterSchema, NewsletterSubscribersResponse
 from .vpn import VpnWaitlistSchema
 from .web import BadRequestResponse, NotFoundResponse
@@ -5,7 +5,7 @@ from uuid import UUID
 from pydantic import UUID4, BaseModel, EmailStr, Field, HttpUrl
 
 from .addons import AddOnsSchema
-from .email import EmailInSchema, EmailSchema
+from .email import EmailInSchema, EmailPatchSchema, EmailSchema
 from .fxa import FirefoxAccountsSchema
 from .newsletter import NewsletterSchema
 from .vpn import VpnWaitlistSchema
@@ -51,6 +51,40 @@ class ContactInSchema(BaseModel):
     )
     vpn_waitlist: Optional["VpnWaitlistSchema"] = None
 
+    def idempotent_equal(self, other: "ContactInSchema") -> bool:
+        """
+        Return True if the contacts would be stored the same way.
+
+        Newsletters are stored once per name, the last one listed, and are
+        read back in name order, so their order is ignored.
+        """
+
+        def stored(contact: "ContactInSchema") -> "ContactInSchema":
+            by_name = {nl.name: nl for nl in contact.newsletters}
+            newsletters = [by_name[name] for name in sorted(by_name)]
+            return contact.copy(update={"newsletters": newsletters})
+
+        return stored(self) == stored(other)
+
+
+class ContactPatchSchema(BaseModel):
+    """
+    Changes to a contact, for PATCH /ctms/{email_id}.
+
+    Only the groups and fields that are set are changed. Newsletters are
+    merged by name, and newsletters that are not listed are not changed.
+    """
+
+    amo: Optional["AddOnsSchema"] = None
+    email: Optional["EmailPatchSchema"] = None
+    fxa: Optional["FirefoxAccountsSchema"] = None
+    newsletters: List["NewsletterSchema"] = Field(
+        default=[],
+        description="Newsletters to add or change, by name",
+        example=([{"name": "firefox-welcome", "subscribed": False}]),
+    )
+    vpn_waitlist: Optional["VpnWaitlistSchema"] = None
+
 
 class CTMSResponse(BaseModel):
     """
@@ -69,6 +103,98 @@ class CTMSResponse(BaseModel):
     vpn_waitlist: VpnWaitlistSchema
 
 
+class CTMSBatchRequest(BaseModel):
+    """Request for /ctms/batch"""
+
+    email_ids: List[UUID4] = Field(
+        ...,
+        description="The email IDs of the contacts to fetch",
+        example=["332de237-cab7-4461-bcc3-48e68f42bd5c"],
+    )
+
+
+class CTMSBatchResponse(BaseModel):
+    """
+    Response for /ctms/batch
+
+    Found contacts are keyed by email_id, and unknown email_ids are listed
+    separately.
+    """
+
+    contacts: Dict[str, CTMSResponse] = Field(
+        ..., description="Contacts that were found, keyed by email_id"
+    )
+    missing: List[UUID] = Field(
+        ...,
+        description="Requested email IDs without a contact",
+        example=["cad092ec-a71a-4df5-aa92-517959caeecb"],
+    )
+
+
+class CTMSBulkResult(BaseModel):
+    """The outcome for one contact in a /ctms/bulk request."""
+
+    email_id: UUID = Field(
+        ...,
+        description="ID for email, generated if not provided",
+        example="332de237-cab7-4461-bcc3-48e68f42bd5c",
+    )
+    status: Literal["created", "conflict"] = Field(
+        ...,
+        description=(
+            "created if the contact was added, conflict if it matches an existing"
+            " contact or an earlier contact in the request"
+        ),
+        example="created",
+    )
+
+
+class CTMSBulkResponse(BaseModel):
+    """Response for /ctms/bulk, with a result for each contact in request order."""
+
+    results: List[CTMSBulkResult]
+
+
+class ContactUpdate(BaseModel):
+    """A contact that changed, in /updates"""
+
+    email_id: UUID = Field(
+        ...,
+        description="ID for email",
+        example="332de237-cab7-4461-bcc3-48e68f42bd5c",
+    )
+    update_timestamp: datetime = Field(
+        ...,
+        description="Earliest change to the contact after the cursor",
+        example="2021-01-28T21:26:57.511Z",
+    )
+    contact: Optional[CTMSResponse] = Field(
+        default=None, description="The full contact, if requested"
+    )
+
+
+class UpdatesResponse(BaseModel):
+    """
+    Response for /updates
+
+    Pass next_since and next_after as since and after to get the next page.
+    A contact is returned again if it changed again after the cursor, and
+    the feed is caught up when updates is empty.
+    """
+
+    updates: List[ContactUpdate]
+    next_since: datetime = Field(
+        ...,
+        description="since for the next page",
+        example="2021-01-28T21:26:57.511Z",
+    )
+    next_after: Optional[UUID] = Field(
+        default=None,
+        description="after for the next page",
+        example="332de237-cab7-4461-bcc3-48e68f42bd5c",
+    )
+
+
 class IdentityResponse(BaseModel):
     """The identity keys for a contact."""
 
@@ -2,7 +2,7 @@ from datetime import date, datetime
 from typing import Any, Dict, List, Literal, Optional
 from uuid import UUID, uuid4
 
-from pydantic import UUID4, BaseModel, EmailStr, Field, HttpUrl
+from pydantic import UUID4, BaseModel, EmailStr, Field, HttpUrl, validator
 
 email_id_field: UUID4 = Field(
     description="ID for email",
@@ -124,3 +124,24 @@ class EmailInSchema(EmailBase):
         if self.email_id is None or other.email_id is None:
             raise BaseException("Cannot compare Email instances without email_id")
         return super().__eq__(self, other)
+
+
+class EmailPatchSchema(EmailBase):
+    """Changes to the email data of a contact. Unset fields are not changed."""
+
+    primary_email: Optional[EmailStr] = Field(
+        default=None,
+        description="Contact email address, Email in Salesforce",
+        example="contact@example.com",
+    )
+    basket_token: Optional[UUID] = Field(
+        default=None,
+        description="Basket token, Token__c in Salesforce",
+        example="c4a7d759-bb52-457b-896b-90f1d3ef8433",
+    )
+
+    @validator("primary_email", pre=True)
+    def primary_email_is_required(cls, value):
+        if value is None:
+            raise ValueError("primary_email can not be null")
+        return value
@@ -35,3 +35,18 @@ class NewsletterSchema(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class NewsletterSubscribersResponse(BaseModel):
+    """Response for /newsletters/{name}/subscribers"""
+
+    email_ids: List[UUID] = Field(
+        ...,
+        description="Email IDs of the contacts, in a stable order",
+        example=["332de237-cab7-4461-bcc3-48e68f42bd5c"],
+    )
+    next_cursor: Optional[str] = Field(
+        default=None,
+        description="Pass as cursor to get the next page, null on the last page",
+        example="MzMyZGUyMzctY2FiNy00NDYxLWJjYzMtNDhlNjhmNDJiZDVj",
+    )
@@ -0,0 +1,363 @@
+"""
+Synthetic contacts, for benchmarks and staging databases.
+
+Contacts are generated in chunks. Each chunk has its own random generator,
+seeded by the seed and the chunk number, so the contacts are the same no
+matter how many processes load the chunks, or in what order.
+
+To add a million contacts to the database at CTMS_DB_URL:
+
+python -m ctms.synthetic_data --contacts 1000000 --jobs 4
+
+Each chunk is added with one COPY per table, in its own transaction. The
+same seed generates the same contacts, so use a new --seed to add more
+contacts to a database that already has some.
+"""
+import argparse
+import io
+import multiprocessing
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from itertools import accumulate
+from random import Random
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+from uuid import UUID
+
+import psycopg2
+
+from .database import Base
+from .models import AmoAccount, Email, FirefoxAccount, Newsletter, VpnWaitlist
+
+# The share of contacts with each optional group or ID
+FXA_RATE = 0.6
+AMO_RATE = 0.05
+VPN_WAITLIST_RATE = 0.03
+SFDC_ID_RATE = 0.8
+MOFO_ID_RATE = 0.1
+NAME_RATE = 0.4
+# The chance that an sfdc_id or mofo_id is shared with an earlier contact
+SHARED_ID_RATE = 0.05
+# Weights for the number of newsletters, from 0 up
+NEWSLETTER_COUNT_WEIGHTS = (15, 35, 20, 12, 7, 4, 3, 2, 1, 0.5, 0.5)
+NEWSLETTER_WEIGHTS = {
+    "mozilla-and-you": 30,
+    "firefox-news": 20,
+    "mozilla-welcome": 15,
+    "about-mozilla": 10,
+    "mozilla-foundation": 8,
+    "firefox-accounts-journey": 8,
+    "take-action-for-the-internet": 5,
+    "app-dev": 4,
+    "test-pilot": 3,
+    "maker-party": 2,
+    "mozilla-learning-network": 2,
+    "internet-health-report": 2,
+    "firefox-sweepstakes": 1,
+    "knowledge-is-power": 1,
+    "common-voice": 1,
+}
+COUNTRY_WEIGHTS = {
+    "us": 35,
+    "de": 10,
+    "fr": 8,
+    "gb": 7,
+    "ca": 5,
+    "br": 5,
+    "in": 5,
+    "es": 4,
+    "it": 4,
+    "pl": 3,
+    "": 14,
+}
+LANG_WEIGHTS = {"en": 55, "de": 12, "fr": 10, "es": 8, "pt": 5, "it": 4, "pl": 3}
+# Reserved domains, so that no mail can reach a real person
+DOMAINS = ("example.com", "example.net", "example.org")
+FIRST_NAMES = ("Alex", "Sam", "Jo", "Kim", "Lee", "Max", "Noa", "Ray", "Sky", "Vic")
+LAST_NAMES = ("Garcia", "Kim", "Martin", "Müller", "Nguyen", "Rossi", "Silva", "Smith")
+SFDC_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+FIRST_TIMESTAMP = datetime(2012, 1, 1, tzinfo=timezone.utc)
+LAST_TIMESTAMP = datetime(2021, 3, 1, tzinfo=timezone.utc)
+
+_NEWSLETTER_NAMES = list(NEWSLETTER_WEIGHTS)
+_NEWSLETTER_CUM_WEIGHTS = list(accumulate(NEWSLETTER_WEIGHTS.values()))
+_NEWSLETTER_COUNTS = list(range(len(NEWSLETTER_COUNT_WEIGHTS)))
+_NEWSLETTER_COUNT_CUM_WEIGHTS = list(accumulate(NEWSLETTER_COUNT_WEIGHTS))
+_COUNTRIES = list(COUNTRY_WEIGHTS)
+_COUNTRY_CUM_WEIGHTS = list(accumulate(COUNTRY_WEIGHTS.values()))
+_LANGS = list(LANG_WEIGHTS)
+_LANG_CUM_WEIGHTS = list(accumulate(LANG_WEIGHTS.values()))
+
+
+def _uuid(rng: Random) -> UUID:
+    return UUID(int=rng.getrandbits(128), version=4)
+
+
+def _timestamps(rng: Random, after: datetime = FIRST_TIMESTAMP):
+    """Return a create and a later update timestamp, after a timestamp."""
+    span = (LAST_TIMESTAMP - after).total_seconds()
+    created = after + timedelta(seconds=rng.random() * span)
+    remaining = (LAST_TIMESTAMP - created).total_seconds()
+    updated = created + timedelta(seconds=rng.random() * remaining)
+    return created, updated
+
+
+def _shared_id(rng: Random, pool: List[str], new_id: str) -> str:
+    """Return an ID from the pool, sometimes, or add and return the new ID."""
+    if pool and rng.random() < SHARED_ID_RATE:
+        return rng.choice(pool)
+    pool.append(new_id)
+    return new_id
+
+
+def generate_contact(
+    rng: Random, shared_ids: Optional[Dict[str, List[str]]] = None
+) -> Dict[str, Any]:
+    """
+    Return the data for a new contact, in the shape of a ContactSchema.
+
+    Each group includes its timestamps. To share sfdc_ids and mofo_ids
+    between contacts, pass the same shared_ids dict for each contact.
+    """
+    if shared_ids is None:
+        shared_ids = {"sfdc_id": [], "mofo_id": []}
+    email_id = _uuid(rng)
+    domain = rng.choice(DOMAINS)
+    primary_email = f"contact-{email_id.hex[:20]}@{domain}"
+    created, updated = _timestamps(rng)
+    (lang,) = rng.choices(_LANGS, cum_weights=_LANG_CUM_WEIGHTS)
+    (country,) = rng.choices(_COUNTRIES, cum_weights=_COUNTRY_CUM_WEIGHTS)
+    has_name = rng.random() < NAME_RATE
+    email = {
+        "email_id": email_id,
+        "primary_email": primary_email,
+        "basket_token": _uuid(rng),
+        "sfdc_id": None,
+        "mofo_id": None,
+        "first_name": rng.choice(FIRST_NAMES) if has_name else None,
+        "last_name": rng.choice(LAST_NAMES) if has_name else None,
+        "mailing_country": country or None,
+        "email_format": "H" if rng.random() < 0.9 else "T",
+        "email_lang": lang,
+        "mofo_relevant": False,
+        "double_opt_in": rng.random() < 0.7,
+        "has_opted_out_of_email": rng.random() < 0.05,
+        "unsubscribe_reason": None,
+        "create_timestamp": created,
+        "update_timestamp": updated,
+    }
+    if rng.random() < SFDC_ID_RATE:
+        new_id = "001" + "".join(rng.choices(SFDC_ALPHABET, k=15))
+        email["sfdc_id"] = _shared_id(rng, shared_ids["sfdc_id"], new_id)
+    if rng.random() < MOFO_ID_RATE:
+        email["mofo_id"] = _shared_id(rng, shared_ids["mofo_id"], str(_uuid(rng)))
+        email["mofo_relevant"] = True
+    if email["has_opted_out_of_email"]:
+        email["unsubscribe_reason"] = "Too many emails"
+
+    contact: Dict[str, Any] = {
+        "email": email,
+        "amo": None,
+        "fxa": None,
+        "vpn_waitlist": None,
+        "newsletters": [],
+    }
+    if rng.random() < FXA_RATE:
+        fxa_created, fxa_updated = _timestamps(rng, created)
+        contact["fxa"] = {
+            "fxa_id": _uuid(rng).hex,
+            "primary_email": (
+                primary_email if rng.random() < 0.9 else f"fxa-{primary_email}"
+            ),
+            "created_date": fxa_created.isoformat(),
+            "lang": f"{lang},en;q=0.5" if lang != "en" else "en-US,en;q=0.5",
+            "first_service": rng.choice(("sync", "monitor", "vpn", "relay", None)),
+            "account_deleted": rng.random() < 0.02,
+            "create_timestamp": fxa_created,
+            "update_timestamp": fxa_updated,
+        }
+    if rng.random() < AMO_RATE:
+        amo_created, amo_updated = _timestamps(rng, created)
+        user_id = str(rng.randint(1, 20000000))
+        contact["amo"] = {
+            "add_on_ids": ",".join(f"addon-{rng.randint(1, 5000)}" for _ in range(2)),
+            "display_name": f"Add-on Author {user_id}",
+            "email_opt_in": rng.random() < 0.5,
+            "language": lang,
+            "last_login": amo_updated.date(),
+            "location": None,
+            "profile_url": f"firefox/user/{user_id}",
+            "user": True,
+            "user_id": user_id,
+            "username": f"author{user_id}",
+            "create_timestamp": amo_created,
+            "update_timestamp": amo_updated,
+        }
+    if rng.random() < VPN_WAITLIST_RATE:
+        vpn_created, vpn_updated = _timestamps(rng, created)
+        contact["vpn_waitlist"] = {
+            "geo": email["mailing_country"],
+            "platform": rng.choice(("windows", "android", "ios,mac", "linux")),
+            "create_timestamp": vpn_created,
+            "update_timestamp": vpn_updated,
+        }
+
+    (count,) = rng.choices(
+        _NEWSLETTER_COUNTS, cum_weights=_NEWSLETTER_COUNT_CUM_WEIGHTS
+    )
+    names: Set[str] = set()
+    while len(names) < count:
+        names.add(
+            rng.choices(_NEWSLETTER_NAMES, cum_weights=_NEWSLETTER_CUM_WEIGHTS)[0]
+        )
+    for name in sorted(names):
+        subscribed = rng.random() < 0.9
+        newsletter_created, newsletter_updated = _timestamps(rng, created)
+        contact["newsletters"].append(
+            {
+                "name": name,
+                "subscribed": subscribed,
+                "format": email["email_format"],
+                "lang": lang,
+                "source": "https://www.mozilla.org/en-US/newsletter/",
+                "unsub_reason": None if subscribed else "Not interested",
+                "create_timestamp": newsletter_created,
+                "update_timestamp": newsletter_updated,
+            }
+        )
+    return contact
+
+
+def generate_chunk(seed: int, chunk: int, size: int) -> List[Dict[str, Any]]:
+    """
+    Return the contacts of a chunk.
+
+    A smaller size returns the first contacts of the same chunk, and the
+    sfdc_id and mofo_id clusters are within a chunk.
+    """
+    rng = Random(f"{seed}:{chunk}")
+    shared_ids: Dict[str, List[str]] = {"sfdc_id": [], "mofo_id": []}
+    return [generate_contact(rng, shared_ids) for _ in range(size)]
+
+
+def copy_value(value: Any) -> str:
+    """Format a value for COPY's text format."""
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+_GROUP_MODELS: Tuple[Tuple[Type[Base], str], ...] = (
+    (AmoAccount, "amo"),
+    (FirefoxAccount, "fxa"),
+    (VpnWaitlist, "vpn_waitlist"),
+)
+
+
+def copy_contacts(cursor, contacts: List[Dict[str, Any]]) -> None:
+    """Add contacts with one COPY per table, using a psycopg2 cursor."""
+    rows: Dict[Type[Base], List[Dict[str, Any]]] = {
+        Email: [],
+        AmoAccount: [],
+        FirefoxAccount: [],
+        VpnWaitlist: [],
+        Newsletter: [],
+    }
+    for contact in contacts:
+        email_id = contact["email"]["email_id"]
+        rows[Email].append(contact["email"])
+        for model, group in _GROUP_MODELS:
+            if contact[group]:
+                rows[model].append(dict(contact[group], email_id=email_id))
+        rows[Newsletter].extend(
+            dict(newsletter, email_id=email_id) for newsletter in contact["newsletters"]
+        )
+
+    for model, model_rows in rows.items():
+        # Leave out the serial id columns
+        columns = [name for name in model.__table__.columns.keys() if name != "id"]
+        data = io.StringIO(
+            "".join(
+                "\t".join(copy_value(row[column]) for column in columns) + "\n"
+                for row in model_rows
+            )
+        )
+        # Quoted, since amo has a column named user
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        cursor.copy_expert(
+            f"COPY {model.__tablename__} ({column_list}) FROM STDIN", data
+        )
+
+
+_connection = None
+
+
+def _connect(db_url: str) -> None:
+    global _connection
+    _connection = psycopg2.connect(db_url)
+
+
+def _load_chunk(task) -> int:
+    seed, chunk, size = task
+    contacts = generate_chunk(seed, chunk, size)
+    with _connection:
+        with _connection.cursor() as cursor:
+            copy_contacts(cursor, contacts)
+    return size
+
+
+def load_contacts(
+    db_url: str, count: int, seed: int = 0, chunk_size: int = 10000, jobs: int = 1
+) -> None:
+    """Add count synthetic contacts, loading chunks in parallel processes."""
+    tasks = [
+        (seed, chunk, min(chunk_size, count - start))
+        for chunk, start in enumerate(range(0, count, chunk_size))
+    ]
+    start_time = time.monotonic()
+    loaded = 0
+    with multiprocessing.Pool(jobs, _connect, (db_url,)) as pool:
+        for size in pool.imap_unordered(_load_chunk, tasks):
+            loaded += size
+            elapsed = time.monotonic() - start_time
+            print(
+                f"{loaded} of {count} contacts, {loaded / elapsed:.0f} per second",
+                file=sys.stderr,
+            )
+
+    # Update the planner statistics for the new rows
+    _connect(db_url)
+    _connection.autocommit = True
+    with _connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    _connection.close()
+
+
+if __name__ == "__main__":
+    from .config import Settings
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--contacts", type=int, default=100000, help="Contacts to add")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the contacts")
+    parser.add_argument(
+        "--chunk-size", type=int, default=10000, help="Contacts per COPY"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=multiprocessing.cpu_count(), help="Processes"
+    )
+    args = parser.parse_args()
+    load_contacts(
+        Settings().db_url, args.contacts, args.seed, args.chunk_size, args.jobs
+    )
@@ -0,0 +1,131 @@
+"""
+Server-Timing headers, with the time spent in each phase of a request.
+
+The phases are:
+
+- db: Running database statements, with the number of statements
+- validate: Building pydantic models from database rows or the cache
+- serialize: Encoding the response as JSON
+- total: The whole request, until the response headers are sent
+
+The ServerTimingMiddleware is only added when the server_timing setting is
+enabled. Without it, timed() is a context variable lookup.
+"""
+import json
+import logging
+from contextlib import nullcontext
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Dict, Optional
+
+from starlette.datastructures import MutableHeaders
+
+from .database import QueryStats, request_query_stats
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("validate", "serialize")
+
+
+class RequestTimer:
+    """The seconds spent in each phase of a request."""
+
+    __slots__ = ("phases",)
+
+    def __init__(self):
+        self.phases: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+
+
+request_timer: ContextVar[Optional[RequestTimer]] = ContextVar(
+    "request_timer", default=None
+)
+
+
+class _TimedPhase:
+    __slots__ = ("timer", "phase", "start")
+
+    def __init__(self, timer: RequestTimer, phase: str):
+        self.timer = timer
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timer.phases[self.phase] += perf_counter() - self.start
+
+
+_untimed = nullcontext()
+
+
+def timed(phase: str):
+    """Add the time spent in a with block to a phase of the current request."""
+    timer = request_timer.get()
+    if timer is None:
+        return _untimed
+    return _TimedPhase(timer, phase)
+
+
+def server_timing_header(timer: RequestTimer, stats: QueryStats, total: float) -> str:
+    """Return the Server-Timing header value, with durations in milliseconds."""
+    metrics = [f'db;dur={stats.seconds * 1000:.3f};desc="{stats.count} statements"']
+    metrics.extend(
+        f"{phase};dur={seconds * 1000:.3f}" for phase, seconds in timer.phases.items()
+    )
+    metrics.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(metrics)
+
+
+class ServerTimingMiddleware:
+    """
+    Add a Server-Timing header to each response, and log the phase timings.
+
+    The log line, on the ctms.timing logger, is JSON. It is written after the
+    response is sent, so the times for streamed responses include the body.
+    The path is logged without the query string, which can have emails.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        timer = RequestTimer()
+        token = request_timer.set(timer)
+        start = perf_counter()
+
+        with request_query_stats() as stats:
+
+            async def send_with_timing(message):
+                nonlocal status_code
+                if message["type"] == "http.response.start":
+                    status_code = message["status"]
+                    header = server_timing_header(timer, stats, perf_counter() - start)
+                    MutableHeaders(scope=message).append("Server-Timing", header)
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                request_timer.reset(token)
+                total = perf_counter() - start
+                logger.info(
+                    json.dumps(
+                        {
+                            "method": scope["method"],
+                            "path": scope["path"],
+                            "status_code": status_code,
+                            "total_ms": round(total * 1000, 3),
+                            "db_ms": round(stats.seconds * 1000, 3),
+                            "db_statements": stats.count,
+                            **{
+                                f"{phase}_ms": round(seconds * 1000, 3)
+                                for phase, seconds in timer.phases.items()
+                            },
+                        }
+                    )
+                )
@@ -42,3 +42,23 @@ log_data = {
     "port": port,
 }
 print(json.dumps(log_data))
+
+
+# Multi-process Prometheus metrics, see ctms/metrics.py
+metrics_dir = os.getenv("prometheus_multiproc_dir")
+
+
+def on_starting(server):
+    """Remove the metrics files of a previous run."""
+    if metrics_dir:
+        for name in os.listdir(metrics_dir):
+            if name.endswith(".db"):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def child_exit(server, worker):
+    """Stop reporting the live gauges of a worker that exited."""
+    if metrics_dir:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
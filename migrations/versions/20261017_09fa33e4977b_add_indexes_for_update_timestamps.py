@@ -0,0 +1,84 @@
+"""Add indexes for update timestamps
+
+Revision ID: 09fa33e4977b
+Revises: 6e9a31022eab
+Create Date: 2026-10-17 06:33:57.667633
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "09fa33e4977b"  # pragma: allowlist secret
+down_revision = "6e9a31022eab"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Build the indexes without blocking writes, as in 6e9a31022eab
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_amo_update_timestamp"),
+            "amo",
+            ["update_timestamp"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_emails_update_timestamp"),
+            "emails",
+            ["update_timestamp"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_fxa_update_timestamp"),
+            "fxa",
+            ["update_timestamp"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_newsletters_update_timestamp"),
+            "newsletters",
+            ["update_timestamp"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_vpn_waitlist_update_timestamp"),
+            "vpn_waitlist",
+            ["update_timestamp"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_vpn_waitlist_update_timestamp"),
+            table_name="vpn_waitlist",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_newsletters_update_timestamp"),
+            table_name="newsletters",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_fxa_update_timestamp"),
+            table_name="fxa",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_emails_update_timestamp"),
+            table_name="emails",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_amo_update_timestamp"),
+            table_name="amo",
+            postgresql_concurrently=True,
+        )
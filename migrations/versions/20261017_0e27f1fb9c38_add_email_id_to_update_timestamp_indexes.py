@@ -0,0 +1,145 @@
+"""Add email_id to the update timestamp indexes
+
+Revision ID: 0e27f1fb9c38
+Revises: eda9ff7327e8
+Create Date: 2026-10-17 09:12:41.305912
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0e27f1fb9c38"  # pragma: allowlist secret
+down_revision = "eda9ff7327e8"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The change feed reads each table in (update_timestamp, email_id) order,
+    # which needs both columns in the index to avoid sorting every change
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_amo_update_timestamp_email_id"),
+            "amo",
+            ["update_timestamp", "email_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_amo_update_timestamp"),
+            table_name="amo",
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_emails_update_timestamp_email_id"),
+            "emails",
+            ["update_timestamp", "email_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_emails_update_timestamp"),
+            table_name="emails",
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_fxa_update_timestamp_email_id"),
+            "fxa",
+            ["update_timestamp", "email_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_fxa_update_timestamp"),
+            table_name="fxa",
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_newsletters_update_timestamp_email_id"),
+            "newsletters",
+            ["update_timestamp", "email_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_newsletters_update_timestamp"),
+            table_name="newsletters",
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_vpn_waitlist_update_timestamp_email_id"),
+            "vpn_waitlist",
+            ["update_timestamp", "email_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_vpn_waitlist_update_timestamp"),
+            table_name="vpn_waitlist",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_vpn_waitlist_update_timestamp"),
+            "vpn_waitlist",
+            ["update_timestamp"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_vpn_waitlist_update_timestamp_email_id"),
+            table_name="vpn_waitlist",
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_newsletters_update_timestamp"),
+            "newsletters",
+            ["update_timestamp"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_newsletters_update_timestamp_email_id"),
+            table_name="newsletters",
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_fxa_update_timestamp"),
+            "fxa",
+            ["update_timestamp"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_fxa_update_timestamp_email_id"),
+            table_name="fxa",
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_emails_update_timestamp"),
+            "emails",
+            ["update_timestamp"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_emails_update_timestamp_email_id"),
+            table_name="emails",
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_amo_update_timestamp"),
+            "amo",
+            ["update_timestamp"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_amo_update_timestamp_email_id"),
+            table_name="amo",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,35 @@
+"""Add index for newsletter subscribers
+
+Revision ID: 685c76621015
+Revises: 09fa33e4977b
+Create Date: 2026-10-17 06:34:51.456301
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "685c76621015"  # pragma: allowlist secret
+down_revision = "09fa33e4977b"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_newsletters_name_subscribed_email_id",
+            "newsletters",
+            ["name", "subscribed", "email_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_newsletters_name_subscribed_email_id",
+            table_name="newsletters",
+            postgresql_concurrently=True,
+        )
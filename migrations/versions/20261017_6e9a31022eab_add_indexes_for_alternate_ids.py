@@ -0,0 +1,85 @@
+"""Add indexes for alternate IDs
+
+Revision ID: 6e9a31022eab
+Revises: 20f05b0d3dc8
+Create Date: 2026-10-17 06:28:30.427121
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "6e9a31022eab"  # pragma: allowlist secret
+down_revision = "20f05b0d3dc8"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY can't run in a transaction, but doesn't block
+    # writes to the tables while the index is built.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_amo_user_id"),
+            "amo",
+            ["user_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_emails_mofo_id"),
+            "emails",
+            ["mofo_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_emails_sfdc_id"),
+            "emails",
+            ["sfdc_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_fxa_primary_email"),
+            "fxa",
+            ["primary_email"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f("ix_newsletters_email_id"),
+            "newsletters",
+            ["email_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_newsletters_email_id"),
+            table_name="newsletters",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_fxa_primary_email"),
+            table_name="fxa",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_emails_sfdc_id"),
+            table_name="emails",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_emails_mofo_id"),
+            table_name="emails",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f("ix_amo_user_id"),
+            table_name="amo",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,58 @@
+"""Add unique index for newsletter names
+
+Revision ID: eda9ff7327e8
+Revises: 685c76621015
+Create Date: 2026-10-17 06:49:08.275609
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "eda9ff7327e8"  # pragma: allowlist secret
+down_revision = "685c76621015"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Needed for ON CONFLICT (email_id, name) when updating newsletters. A
+    # contact could have two rows for a newsletter before, so keep the newest.
+    op.execute(
+        "DELETE FROM newsletters AS older USING newsletters AS newer"
+        " WHERE older.email_id = newer.email_id AND older.name = newer.name"
+        " AND older.id < newer.id"
+    )
+    # If duplicates are added by an older release before the index is built,
+    # CREATE INDEX CONCURRENTLY fails and leaves an INVALID index. Drop it with
+    # "DROP INDEX CONCURRENTLY uix_email_name" and run the upgrade again.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "uix_email_name",
+            "newsletters",
+            ["email_id", "name"],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+        # uix_email_name starts with email_id, so it replaces this index
+        op.drop_index(
+            op.f("ix_newsletters_email_id"),
+            table_name="newsletters",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_newsletters_email_id"),
+            "newsletters",
+            ["email_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "uix_email_name",
+            table_name="newsletters",
+            postgresql_concurrently=True,
+        )
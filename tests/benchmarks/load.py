@@ -0,0 +1,278 @@
+"""
+Load test of a running API server with a weighted mix of requests.
+
+Seeds the database at CTMS_DB_URL with synthetic contacts, then sends
+requests to the server from a fixed number of threads for a fixed time. The
+requests per second and latency percentiles for each kind of request are
+printed as JSON, so that runs against different builds can be compared.
+
+Start the server against the same database, for example with
+"uvicorn ctms.app:app --port 8000", then run
+"python -m tests.benchmarks.load --url http://localhost:8000".
+The contacts are added by ctms.synthetic_data. Unlike the micro-benchmarks,
+the added and created contacts are kept, so use a database just for
+testing. Pass "--contacts 0" to reuse them, or a new --random-seed to add
+more.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import requests
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from ctms.config import Settings
+from ctms.schemas import ContactInSchema
+from ctms.synthetic_data import generate_contact, load_contacts
+
+# Relative weights of each kind of request
+DEFAULT_MIX = {
+    "get_contact": 40,
+    "get_by_fxa_id": 15,
+    "identities": 10,
+    "contact_part": 25,
+    "create": 10,
+}
+CONTACT_PARTS = ("email", "amo", "fxa", "vpn_waitlist")
+
+
+class Target(NamedTuple):
+    """The IDs of an existing contact, used to build requests."""
+
+    email_id: str
+    primary_email: str
+    fxa_id: Optional[str]
+
+
+def load_targets(db, limit: int) -> List[Target]:
+    """
+    Return the IDs of existing contacts.
+
+    The email_ids are random, so the first ones are a fair sample.
+    """
+    rows = db.execute(
+        text(
+            "SELECT emails.email_id, emails.primary_email, fxa.fxa_id"
+            " FROM emails LEFT JOIN fxa ON fxa.email_id = emails.email_id"
+            " ORDER BY emails.email_id LIMIT :limit"
+        ),
+        {"limit": limit},
+    )
+    return [Target(str(row[0]), row[1], row[2]) for row in rows]
+
+
+def build_request(
+    name: str,
+    targets: List[Target],
+    fxa_targets: List[Target],
+    rng: random.Random,
+    new_contact_rng: random.Random,
+):
+    """Return the method, path, query parameters and body of a request."""
+    target = rng.choice(targets)
+    if name == "get_contact":
+        return "GET", f"/ctms/{target.email_id}", None, None
+    if name == "get_by_fxa_id":
+        return "GET", "/ctms", {"fxa_id": rng.choice(fxa_targets).fxa_id}, None
+    if name == "identities":
+        return "GET", "/identities", {"primary_email": target.primary_email}, None
+    if name == "contact_part":
+        part = rng.choice(CONTACT_PARTS)
+        return "GET", f"/contact/{part}/{target.email_id}", None, None
+    if name == "create":
+        contact = ContactInSchema(**generate_contact(new_contact_rng))
+        return "POST", "/ctms", None, contact.json()
+    raise ValueError(f"Unknown request {name}")
+
+
+def run_worker(
+    base_url: str,
+    mix: Dict[str, int],
+    targets: List[Target],
+    fxa_targets: List[Target],
+    rng: random.Random,
+    start_at: float,
+    stop_at: float,
+):
+    """Send requests until stop_at, recording those sent after start_at."""
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    names, weights = list(mix), list(mix.values())
+    # New contacts must differ between runs, so they are not seeded
+    new_contact_rng = random.Random()
+    session = requests.Session()
+    session.headers["Content-Type"] = "application/json"
+    while True:
+        name = rng.choices(names, weights)[0]
+        method, path, params, body = build_request(
+            name, targets, fxa_targets, rng, new_contact_rng
+        )
+        started = time.monotonic()
+        if started >= stop_at:
+            break
+        try:
+            status = str(
+                session.request(
+                    method, base_url + path, params=params, data=body
+                ).status_code
+            )
+        except requests.RequestException:
+            status = "error"
+        finished = time.monotonic()
+        if started >= start_at:
+            latencies[name].append(finished - started)
+            statuses[name][status] += 1
+    return latencies, statuses
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Return the nearest-rank percentile of sorted values."""
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def summarize(latencies: List[float], statuses: Counter, seconds: float) -> dict:
+    """Return the request rate, latency percentiles in ms, and status counts."""
+    latencies = sorted(latencies)
+    summary: Dict[str, Any] = {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / seconds, 1),
+    }
+    if latencies:
+        for percent in (50, 95, 99):
+            summary[f"p{percent}_ms"] = round(percentile(latencies, percent) * 1000, 2)
+        summary["max_ms"] = round(latencies[-1] * 1000, 2)
+    summary["statuses"] = dict(sorted(statuses.items()))
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    """Return the commit being tested, if run from a git checkout."""
+    result = subprocess.run(
+        ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=False
+    )
+    return result.stdout.strip() or None
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """Parse a mix like "get_contact=3,create=1"."""
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown request {name}")
+        mix[name] = int(weight)
+    return mix
+
+
+def main(args: argparse.Namespace) -> dict:
+    if args.contacts:
+        load_contacts(
+            Settings().db_url, args.contacts, seed=args.random_seed, jobs=args.jobs
+        )
+    engine = create_engine(Settings().db_url)
+    db = sessionmaker(bind=engine)()
+    try:
+        targets = load_targets(db, args.targets)
+    finally:
+        db.close()
+        engine.dispose()
+    if not targets:
+        raise SystemExit("No contacts to request, add some with --contacts")
+    fxa_targets = [target for target in targets if target.fxa_id]
+    if "get_by_fxa_id" in args.mix and not fxa_targets:
+        raise SystemExit("No contacts with an fxa_id to request")
+
+    start_at = time.monotonic() + args.warmup
+    stop_at = start_at + args.duration
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        futures = [
+            executor.submit(
+                run_worker,
+                args.url.rstrip("/"),
+                args.mix,
+                targets,
+                fxa_targets,
+                random.Random(f"{args.random_seed}-{index}"),
+                start_at,
+                stop_at,
+            )
+            for index in range(args.concurrency)
+        ]
+        results = [future.result() for future in futures]
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    for worker_latencies, worker_statuses in results:
+        for name, values in worker_latencies.items():
+            latencies[name].extend(values)
+            statuses[name].update(worker_statuses[name])
+    all_statuses: Counter = sum(statuses.values(), Counter())
+    return {
+        "commit": git_commit(),
+        "started": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "contacts": args.contacts,
+            "targets": len(targets),
+            "mix": args.mix,
+        },
+        "total": summarize(
+            [value for values in latencies.values() for value in values],
+            all_statuses,
+            args.duration,
+        ),
+        "endpoints": {
+            name: summarize(latencies[name], statuses[name], args.duration)
+            for name in sorted(latencies)
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8000", help="API server")
+    parser.add_argument(
+        "--contacts", type=int, default=10000, help="Contacts to add first"
+    )
+    parser.add_argument(
+        "--targets", type=int, default=10000, help="Existing contacts to request"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Processes to add contacts",
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="Client threads")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to measure")
+    parser.add_argument(
+        "--warmup", type=float, default=5, help="Seconds before measuring"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help='Request weights, like "get_contact=3,create=1"',
+    )
+    parser.add_argument("--random-seed", type=int, default=0, help="For repeat runs")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+    output = json.dumps(main(args), indent=2) + "\n"
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        sys.stdout.write(output)
@@ -0,0 +1,108 @@
+"""
+Micro-benchmark of the baked contact queries.
+
+Compares the CPU time per call of the baked queries in ctms.crud with the
+same queries built as a new ORM Query on each call. Only this process's CPU
+time is measured, not the time spent waiting on the database.
+
+Run with "python -m tests.benchmarks.queries". It needs a migrated database
+at CTMS_DB_URL. The sample contact is added in a transaction that is rolled
+back, so the database is left unchanged.
+"""
+import argparse
+import time
+from uuid import UUID
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ctms.config import Settings
+from ctms.crud import (
+    ALT_ID_FILTERS,
+    bakery,
+    contact_data,
+    contacts_by_any_id_query,
+    contacts_query,
+    create_contact,
+    get_contact_by_email_id,
+)
+from ctms.models import Email
+from ctms.sample_data import SAMPLE_CONTACTS
+
+
+def unbaked_contact_by_email_id(db, email_id):
+    return contact_data(contacts_query(db).filter(Email.email_id == email_id).first())
+
+
+def unbaked_contacts_by_any_id(db, **ids):
+    query = contacts_by_any_id_query(db)
+    for name in ids:
+        query = ALT_ID_FILTERS[name](query)
+    return query.params(**ids).all()
+
+
+def baked_contacts_by_any_id(db, **ids):
+    query = bakery(contacts_by_any_id_query)
+    for name in ids:
+        query += ALT_ID_FILTERS[name]
+    return query(db).params(**ids).all()
+
+
+def cpu_per_call(func, count: int) -> float:
+    """Return the CPU seconds per call, after a warm up call."""
+    func()
+    start = time.process_time()
+    for _ in range(count):
+        func()
+    return (time.process_time() - start) / count
+
+
+def main(count: int) -> None:
+    engine = create_engine(Settings().db_url)
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = sessionmaker(bind=connection)()
+    try:
+        email_id = UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+        contact = SAMPLE_CONTACTS[email_id]
+        create_contact(db, email_id, contact)
+        db.flush()
+
+        fxa_id = {"fxa_id": contact.fxa.fxa_id}
+        two_ids = {"sfdc_id": contact.email.sfdc_id, "mofo_id": contact.email.mofo_id}
+        cases = (
+            (
+                "contact by email_id",
+                lambda: unbaked_contact_by_email_id(db, email_id),
+                lambda: get_contact_by_email_id(db, email_id),
+            ),
+            (
+                "contacts by fxa_id",
+                lambda: unbaked_contacts_by_any_id(db, **fxa_id),
+                lambda: baked_contacts_by_any_id(db, **fxa_id),
+            ),
+            (
+                "contacts by sfdc_id and mofo_id",
+                lambda: unbaked_contacts_by_any_id(db, **two_ids),
+                lambda: baked_contacts_by_any_id(db, **two_ids),
+            ),
+        )
+        print(f"{'query':<32} {'unbaked':>10} {'baked':>10} {'saved':>6}")
+        for name, unbaked, baked in cases:
+            before = cpu_per_call(unbaked, count)
+            after = cpu_per_call(baked, count)
+            print(
+                f"{name:<32} {before * 1e6:>8.0f}us {after * 1e6:>8.0f}us"
+                f" {1 - after / before:>6.0%}"
+            )
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=2000, help="Calls per query")
+    main(parser.parse_args().count)
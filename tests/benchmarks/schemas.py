@@ -0,0 +1,141 @@
+"""
+Micro-benchmarks of building, comparing and encoding the contact schemas.
+
+Measures the CPU time per call of the schema code that runs on each request:
+a ContactSchema built from the data of a database row, as_identity_response,
+EmailSchema equality, the EmailStr and HttpUrl validators, and encoding a
+contact as JSON. Each case is timed several times, and the best is kept.
+
+Run with "python -m tests.benchmarks.schemas". No database is needed, the
+row data is built from the maximal sample contact. To check a change for
+regressions, save a baseline before the change, and compare after it:
+
+python -m tests.benchmarks.schemas --save before.json
+python -m tests.benchmarks.schemas --compare before.json --threshold 0.2
+
+The comparison exits with status 1 if a case is slower than the baseline by
+more than the threshold. Timings depend on the machine, so only compare runs
+from the same machine.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Callable, Dict, List
+from uuid import UUID
+
+import pydantic
+from pydantic import EmailStr
+
+from ctms.models import AmoAccount, Email, FirefoxAccount, VpnWaitlist
+from ctms.sample_data import SAMPLE_CONTACTS
+from ctms.schemas import ContactSchema, EmailSchema, NewsletterSchema
+
+
+def row_data(contact: ContactSchema) -> dict:
+    """Return the data that get_contact_by_email_id returns for a contact."""
+    email_id = contact.email.email_id
+    return {
+        "amo": AmoAccount(email_id=email_id, **contact.amo.dict()),
+        "email": Email(**contact.email.dict()),
+        "fxa": FirefoxAccount(email_id=email_id, **contact.fxa.dict()),
+        # Newsletters are aggregated as JSON by the query
+        "newsletters": [json.loads(item.json()) for item in contact.newsletters],
+        "vpn_waitlist": VpnWaitlist(email_id=email_id, **contact.vpn_waitlist.dict()),
+        "update_timestamp": contact.email.update_timestamp,
+    }
+
+
+def get_cases() -> Dict[str, Callable]:
+    contact = SAMPLE_CONTACTS[UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")]
+    data = row_data(contact)
+    same_email = EmailSchema(**contact.email.dict())
+    newsletter = {"name": "mozilla-welcome", "subscribed": True, "lang": "en"}
+    newsletter_with_source = dict(newsletter, source="https://www.mozilla.org/en-US/")
+    return {
+        "contact from row": lambda: ContactSchema(**data),
+        "as_identity_response": contact.as_identity_response,
+        "EmailSchema ==": lambda: contact.email == same_email,
+        "EmailStr": lambda: EmailStr.validate(contact.email.primary_email),
+        "newsletter": lambda: NewsletterSchema(**newsletter),
+        "newsletter with source": lambda: NewsletterSchema(**newsletter_with_source),
+        "contact json": contact.json,
+    }
+
+
+def best_cpu_per_call(func: Callable, count: int, repeat: int) -> float:
+    """Return the lowest CPU seconds per call of several runs, after a warm up."""
+    func()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        for _ in range(count):
+            func()
+        best = min(best, (time.process_time() - start) / count)
+    return best
+
+
+def find_regressions(
+    results: Dict[str, float], baseline: Dict[str, float], threshold: float
+) -> List[str]:
+    """Return the cases slower than the baseline by more than the threshold."""
+    return [
+        name
+        for name, seconds in results.items()
+        if name in baseline and seconds > baseline[name] * (1 + threshold)
+    ]
+
+
+def main(args: argparse.Namespace) -> int:
+    results = {
+        name: best_cpu_per_call(func, args.count, args.repeat)
+        for name, func in get_cases().items()
+    }
+
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "pydantic": pydantic.VERSION,
+                    "results": results,
+                },
+                baseline_file,
+                indent=2,
+            )
+
+    if not args.compare:
+        print(f"{'case':<24} {'time':>10}")
+        for name, seconds in results.items():
+            print(f"{name:<24} {seconds * 1e6:>8.1f}us")
+        return 0
+
+    with open(args.compare) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+    regressions = find_regressions(results, baseline, args.threshold)
+    print(f"{'case':<24} {'baseline':>10} {'time':>10} {'change':>7}")
+    for name, seconds in results.items():
+        if name in baseline:
+            before = f"{baseline[name] * 1e6:>8.1f}us"
+            change = f"{seconds / baseline[name] - 1:>+7.0%}"
+        else:
+            before, change = f"{'-':>10}", f"{'new':>7}"
+        flag = " SLOWER" if name in regressions else ""
+        print(f"{name:<24} {before} {seconds * 1e6:>8.1f}us {change}{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=2000, help="Calls per run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case")
+    parser.add_argument("--save", help="Save the timings as a baseline to this file")
+    parser.add_argument("--compare", help="Compare with the baseline in this file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown from the baseline, 0.2 for 20%%",
+    )
+    sys.exit(main(parser.parse_args()))
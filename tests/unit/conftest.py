@@ -1,16 +1,20 @@
 """pytest fixtures for the CTMS app"""
+import asyncio
 from uuid import UUID
 
 import pytest
 from fastapi.testclient import TestClient
 from pydantic import PostgresDsn
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy_utils.functions import create_database, database_exists, drop_database
 
-from ctms.app import app, get_db
+from ctms.app import app, get_contact_cache, get_db, get_identity_cache, get_settings
+from ctms.cache import ContactCache, IdentityCache, MemoryCache
 from ctms.config import Settings
 from ctms.crud import create_contact
+from ctms.database import get_async_db_engine, track_query_stats, untrack_query_stats
 from ctms.models import Base
 from ctms.sample_data import SAMPLE_CONTACTS
 
@@ -20,6 +24,41 @@ def client():
     return TestClient(app)
 
 
+@pytest.fixture
+def override_settings():
+    """Return a function that replaces the app settings for the test."""
+
+    def override(**kwargs):
+        app.dependency_overrides[get_settings] = lambda: Settings(**kwargs)
+
+    yield override
+    app.dependency_overrides.pop(get_settings, None)
+
+
+@pytest.fixture
+def negative_cache():
+    """Return the in-memory backend for unknown IDs, shared by the caches."""
+    return MemoryCache(max_size=100, ttl=10)
+
+
+@pytest.fixture
+def contact_cache(negative_cache):
+    """Return an in-memory contact cache used by the app for the test."""
+    cache = ContactCache(MemoryCache(max_size=100, ttl=60), negative_cache)
+    app.dependency_overrides[get_contact_cache] = lambda: cache
+    yield cache
+    app.dependency_overrides.pop(get_contact_cache, None)
+
+
+@pytest.fixture
+def identity_cache(negative_cache):
+    """Return an in-memory alternate ID cache used by the app for the test."""
+    cache = IdentityCache(MemoryCache(max_size=100, ttl=60), negative_cache)
+    app.dependency_overrides[get_identity_cache] = lambda: cache
+    yield cache
+    app.dependency_overrides.pop(get_identity_cache, None)
+
+
 @pytest.fixture(scope="session")
 def engine(pytestconfig):
     """Return a SQLAlchemy engine for a fresh test database."""
@@ -54,6 +93,13 @@ def engine(pytestconfig):
 
     # TODO: Convert to running alembic migrations
     Base.metadata.create_all(bind=test_engine)
+    # The query plan tests expect tables that were never analyzed. Autovacuum
+    # would change the plans partway through a run, after rollbacks.
+    with test_engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            connection.execute(
+                f"ALTER TABLE {table.name} SET (autovacuum_enabled = false)"
+            )
 
     yield test_engine
     test_engine.dispose()
@@ -64,10 +110,43 @@ def engine(pytestconfig):
 @pytest.fixture
 def connection(engine):
     """Return a connection to the database that rolls back automatically."""
-    with engine.begin() as connection:
-        savepoint = connection.begin_nested()
+    with engine.connect() as connection:
+        transaction = connection.begin()
         yield connection
-        savepoint.rollback()
+        transaction.rollback()
+
+
+@pytest.fixture
+def statements(connection):
+    """Return the (SQL statement, parameters) executed on the test connection."""
+    executed = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        executed.append((statement, parameters))
+
+    event.listen(connection, "before_cursor_execute", record_statement)
+    yield executed
+    event.remove(connection, "before_cursor_execute", record_statement)
+
+
+@pytest.fixture
+def tracked_connection(connection):
+    """Count the statements run on the test connection, like the app engine."""
+    track_query_stats(connection)
+    yield connection
+    untrack_query_stats(connection)
+
+
+def keep_in_savepoint(db: Session) -> None:
+    """Run a session in a savepoint, started again when the app commits or rolls back."""
+    db.begin_nested()
+    db.connection()
+
+    @event.listens_for(db, "after_transaction_end")
+    def restart_savepoint(session, transaction):
+        if transaction.nested and not transaction._parent.nested:
+            session.begin_nested()
+            session.connection()
 
 
 @pytest.fixture
@@ -75,17 +154,64 @@ def dbsession(connection):
     """Return a database session that rolls back."""
     test_sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=connection)
     db = test_sessionmaker()
+    keep_in_savepoint(db)
+
+    def test_get_db():
+        yield db
+
+    app.dependency_overrides[get_db] = test_get_db
+    yield db
+    del app.dependency_overrides[get_db]
+
+
+@pytest.fixture
+def run_async():
+    """Return a function that runs a coroutine on the TestClient's event loop."""
+    return asyncio.get_event_loop().run_until_complete
+
+
+@pytest.fixture
+def async_engine(engine, run_async):
+    """Return an asyncpg engine for the test database."""
+    pytest.importorskip("asyncpg")
+    async_engine, _ = get_async_db_engine(Settings(db_url=str(engine.url)))
+    yield async_engine
+    run_async(async_engine.dispose())
+
+
+@pytest.fixture
+def async_dbsession(async_engine, run_async):
+    """Return an AsyncSession that rolls back, used by the app in async mode."""
+    connection = run_async(async_engine.connect())
+    transaction = run_async(connection.begin())
+    db = AsyncSession(bind=connection, autoflush=False)
+    run_async(db.run_sync(keep_in_savepoint))
 
     def test_get_db():
-        db.begin_nested()
-        try:
-            yield db
-        finally:
-            db.close()
+        yield db
 
     app.dependency_overrides[get_db] = test_get_db
     yield db
     del app.dependency_overrides[get_db]
+    run_async(transaction.rollback())
+    run_async(connection.close())
+
+
+@pytest.fixture
+def async_contacts(async_dbsession, run_async):
+    """Add the minimal, maximal and example contacts with the AsyncSession."""
+    contacts = {
+        email_id: SAMPLE_CONTACTS[email_id]
+        for email_id in (
+            UUID("93db83d4-4119-4e0c-af87-a713786fa81d"),
+            UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a"),
+            UUID("332de237-cab7-4461-bcc3-48e68f42bd5c"),
+        )
+    }
+    for email_id, contact in contacts.items():
+        run_async(async_dbsession.run_sync(create_contact, email_id, contact))
+    run_async(async_dbsession.commit())
+    return contacts
 
 
 @pytest.fixture
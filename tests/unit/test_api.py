@@ -1,9 +1,14 @@
 """pytest tests for API functionality"""
+import json
 from uuid import UUID
 
 import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ctms.crud import get_contacts_by_any_id
+from ctms.app import app, get_recent_writes, get_replicas
+from ctms.cache import MemoryCache, RecentWrites
+from ctms.crud import get_contact_by_email_id, get_contacts_by_any_id
+from ctms.database import ReplicaSession
 from ctms.models import Email
 from ctms.sample_data import SAMPLE_CONTACTS
 from ctms.schemas import ContactSchema
@@ -379,6 +384,46 @@ def test_create_basic_idempotent(client, dbsession):
     assert saved_contact.email == sample.email
 
 
+def test_create_idempotent_newsletter_order(client, dbsession):
+    """A retried create matches when the newsletters are not in name order."""
+    email_id = UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+    sample = SAMPLE_CONTACTS[email_id].copy(deep=True)
+    sample.newsletters = sorted(
+        sample.newsletters, key=lambda newsletter: newsletter.name, reverse=True
+    )
+    assert len(sample.newsletters) > 1
+    resp = client.post("/ctms", sample.json())
+    assert resp.status_code == 200
+    resp = client.post("/ctms", sample.json())
+    assert resp.status_code == 200
+
+
+def test_create_statements(client, dbsession, statements):
+    """A new contact is created without reading first."""
+    email_id = UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+    statements.clear()
+    resp = client.post("/ctms", SAMPLE_CONTACTS[email_id].json())
+    assert resp.status_code == 200
+    sql = [sql.split()[0] for sql, _ in statements if not sql.startswith("SAVEPOINT")]
+    assert "SELECT" not in sql
+    assert sql.count("INSERT") == 5
+    email_insert = next(sql for sql, _ in statements if "INTO emails" in sql)
+    assert "ON CONFLICT DO NOTHING" in email_insert
+
+
+def test_create_retry_statements(client, dbsession, statements):
+    """A retried create tries to insert, then reads the contact once to compare."""
+    email_id = UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+    sample = SAMPLE_CONTACTS[email_id]
+    assert client.post("/ctms", sample.json()).status_code == 200
+    statements.clear()
+    resp = client.post("/ctms", sample.json())
+    assert resp.status_code == 200
+    sql = [sql.split()[0] for sql, _ in statements if not sql.startswith("SAVEPOINT")]
+    assert sql.count("INSERT") == 1
+    assert sql.count("SELECT") == 1
+
+
 def test_create_basic_with_id_collision(client, dbsession):
     """Creating a contact with the same id but different data fails."""
     email_id = UUID("d1da1c99-fe09-44db-9c68-78a75752574d")
@@ -448,3 +493,889 @@ def test_create_basic_with_email_collision(client, dbsession):
     assert len(saved) == 1
     saved_contact = ContactSchema(**saved[0])
     assert saved_contact.email == orig_sample.email
+
+
+def test_get_ctms_batch(client, sample_contacts, statements):
+    """POST /ctms/batch returns the found contacts and the missing IDs."""
+    minimal_id, _ = sample_contacts["minimal"]
+    maximal_id, _ = sample_contacts["maximal"]
+    unknown_id = "cad092ec-a71a-4df5-aa92-517959caeecb"
+    minimal_json = client.get(f"/ctms/{minimal_id}").json()
+    maximal_json = client.get(f"/ctms/{maximal_id}").json()
+    statements.clear()
+
+    email_ids = [str(maximal_id), unknown_id, str(minimal_id), str(maximal_id)]
+    resp = client.post("/ctms/batch", json={"email_ids": email_ids})
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "contacts": {str(minimal_id): minimal_json, str(maximal_id): maximal_json},
+        "missing": [unknown_id],
+    }
+    selects = [sql for sql, _ in statements if sql.startswith("SELECT")]
+    assert len(selects) == 1
+
+
+def test_get_ctms_batch_empty(client, dbsession):
+    """POST /ctms/batch with no email_ids returns no contacts."""
+    resp = client.post("/ctms/batch", json={"email_ids": []})
+    assert resp.status_code == 200
+    assert resp.json() == {"contacts": {}, "missing": []}
+
+
+def test_get_ctms_batch_too_large(client, dbsession, override_settings):
+    """POST /ctms/batch with more than the configured limit is an error."""
+    override_settings(batch_lookup_max=2)
+    email_ids = [
+        "67e52c77-950f-4f28-accb-bb3ea1a2c51a",
+        "93db83d4-4119-4e0c-af87-a713786fa81d",
+        "332de237-cab7-4461-bcc3-48e68f42bd5c",
+    ]
+    resp = client.post("/ctms/batch", json={"email_ids": email_ids})
+    assert resp.status_code == 400
+    assert resp.json() == {
+        "detail": "Too many email_ids, the limit is 2 but 3 were requested"
+    }
+
+
+def bulk_contacts(*email_ids):
+    """Return sample contacts as JSON-ready dicts for POST /ctms/bulk"""
+    return [
+        json.loads(SAMPLE_CONTACTS[UUID(email_id)].json()) for email_id in email_ids
+    ]
+
+
+def test_create_bulk(client, dbsession, statements):
+    """POST /ctms/bulk creates contacts with one INSERT per table."""
+    email_ids = [
+        "67e52c77-950f-4f28-accb-bb3ea1a2c51a",
+        "332de237-cab7-4461-bcc3-48e68f42bd5c",
+        "d1da1c99-fe09-44db-9c68-78a75752574d",
+    ]
+    resp = client.post("/ctms/bulk", json=bulk_contacts(*email_ids))
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "results": [
+            {"email_id": email_id, "status": "created"} for email_id in email_ids
+        ]
+    }
+    inserts = [sql for sql, _ in statements if sql.startswith("INSERT")]
+    assert len(inserts) == 5
+
+    for email_id in email_ids:
+        sample = SAMPLE_CONTACTS[UUID(email_id)]
+        saved = ContactSchema(**get_contact_by_email_id(dbsession, email_id))
+        assert saved.email == sample.email
+        assert saved.amo == sample.amo
+        assert saved.fxa == sample.fxa
+        assert saved.newsletters == sample.newsletters
+        assert saved.vpn_waitlist == sample.vpn_waitlist
+
+
+def test_create_bulk_generates_ids(client, dbsession):
+    """POST /ctms/bulk generates missing email_ids."""
+    contacts = bulk_contacts("d1da1c99-fe09-44db-9c68-78a75752574d")
+    contacts[0]["email"]["email_id"] = None
+    resp = client.post("/ctms/bulk", json=contacts)
+    assert resp.status_code == 200
+    (result,) = resp.json()["results"]
+    assert result["status"] == "created"
+    assert result["email_id"] != "d1da1c99-fe09-44db-9c68-78a75752574d"
+    saved = get_contact_by_email_id(dbsession, result["email_id"])
+    assert saved["email"].primary_email == contacts[0]["email"]["primary_email"]
+
+
+def test_create_bulk_conflicts(client, minimal_contact, dbsession):
+    """POST /ctms/bulk reports conflicts and creates the other contacts."""
+    contacts = bulk_contacts(
+        "93db83d4-4119-4e0c-af87-a713786fa81d",  # Already exists
+        "67e52c77-950f-4f28-accb-bb3ea1a2c51a",
+        "67e52c77-950f-4f28-accb-bb3ea1a2c51a",  # Duplicate email_id
+        "332de237-cab7-4461-bcc3-48e68f42bd5c",
+        "332de237-cab7-4461-bcc3-48e68f42bd5c",
+        "d1da1c99-fe09-44db-9c68-78a75752574d",
+    )
+    # Same primary_email as the minimal contact
+    contacts[3]["email"]["primary_email"] = minimal_contact.email.primary_email
+    # Same fxa_id as the maximal contact
+    contacts[4]["email"]["email_id"] = "229cfa16-a8c9-4028-a9bd-fe746dc6bf73"
+    contacts[4]["email"]["primary_email"] = "fxa-dupe@example.com"
+    contacts[4]["email"]["basket_token"] = "df9f7086-4949-4b2d-8fcf-49167f8f783d"
+    contacts[4]["fxa"]["fxa_id"] = contacts[1]["fxa"]["fxa_id"]
+
+    resp = client.post("/ctms/bulk", json=contacts)
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "results": [
+            {"email_id": "93db83d4-4119-4e0c-af87-a713786fa81d", "status": "conflict"},
+            {"email_id": "67e52c77-950f-4f28-accb-bb3ea1a2c51a", "status": "created"},
+            {"email_id": "67e52c77-950f-4f28-accb-bb3ea1a2c51a", "status": "conflict"},
+            {"email_id": "332de237-cab7-4461-bcc3-48e68f42bd5c", "status": "conflict"},
+            {"email_id": "229cfa16-a8c9-4028-a9bd-fe746dc6bf73", "status": "conflict"},
+            {"email_id": "d1da1c99-fe09-44db-9c68-78a75752574d", "status": "created"},
+        ]
+    }
+    assert get_contact_by_email_id(dbsession, contacts[3]["email"]["email_id"]) is None
+    assert get_contact_by_email_id(dbsession, contacts[4]["email"]["email_id"]) is None
+    existing = get_contact_by_email_id(dbsession, contacts[0]["email"]["email_id"])
+    assert ContactSchema(**existing).email == minimal_contact.email
+
+
+def test_create_bulk_duplicate_newsletters(client, dbsession):
+    """POST /ctms/bulk keeps the last of the newsletters with the same name."""
+    contacts = bulk_contacts("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+    newsletter = contacts[0]["newsletters"][0]
+    assert not newsletter["subscribed"]
+    contacts[0]["newsletters"].append(dict(newsletter, subscribed=True))
+    resp = client.post("/ctms/bulk", json=contacts)
+    assert resp.status_code == 200
+    (result,) = resp.json()["results"]
+    assert result["status"] == "created"
+    saved = ContactSchema(**get_contact_by_email_id(dbsession, result["email_id"]))
+    same_name = [nl for nl in saved.newsletters if nl.name == newsletter["name"]]
+    assert len(same_name) == 1
+    assert same_name[0].subscribed
+
+
+def test_create_bulk_too_large(client, dbsession, override_settings):
+    """POST /ctms/bulk with more than the configured limit is an error."""
+    override_settings(bulk_create_max=1)
+    contacts = bulk_contacts(
+        "67e52c77-950f-4f28-accb-bb3ea1a2c51a", "d1da1c99-fe09-44db-9c68-78a75752574d"
+    )
+    resp = client.post("/ctms/bulk", json=contacts)
+    assert resp.status_code == 400
+    assert resp.json() == {
+        "detail": "Too many contacts, the limit is 1 but 2 were sent"
+    }
+
+
+@pytest.fixture
+def updated_contacts(dbsession, sample_contacts):
+    """
+    Set known update timestamps on the sample contacts.
+
+    All rows are updated in 2020, and then:
+    * maximal: AMO updated 2021-03-01
+    * minimal: email updated 2021-02-01
+    * example: a newsletter updated 2021-03-01
+    """
+    for table in ("emails", "amo", "fxa", "vpn_waitlist", "newsletters"):
+        dbsession.execute(f"UPDATE {table} SET update_timestamp = '2020-06-01Z'")
+    changes = (
+        ("amo", "maximal", "2021-03-01Z"),
+        ("emails", "minimal", "2021-02-01Z"),
+        ("newsletters", "example", "2021-03-01Z"),
+    )
+    for table, name, timestamp in changes:
+        email_id, _ = sample_contacts[name]
+        dbsession.execute(
+            f"UPDATE {table} SET update_timestamp = :timestamp"
+            " WHERE email_id = :email_id",
+            {"timestamp": timestamp, "email_id": email_id},
+        )
+    dbsession.commit()
+    return sample_contacts
+
+
+def test_get_updates(client, updated_contacts):
+    """GET /updates returns contacts changed in any table, oldest first."""
+    example_id, _ = updated_contacts["example"]
+    maximal_id, _ = updated_contacts["maximal"]
+    minimal_id, _ = updated_contacts["minimal"]
+    # The example and maximal contacts have the same timestamp, sorted by ID
+    first_id, second_id = sorted([str(example_id), str(maximal_id)])
+    resp = client.get("/updates", params={"since": "2021-01-01T00:00:00Z"})
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "updates": [
+            {
+                "email_id": str(minimal_id),
+                "update_timestamp": "2021-02-01T00:00:00+00:00",
+                "contact": None,
+            },
+            {
+                "email_id": first_id,
+                "update_timestamp": "2021-03-01T00:00:00+00:00",
+                "contact": None,
+            },
+            {
+                "email_id": second_id,
+                "update_timestamp": "2021-03-01T00:00:00+00:00",
+                "contact": None,
+            },
+        ],
+        "next_since": "2021-03-01T00:00:00+00:00",
+        "next_after": second_id,
+    }
+
+
+def test_get_updates_paginated(client, updated_contacts):
+    """GET /updates pages through changes with the since and after cursor."""
+    params = {"since": "2021-01-01T00:00:00Z", "limit": 2}
+    seen = []
+    for _ in range(3):
+        resp = client.get("/updates", params=params)
+        assert resp.status_code == 200
+        data = resp.json()
+        seen.extend(update["email_id"] for update in data["updates"])
+        params["since"] = data["next_since"]
+        params["after"] = data["next_after"]
+    assert len(seen) == 3
+    assert len(set(seen)) == 3
+    assert data["updates"] == []
+
+
+def test_get_updates_at_least_once(client, dbsession, updated_contacts):
+    """GET /updates returns a contact again for a later change in another table."""
+    example_id, _ = updated_contacts["example"]
+    maximal_id, _ = updated_contacts["maximal"]
+    dbsession.execute(
+        "UPDATE emails SET update_timestamp = '2021-02-15Z' WHERE email_id = :email_id",
+        {"email_id": maximal_id},
+    )
+    dbsession.commit()
+
+    resp = client.get("/updates", params={"since": "2021-02-10T00:00:00Z"})
+    assert resp.status_code == 200
+    page1 = resp.json()
+    changes = [
+        (item["email_id"], item["update_timestamp"]) for item in page1["updates"]
+    ]
+    # Within a page, a contact is returned at its earliest change
+    assert changes == [
+        (str(maximal_id), "2021-02-15T00:00:00+00:00"),
+        (str(example_id), "2021-03-01T00:00:00+00:00"),
+    ]
+
+    # A page that ends before the later change returns the contact again
+    params = {"since": "2021-02-10T00:00:00Z", "limit": 1}
+    resp = client.get("/updates", params=params)
+    page1 = resp.json()
+    assert [item["email_id"] for item in page1["updates"]] == [str(maximal_id)]
+    params.update(since=page1["next_since"], after=page1["next_after"], limit=2)
+    resp = client.get("/updates", params=params)
+    page2 = resp.json()
+    first_id, second_id = sorted([str(example_id), str(maximal_id)])
+    assert [item["email_id"] for item in page2["updates"]] == [first_id, second_id]
+
+
+def test_get_updates_full(client, updated_contacts):
+    """GET /updates?full=true includes the contacts."""
+    minimal_id, _ = updated_contacts["minimal"]
+    minimal_json = client.get(f"/ctms/{minimal_id}").json()
+    resp = client.get(
+        "/updates", params={"since": "2021-02-01T00:00:00Z", "limit": 1, "full": True}
+    )
+    assert resp.status_code == 200
+    (update,) = resp.json()["updates"]
+    assert update["contact"] == minimal_json
+
+
+def test_get_updates_limit_too_large(client, dbsession, override_settings):
+    """GET /updates with a limit over the maximum is an error."""
+    override_settings(updates_max=10)
+    resp = client.get("/updates", params={"since": "2021-01-01T00:00:00Z", "limit": 11})
+    assert resp.status_code == 400
+    assert resp.json() == {"detail": "limit is too large, the maximum is 10"}
+
+
+def test_get_newsletter_subscribers(client, sample_contacts):
+    """GET /newsletters/{name}/subscribers pages through the subscribers."""
+    minimal_id, _ = sample_contacts["minimal"]
+    maximal_id, _ = sample_contacts["maximal"]
+    expected = sorted([str(minimal_id), str(maximal_id)])
+    url = "/newsletters/mozilla-foundation/subscribers"
+
+    resp = client.get(url, params={"limit": 1})
+    assert resp.status_code == 200
+    page1 = resp.json()
+    assert page1["email_ids"] == expected[:1]
+    assert page1["next_cursor"]
+
+    resp = client.get(url, params={"limit": 1, "cursor": page1["next_cursor"]})
+    assert resp.status_code == 200
+    page2 = resp.json()
+    assert page2["email_ids"] == expected[1:]
+
+    resp = client.get(url, params={"limit": 1, "cursor": page2["next_cursor"]})
+    assert resp.status_code == 200
+    assert resp.json() == {"email_ids": [], "next_cursor": None}
+
+
+def test_get_newsletter_subscribers_last_page(client, sample_contacts):
+    """GET /newsletters/{name}/subscribers has no cursor on a short page."""
+    resp = client.get("/newsletters/mozilla-foundation/subscribers")
+    assert resp.status_code == 200
+    data = resp.json()
+    assert len(data["email_ids"]) == 2
+    assert data["next_cursor"] is None
+
+
+def test_get_newsletter_unsubscribed(client, sample_contacts):
+    """GET /newsletters/{name}/subscribers?subscribed=false gets former subscribers."""
+    maximal_id, _ = sample_contacts["maximal"]
+    resp = client.get(
+        "/newsletters/ambassadors/subscribers", params={"subscribed": False}
+    )
+    assert resp.status_code == 200
+    assert resp.json() == {"email_ids": [str(maximal_id)], "next_cursor": None}
+
+
+def test_get_newsletter_subscribers_bad_cursor(client, dbsession):
+    """GET /newsletters/{name}/subscribers with an invalid cursor is an error."""
+    resp = client.get(
+        "/newsletters/mozilla-foundation/subscribers", params={"cursor": "not-a-cursor"}
+    )
+    assert resp.status_code == 400
+    assert resp.json() == {"detail": "Invalid cursor"}
+
+
+def test_get_ctms_cached(client, maximal_contact, contact_cache, statements):
+    """GET /ctms/{email_id} fills the cache, and later reads skip the database."""
+    email_id = maximal_contact.email.email_id
+    resp = client.get(f"/ctms/{email_id}")
+    assert resp.status_code == 200
+    statements.clear()
+    cached_resp = client.get(f"/ctms/{email_id}")
+    assert cached_resp.status_code == 200
+    assert cached_resp.json() == resp.json()
+    assert statements == []
+    assert contact_cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize(
+    "path",
+    (
+        "/identity/{}",
+        "/contact/email/{}",
+        "/contact/amo/{}",
+        "/contact/vpn_waitlist/{}",
+        "/contact/fxa/{}",
+    ),
+)
+def test_get_cached_contact_parts(
+    client, minimal_contact, contact_cache, statements, path
+):
+    """Identity and subgroup endpoints are served from a cached contact."""
+    email_id = minimal_contact.email.email_id
+    url = path.format(email_id)
+    uncached = client.get(url).json()
+    client.get(f"/ctms/{email_id}")
+    statements.clear()
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.json() == uncached
+    assert statements == []
+
+
+def test_create_invalidates_cache(client, dbsession, contact_cache):
+    """POST /ctms removes a stale contact from the cache."""
+    email_id = UUID("93db83d4-4119-4e0c-af87-a713786fa81d")
+    contact = SAMPLE_CONTACTS[email_id]
+    stale = contact.copy(deep=True)
+    stale.email.primary_email = "stale@example.com"
+    contact_cache.set(email_id, stale)
+    resp = client.post("/ctms", contact.json())
+    assert resp.status_code == 200
+    assert contact_cache.get(email_id) is None
+    resp = client.get(f"/ctms/{email_id}")
+    assert resp.json()["email"]["primary_email"] == contact.email.primary_email
+
+
+@pytest.mark.parametrize(
+    "path",
+    (
+        "/ctms/{}",
+        "/identity/{}",
+        "/contact/email/{}",
+        "/contact/amo/{}",
+        "/contact/vpn_waitlist/{}",
+        "/contact/fxa/{}",
+    ),
+)
+def test_get_unknown_cached(client, dbsession, contact_cache, statements, path):
+    """A 404 for an unknown email_id is remembered, and repeats skip the database."""
+    url = path.format("cad092ec-a71a-4df5-aa92-517959caeecb")
+    resp = client.get(url)
+    assert resp.status_code == 404
+    statements.clear()
+    resp = client.get(url)
+    assert resp.status_code == 404
+    assert resp.json() == {"detail": "Unknown email_id"}
+    assert statements == []
+
+
+def test_create_clears_unknown_cached(client, dbsession, contact_cache):
+    """POST /ctms makes a recently unknown email_id visible immediately."""
+    email_id = UUID("93db83d4-4119-4e0c-af87-a713786fa81d")
+    assert client.get(f"/ctms/{email_id}").status_code == 404
+    resp = client.post("/ctms", SAMPLE_CONTACTS[email_id].json())
+    assert resp.status_code == 200
+    assert client.get(f"/ctms/{email_id}").status_code == 200
+
+
+@pytest.mark.parametrize(
+    "path", ("/ctms/{}", "/identity/{}", "/contact/email/{}", "/contact/fxa/{}")
+)
+def test_get_unknown_from_replica_not_cached(
+    client, dbsession, contact_cache, replicas, path
+):
+    """A 404 read from a replica is not remembered, since the replica may lag."""
+    email_id = UUID("cad092ec-a71a-4df5-aa92-517959caeecb")
+    assert client.get(path.format(email_id)).status_code == 404
+    assert replicas.connections == 1
+    assert not contact_cache.is_missing(email_id)
+
+
+def test_get_identities_unknown_from_replica_not_cached(
+    client, dbsession, identity_cache, replicas
+):
+    """An unknown alternate ID read from a replica is not remembered."""
+    resp = client.get("/identities", params={"fxa_id": "unknown-fxa-id"})
+    assert resp.json() == []
+    assert replicas.connections == 1
+    assert not identity_cache.is_missing("fxa_id", "unknown-fxa-id")
+
+
+@pytest.mark.parametrize("path", ("/ctms/{}", "/identity/{}"))
+def test_get_etag(client, maximal_contact, path, statements):
+    """A contact GET returns an ETag, and a matching If-None-Match gets a 304."""
+    url = path.format(maximal_contact.email.email_id)
+    resp = client.get(url)
+    assert resp.status_code == 200
+    etag = resp.headers["ETag"]
+    assert etag.startswith('"')
+
+    statements.clear()
+    resp = client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.headers["ETag"] == etag
+    assert resp.content == b""
+    selects = [sql for sql, _ in statements if sql.startswith("SELECT")]
+    assert len(selects) == 1
+    assert "json_agg" not in selects[0]
+
+
+@pytest.mark.parametrize(
+    "if_none_match", ('"other"', 'W/"other", {etag}', "*", "W/{etag}")
+)
+def test_get_etag_if_none_match_forms(client, minimal_contact, if_none_match):
+    """If-None-Match can be a list, a weak tag or a wildcard."""
+    url = f"/ctms/{minimal_contact.email.email_id}"
+    etag = client.get(url).headers["ETag"]
+    resp = client.get(url, headers={"If-None-Match": if_none_match.format(etag=etag)})
+    assert resp.status_code == (200 if if_none_match == '"other"' else 304)
+
+
+def test_get_etag_changes_with_newsletter(client, minimal_contact, dbsession):
+    """Adding a newsletter changes the contact's ETag."""
+    email_id = minimal_contact.email.email_id
+    url = f"/ctms/{email_id}"
+    etag = client.get(url).headers["ETag"]
+    dbsession.execute(
+        "INSERT INTO newsletters (email_id, name, subscribed, format, update_timestamp)"
+        " VALUES (:email_id, 'new-newsletter', true, 'H', now() + interval '1 second')",
+        {"email_id": str(email_id)},
+    )
+    resp = client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+def test_get_etag_cached(client, minimal_contact, contact_cache, statements):
+    """A cached contact is returned with its ETag, and a 304 needs no query."""
+    url = f"/ctms/{minimal_contact.email.email_id}"
+    etag = client.get(url).headers["ETag"]
+    statements.clear()
+    resp = client.get(url)
+    assert resp.headers["ETag"] == etag
+    resp = client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert statements == []
+
+
+def test_get_etag_unknown(client, dbsession):
+    """An If-None-Match for an unknown contact is a 404."""
+    resp = client.get(
+        "/ctms/cad092ec-a71a-4df5-aa92-517959caeecb", headers={"If-None-Match": "*"}
+    )
+    assert resp.status_code == 404
+
+
+class FakeReplicas:
+    """A stand-in for ReplicaPool, with sessions on the test connection."""
+
+    def __init__(self, dbsession):
+        self.dbsession = dbsession
+        self.sessions = 0
+        self.connections = 0
+
+    def session(self, primary):
+        self.sessions += 1
+        return ReplicaSession(self, primary)
+
+    def connect(self, db):
+        self.connections += 1
+        db.connection(bind=self.dbsession.bind)
+        return self.dbsession.bind
+
+
+@pytest.fixture
+def replicas(dbsession):
+    """Route the app's read-only endpoints to a fake replica."""
+    fake = FakeReplicas(dbsession)
+    app.dependency_overrides[get_replicas] = lambda: fake
+    yield fake
+    del app.dependency_overrides[get_replicas]
+
+
+@pytest.mark.parametrize(
+    "path",
+    (
+        "/ctms/{email_id}",
+        "/ctms?primary_email={primary_email}",
+        "/identity/{email_id}",
+        "/identities?primary_email={primary_email}",
+        "/contact/email/{email_id}",
+        "/contact/fxa/{email_id}",
+        "/updates?since=2020-01-01T00:00:00Z",
+        "/newsletters/mozilla-welcome/subscribers",
+        "/export",
+    ),
+)
+def test_reads_use_replica(client, minimal_contact, replicas, path):
+    """Read-only endpoints use a replica session."""
+    url = path.format(
+        email_id=minimal_contact.email.email_id,
+        primary_email=minimal_contact.email.primary_email,
+    )
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert replicas.sessions == 1
+
+
+def test_cached_reads_skip_replica(client, minimal_contact, contact_cache, replicas):
+    """Reads answered from the cache don't use a replica connection."""
+    email_id = minimal_contact.email.email_id
+    etag = client.get(f"/ctms/{email_id}").headers["ETag"]
+    assert replicas.connections == 1
+    for _ in range(5):
+        resp = client.get(f"/ctms/{email_id}", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+    assert client.get(f"/identity/{email_id}").status_code == 200
+    assert client.get(f"/contact/email/{email_id}").status_code == 200
+    assert replicas.sessions == 8
+    assert replicas.connections == 1
+
+
+def test_create_uses_primary(client, dbsession, replicas):
+    """POST /ctms uses the primary."""
+    email_id = UUID("93db83d4-4119-4e0c-af87-a713786fa81d")
+    resp = client.post("/ctms", SAMPLE_CONTACTS[email_id].json())
+    assert resp.status_code == 200
+    assert replicas.sessions == 0
+
+
+@pytest.fixture
+def recent_writes():
+    """Track the contacts written by the app, for read-your-writes."""
+    writes = RecentWrites(MemoryCache(max_size=10, ttl=5))
+    app.dependency_overrides[get_recent_writes] = lambda: writes
+    yield writes
+    del app.dependency_overrides[get_recent_writes]
+
+
+def test_read_your_writes(client, dbsession, replicas, recent_writes):
+    """A contact is read from the primary right after it is created."""
+    email_id = UUID("93db83d4-4119-4e0c-af87-a713786fa81d")
+    resp = client.post("/ctms", SAMPLE_CONTACTS[email_id].json())
+    assert resp.status_code == 200
+    assert client.get(f"/ctms/{email_id}").status_code == 200
+    assert replicas.sessions == 0
+    other_id = "67e52c77-950f-4f28-accb-bb3ea1a2c51a"
+    assert client.get(f"/ctms/{other_id}").status_code == 404
+    assert replicas.sessions == 1
+
+
+@pytest.mark.parametrize(
+    "path",
+    (
+        "/ctms?fxa_id={fxa_id}",
+        "/ctms?primary_email={primary_email}",
+        "/ctms?email_id={email_id}",
+        "/identities?mofo_id={mofo_id}",
+        "/identities?basket_token={basket_token}",
+    ),
+)
+def test_read_your_writes_by_alternate_id(
+    client, dbsession, replicas, recent_writes, path
+):
+    """A contact is read from the primary by its alternate IDs after it is created."""
+    contact = SAMPLE_CONTACTS[UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")]
+    resp = client.post("/ctms", contact.json())
+    assert resp.status_code == 200
+    url = path.format(
+        email_id=contact.email.email_id,
+        primary_email=contact.email.primary_email,
+        basket_token=contact.email.basket_token,
+        mofo_id=contact.email.mofo_id,
+        fxa_id=contact.fxa.fxa_id,
+    )
+    resp = client.get(url)
+    assert len(resp.json()) == 1
+    assert replicas.sessions == 0
+    assert client.get("/ctms?fxa_id=unknown").json() == []
+    assert replicas.sessions == 1
+
+
+def test_read_your_writes_after_patch(client, minimal_contact, replicas, recent_writes):
+    """An alternate ID added by PATCH is read from the primary."""
+    email_id = minimal_contact.email.email_id
+    resp = client.patch(f"/ctms/{email_id}", json={"fxa": {"fxa_id": "new-fxa-id"}})
+    assert resp.status_code == 200
+    resp = client.get("/identities?fxa_id=new-fxa-id")
+    assert [identity["email_id"] for identity in resp.json()] == [str(email_id)]
+    assert replicas.sessions == 0
+
+
+def test_patch_email_fields(client, maximal_contact):
+    """PATCH /ctms/{email_id} changes only the fields that are sent."""
+    email_id = maximal_contact.email.email_id
+    before = client.get(f"/ctms/{email_id}").json()
+    resp = client.patch(
+        f"/ctms/{email_id}", json={"email": {"first_name": "Jane", "mofo_id": None}}
+    )
+    assert resp.status_code == 200
+    after = resp.json()
+    assert after["email"]["first_name"] == "Jane"
+    assert after["email"]["mofo_id"] is None
+    assert after["email"]["primary_email"] == before["email"]["primary_email"]
+    assert after["fxa"] == before["fxa"]
+    assert after["newsletters"] == before["newsletters"]
+    assert client.get(f"/ctms/{email_id}").json() == after
+
+
+def test_patch_newsletters_merged(client, maximal_contact):
+    """PATCH /ctms/{email_id} upserts newsletters by name, keeping the others."""
+    email_id = maximal_contact.email.email_id
+    names = [newsletter.name for newsletter in maximal_contact.newsletters]
+    changed = names[0]
+    resp = client.patch(
+        f"/ctms/{email_id}",
+        json={
+            "newsletters": [
+                {"name": changed, "subscribed": False},
+                {"name": "new-newsletter", "format": "T"},
+            ]
+        },
+    )
+    assert resp.status_code == 200
+    newsletters = {item["name"]: item for item in resp.json()["newsletters"]}
+    assert set(newsletters) == set(names) | {"new-newsletter"}
+    assert newsletters[changed]["subscribed"] is False
+    old = next(n for n in maximal_contact.newsletters if n.name == changed)
+    assert newsletters[changed]["lang"] == old.lang
+    assert newsletters["new-newsletter"]["format"] == "T"
+    assert newsletters["new-newsletter"]["subscribed"] is True
+
+
+def test_patch_adds_group(client, minimal_contact):
+    """PATCH /ctms/{email_id} creates a group the contact did not have."""
+    email_id = minimal_contact.email.email_id
+    resp = client.patch(
+        f"/ctms/{email_id}", json={"amo": {"user_id": "98765", "display_name": "Jo"}}
+    )
+    assert resp.status_code == 200
+    amo = resp.json()["amo"]
+    assert amo["user_id"] == "98765"
+    assert amo["display_name"] == "Jo"
+    assert amo["email_opt_in"] is False
+
+
+def test_patch_unknown(client, dbsession):
+    """PATCH /ctms/{unknown email_id} returns a 404 and writes nothing."""
+    email_id = "cad092ec-a71a-4df5-aa92-517959caeecb"
+    resp = client.patch(f"/ctms/{email_id}", json={"amo": {"user_id": "98765"}})
+    assert resp.status_code == 404
+    assert resp.json() == {"detail": "Unknown email_id"}
+    assert get_contacts_by_any_id(dbsession, amo_user_id="98765") == []
+
+
+def test_patch_duplicate_email(client, sample_contacts):
+    """PATCH /ctms/{email_id} to another contact's primary_email is a 409."""
+    email_id, _ = sample_contacts["minimal"]
+    _, maximal = sample_contacts["maximal"]
+    resp = client.patch(
+        f"/ctms/{email_id}",
+        json={"email": {"primary_email": maximal.email.primary_email}},
+    )
+    assert resp.status_code == 409
+    assert resp.json() == {"detail": "Contact conflicts with an existing contact"}
+
+
+def test_patch_null_email_fails(client, minimal_contact):
+    """PATCH /ctms/{email_id} can not remove the primary_email."""
+    email_id = minimal_contact.email.email_id
+    resp = client.patch(f"/ctms/{email_id}", json={"email": {"primary_email": None}})
+    assert resp.status_code == 422
+
+
+def test_patch_invalidates_cache(client, maximal_contact, contact_cache, dbsession):
+    """PATCH /ctms/{email_id} replaces the cached contact and changes the ETag."""
+    email_id = maximal_contact.email.email_id
+    url = f"/ctms/{email_id}"
+    # now() is fixed in the test transaction, so make the contact older
+    for table in ("emails", "amo", "fxa", "newsletters", "vpn_waitlist"):
+        dbsession.execute(
+            f"UPDATE {table} SET update_timestamp = now() - interval '1 hour'"
+            " WHERE email_id = :email_id",
+            {"email_id": str(email_id)},
+        )
+    etag = client.get(url).headers["ETag"]
+    resp = client.patch(url, json={"email": {"first_name": "Jane"}})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+    cached = client.get(url, headers={"If-None-Match": etag})
+    assert cached.status_code == 200
+    assert cached.headers["ETag"] == resp.headers["ETag"]
+    assert cached.json()["email"]["first_name"] == "Jane"
+
+
+def test_patch_writes_without_reading(client, maximal_contact, statements):
+    """PATCH /ctms/{email_id} writes each changed table once, without reading first."""
+    email_id = maximal_contact.email.email_id
+    statements.clear()
+    resp = client.patch(
+        f"/ctms/{email_id}",
+        json={
+            "email": {"first_name": "Jane"},
+            "fxa": {"lang": "fr"},
+            "newsletters": [{"name": "a-newsletter"}, {"name": "b-newsletter"}],
+        },
+    )
+    assert resp.status_code == 200
+    verbs = [sql.split()[0] for sql, _ in statements]
+    writes = [verb for verb in verbs if verb in ("SELECT", "UPDATE", "INSERT")]
+    # One UPDATE for emails, then an upsert for fxa and one for the newsletters
+    assert writes[:3] == ["UPDATE", "INSERT", "INSERT"]
+
+
+@pytest.mark.parametrize(
+    "path",
+    (
+        "/ctms/{email_id}",
+        "/ctms?primary_email={primary_email}",
+        "/identity/{email_id}",
+        "/identities?primary_email={primary_email}",
+        "/contact/email/{email_id}",
+        "/updates?since=2020-01-01T00:00:00Z&full=true",
+        "/newsletters/firefox-os/subscribers",
+    ),
+)
+def test_async_reads(client, async_contacts, path):
+    """In async mode, the read endpoints run their queries with asyncpg."""
+    contact = async_contacts[UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")]
+    url = path.format(
+        email_id=contact.email.email_id, primary_email=contact.email.primary_email
+    )
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert str(contact.email.email_id) in resp.text
+
+
+@pytest.mark.parametrize("group", ("amo", "fxa", "vpn_waitlist"))
+def test_async_read_group(client, async_contacts, group):
+    """In async mode, GET /contact/{group}/{email_id} returns the group."""
+    contact = async_contacts[UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")]
+    resp = client.get(f"/contact/{group}/{contact.email.email_id}")
+    assert resp.status_code == 200
+    assert resp.json() == json.loads(getattr(contact, group).json())
+
+
+def test_async_get_unknown(client, async_dbsession):
+    """In async mode, an unknown email_id is a 404."""
+    resp = client.get("/ctms/cad092ec-a71a-4df5-aa92-517959caeecb")
+    assert resp.status_code == 404
+
+
+def test_async_batch(client, async_contacts):
+    """In async mode, POST /ctms/batch returns the found and missing contacts."""
+    unknown = "cad092ec-a71a-4df5-aa92-517959caeecb"
+    email_ids = [str(email_id) for email_id in async_contacts] + [unknown]
+    resp = client.post("/ctms/batch", json={"email_ids": email_ids})
+    assert resp.status_code == 200
+    assert sorted(resp.json()["contacts"]) == sorted(email_ids[:-1])
+    assert resp.json()["missing"] == [unknown]
+
+
+def test_async_create_and_patch(client, async_dbsession):
+    """In async mode, a contact can be created, retried, changed and read."""
+    contact = SAMPLE_CONTACTS[UUID("93db83d4-4119-4e0c-af87-a713786fa81d")]
+    email_id = contact.email.email_id
+    assert client.post("/ctms", contact.json()).status_code == 200
+    assert client.post("/ctms", contact.json()).status_code == 200
+    resp = client.patch(f"/ctms/{email_id}", json={"email": {"first_name": "Jane"}})
+    assert resp.status_code == 200
+    assert resp.json()["email"]["first_name"] == "Jane"
+    etag = resp.headers["ETag"]
+    resp = client.get(f"/ctms/{email_id}")
+    assert resp.json()["email"]["first_name"] == "Jane"
+    assert resp.headers["ETag"] == etag
+
+
+def test_async_create_conflict(client, async_contacts):
+    """In async mode, a create that conflicts with a contact is a 409."""
+    contact = async_contacts[UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")].copy(
+        deep=True
+    )
+    contact.email.first_name = "Someone else"
+    resp = client.post("/ctms", contact.json())
+    assert resp.status_code == 409
+
+
+def test_async_bulk(client, async_contacts):
+    """In async mode, POST /ctms/bulk creates the new contacts."""
+    existing = async_contacts[UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")]
+    new = SAMPLE_CONTACTS[UUID("d1da1c99-fe09-44db-9c68-78a75752574d")]
+    resp = client.post("/ctms/bulk", data=f"[{existing.json()}, {new.json()}]")
+    assert resp.status_code == 200
+    assert [result["status"] for result in resp.json()["results"]] == [
+        "conflict",
+        "created",
+    ]
+    assert client.get(f"/ctms/{new.email.email_id}").status_code == 200
+
+
+def test_async_export(client, async_contacts, override_settings):
+    """In async mode, GET /export streams the contacts in chunks."""
+    override_settings(export_chunk_size=2)
+    resp = client.get("/export")
+    assert resp.status_code == 200
+    email_ids = [
+        json.loads(line)["email"]["email_id"] for line in resp.text.splitlines()
+    ]
+    assert email_ids == sorted(str(email_id) for email_id in async_contacts)
+
+
+class FakeAsyncReplicas(FakeReplicas):
+    """A stand-in for ReplicaPool in async mode."""
+
+    def async_session(self, primary):
+        self.sessions += 1
+        return AsyncSession(
+            sync_session_class=ReplicaSession, replicas=self, primary=primary
+        )
+
+
+def test_async_reads_use_replica(client, async_contacts, async_dbsession):
+    """In async mode, read-only endpoints use a replica session."""
+    fake = FakeAsyncReplicas(async_dbsession.sync_session)
+    app.dependency_overrides[get_replicas] = lambda: fake
+    try:
+        email_id = UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+        assert client.get(f"/ctms/{email_id}").status_code == 200
+        assert client.get("/ctms?fxa_id=unknown").json() == []
+    finally:
+        del app.dependency_overrides[get_replicas]
+    assert fake.sessions == 2
+    assert fake.connections == 2
@@ -1,4 +1,17 @@
 """pytest tests for basic app functionality"""
+from uuid import UUID
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ctms import app as app_module
+from ctms import metrics
+from ctms.app import ctms_response, json_response, startup_event
+from ctms.config import Settings
+from ctms.sample_data import SAMPLE_CONTACTS
 
 
 def test_read_root(client):
@@ -16,3 +29,54 @@ def test_read_health(client):
     resp = client.get("/health")
     assert resp.status_code == 200
     assert resp.json() == [{"health": "OK"}, 200]
+
+
+@pytest.fixture
+def run_startup(monkeypatch):
+    """
+    Return a function that runs the startup event with settings.
+
+    The app's globals are restored after the test.
+    """
+    for name in (
+        "engine",
+        "SessionLocal",
+        "replica_pool",
+        "recent_writes",
+        "contact_cache",
+        "identity_cache",
+    ):
+        monkeypatch.setattr(app_module, name, getattr(app_module, name))
+    monkeypatch.setattr(metrics, "_pools", dict(metrics._pools))
+
+    def run(**settings):
+        monkeypatch.setattr(app_module, "get_settings", lambda: Settings(**settings))
+        startup_event()
+
+    return run
+
+
+def test_startup_uses_psycopg2(run_startup):
+    """By default, the app uses psycopg2 sessions."""
+    run_startup()
+    assert app_module.engine.dialect.driver == "psycopg2"
+    assert isinstance(app_module.SessionLocal(), Session)
+
+
+def test_startup_async_mode(run_startup):
+    """With CTMS_DB_ASYNC, the app uses asyncpg and AsyncSessions."""
+    pytest.importorskip("asyncpg")
+    run_startup(db_async=True, db_replica_urls=[str(app_module.get_settings().db_url)])
+    assert app_module.engine.dialect.driver == "asyncpg"
+    assert isinstance(app_module.SessionLocal(), AsyncSession)
+    assert app_module.replica_pool.engines[0].dialect.driver == "asyncpg"
+
+
+def test_json_response_matches_fastapi_encoding():
+    """json_response encodes a model like FastAPI's default JSONResponse."""
+    contact = SAMPLE_CONTACTS[UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")]
+    model = ctms_response(contact)
+    response = json_response(model, headers={"ETag": '"tag"'})
+    assert response.media_type == "application/json"
+    assert response.headers["ETag"] == '"tag"'
+    assert response.body == JSONResponse(jsonable_encoder(model)).body
@@ -0,0 +1,235 @@
+"""Tests for the contact caches."""
+from uuid import UUID
+
+import pytest
+
+from ctms import cache as cache_module
+from ctms.app import create_caches
+from ctms.cache import (
+    ContactCache,
+    IdentityCache,
+    MemoryCache,
+    RecentWrites,
+    RedisCache,
+    get_cache_backend,
+)
+from ctms.config import Settings
+from ctms.sample_data import SAMPLE_CONTACTS
+
+
+class FakeRedis:
+    """A local stand-in for the parts of redis.Redis used by RedisCache."""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return
+        self.data[key] = value.encode()
+        self.expires[key] = ex
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Control the time seen by the memory cache."""
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, "monotonic", lambda: now[0])
+    return now
+
+
+def test_memory_cache_hits_and_misses():
+    cache = MemoryCache(max_size=10, ttl=60)
+    assert cache.get("a") is None
+    cache.set("a", "1")
+    assert cache.get("a") == "1"
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_size=2, ttl=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_memory_cache_expires(clock):
+    cache = MemoryCache(max_size=10, ttl=60)
+    cache.set("a", "1")
+    clock[0] += 59
+    assert cache.get("a") == "1"
+    clock[0] += 1
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_memory_cache_delete():
+    cache = MemoryCache(max_size=10, ttl=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.delete("a", "unknown")
+    assert cache.get("a") is None
+    assert cache.get("b") == "2"
+
+
+def test_memory_cache_add(clock):
+    cache = MemoryCache(max_size=10, ttl=60)
+    cache.add("a", "1")
+    cache.add("a", "2")
+    assert cache.get("a") == "1"
+    clock[0] += 60
+    cache.add("a", "3")
+    assert cache.get("a") == "3"
+
+
+def test_redis_cache():
+    client = FakeRedis()
+    cache = RedisCache(client, ttl=30)
+    assert cache.get("a") is None
+    cache.set("a", "1")
+    assert client.expires == {"ctms:a": 30}
+    assert cache.get("a") == "1"
+    cache.add("a", "2")
+    assert cache.get("a") == "1"
+    cache.delete("a")
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 2, "misses": 2}
+
+
+@pytest.mark.parametrize(
+    "backend", (MemoryCache(max_size=10, ttl=60), RedisCache(FakeRedis(), ttl=60))
+)
+def test_contact_cache_round_trip(backend):
+    email_id = UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+    contact = SAMPLE_CONTACTS[email_id]
+    cache = ContactCache(backend)
+    assert cache.get(email_id) is None
+    cache.set(email_id, contact)
+    assert cache.get(email_id) == contact
+    cache.invalidate(email_id)
+    assert cache.get(email_id) is None
+
+
+def test_identity_cache():
+    email_id = UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+    contact = SAMPLE_CONTACTS[email_id]
+    cache = IdentityCache(MemoryCache(max_size=10, ttl=60))
+    cache.set("fxa_id", contact.fxa.fxa_id, email_id)
+    cache.set("basket_token", contact.email.basket_token, email_id)
+    cache.set("fxa_id", "unrelated", email_id)
+    assert cache.get("fxa_id", contact.fxa.fxa_id) == email_id
+    cache.invalidate(contact)
+    assert cache.get("fxa_id", contact.fxa.fxa_id) is None
+    assert cache.get("basket_token", contact.email.basket_token) is None
+    assert cache.get("fxa_id", "unrelated") == email_id
+
+
+def test_get_cache_backend():
+    settings = Settings(cache_backend="memory")
+    backend = get_cache_backend(settings, 5, 10)
+    assert isinstance(backend, MemoryCache)
+    assert (backend.max_size, backend.ttl) == (5, 10)
+    assert get_cache_backend(Settings(), 5, 10) is None
+
+
+def test_get_cache_backend_redis():
+    """The redis backend connects with the redis package, from the redis extra."""
+    redis = pytest.importorskip("redis")
+    settings = Settings(cache_backend="redis", cache_url="redis://localhost:6379/3")
+    backend = get_cache_backend(settings, 5, 10)
+    assert isinstance(backend, RedisCache)
+    assert isinstance(backend.client, redis.Redis)
+    assert backend.client.connection_pool.connection_kwargs["db"] == 3
+    assert backend.ttl == 10
+
+
+def test_create_caches_disabled():
+    assert create_caches(Settings()) == (None, None)
+
+
+def test_create_caches_memory():
+    """The memory backend only caches alternate IDs, not contacts or unknown IDs."""
+    contact_cache, identity_cache = create_caches(Settings(cache_backend="memory"))
+    assert contact_cache is None
+    assert isinstance(identity_cache.backend, MemoryCache)
+    assert identity_cache.negative_backend is None
+
+
+def test_create_caches_redis():
+    """The redis backend remembers unknown IDs, shared by all workers."""
+    pytest.importorskip("redis")
+    settings = Settings(
+        cache_backend="redis",
+        cache_url="redis://localhost:6379/0",
+        negative_cache_ttl=5,
+    )
+    contact_cache, identity_cache = create_caches(settings)
+    assert isinstance(contact_cache.backend, RedisCache)
+    assert isinstance(contact_cache.negative_backend, RedisCache)
+    assert contact_cache.negative_backend.ttl == 5
+    assert identity_cache.negative_backend is contact_cache.negative_backend
+
+
+def test_contact_cache_missing():
+    email_id = UUID("cad092ec-a71a-4df5-aa92-517959caeecb")
+    cache = ContactCache(MemoryCache(10, 60), MemoryCache(10, 10))
+    assert not cache.is_missing(email_id)
+    cache.set_missing(email_id)
+    assert cache.is_missing(email_id)
+    cache.invalidate(email_id)
+    assert not cache.is_missing(email_id)
+
+
+@pytest.mark.parametrize(
+    "backend", (MemoryCache(10, 10), RedisCache(FakeRedis(), ttl=10))
+)
+def test_contact_cache_missing_after_write(backend):
+    """A read that missed a contact before it was created can't hide it."""
+    email_id = UUID("cad092ec-a71a-4df5-aa92-517959caeecb")
+    cache = ContactCache(MemoryCache(10, 60), backend)
+    cache.invalidate(email_id)
+    cache.set_missing(email_id)
+    assert not cache.is_missing(email_id)
+
+
+def test_contact_cache_without_negative_backend():
+    email_id = UUID("cad092ec-a71a-4df5-aa92-517959caeecb")
+    cache = ContactCache(MemoryCache(10, 60))
+    cache.set_missing(email_id)
+    assert not cache.is_missing(email_id)
+
+
+def test_identity_cache_missing():
+    email_id = UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+    contact = SAMPLE_CONTACTS[email_id]
+    cache = IdentityCache(MemoryCache(10, 60), MemoryCache(10, 10))
+    cache.set_missing("fxa_id", contact.fxa.fxa_id)
+    assert cache.is_missing("fxa_id", contact.fxa.fxa_id)
+    cache.invalidate(contact)
+    assert not cache.is_missing("fxa_id", contact.fxa.fxa_id)
+    cache.set_missing("fxa_id", contact.fxa.fxa_id)
+    assert not cache.is_missing("fxa_id", contact.fxa.fxa_id)
+
+
+def test_recent_writes_identities():
+    contact = SAMPLE_CONTACTS[UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")]
+    writes = RecentWrites(MemoryCache(10, 5))
+    assert not writes.is_recent_identity("fxa_id", contact.fxa.fxa_id)
+    writes.add_identities(contact)
+    assert writes.is_recent_identity("fxa_id", contact.fxa.fxa_id)
+    assert writes.is_recent_identity("basket_token", contact.email.basket_token)
+    assert writes.is_recent_identity("amo_user_id", contact.amo.user_id)
+    assert not writes.is_recent(contact.email.email_id)
@@ -0,0 +1,168 @@
+"""Tests for the database functions in ctms.crud"""
+from datetime import datetime, timezone
+from uuid import UUID
+
+import pytest
+
+from ctms.crud import (
+    bakery,
+    create_contact,
+    get_contact_by_email_id,
+    get_contact_updates,
+    get_contacts_by_any_id,
+    get_newsletter_subscribers,
+)
+from ctms.sample_data import SAMPLE_CONTACTS
+from ctms.schemas import ContactSchema, NewsletterSchema
+
+
+def add_mofo_sibling(dbsession, contact):
+    """Add a second contact that shares the MoFo ID of an existing contact."""
+    sibling = SAMPLE_CONTACTS[UUID("d1da1c99-fe09-44db-9c68-78a75752574d")].copy(
+        deep=True
+    )
+    sibling.email.mofo_id = contact.email.mofo_id
+    sibling.newsletters = [NewsletterSchema(name="mozilla-foundation")]
+    create_contact(dbsession, sibling.email.email_id, sibling)
+    dbsession.commit()
+    return sibling
+
+
+def test_get_contacts_by_any_id_batches_newsletters(
+    dbsession, maximal_contact, statements
+):
+    """Newsletters for all matching contacts are loaded in one query."""
+    sibling = add_mofo_sibling(dbsession, maximal_contact)
+    statements.clear()
+
+    contacts = get_contacts_by_any_id(dbsession, mofo_id=maximal_contact.email.mofo_id)
+
+    assert len(statements) == 2
+    newsletters = {
+        contact["email"].email_id: [nl.name for nl in contact["newsletters"]]
+        for contact in contacts
+    }
+    assert newsletters == {
+        maximal_contact.email.email_id: [nl.name for nl in maximal_contact.newsletters],
+        sibling.email.email_id: ["mozilla-foundation"],
+    }
+
+
+def test_get_contacts_by_any_id_no_match(dbsession, statements):
+    """The newsletters query is skipped when no contacts match."""
+    contacts = get_contacts_by_any_id(dbsession, sfdc_id="001A000404aUnknown")
+    assert contacts == []
+    assert len(statements) == 1
+
+
+def test_get_contact_by_email_id_single_query(dbsession, maximal_contact, statements):
+    """A contact, including newsletters, is loaded in one query."""
+    statements.clear()
+    contact = get_contact_by_email_id(dbsession, maximal_contact.email.email_id)
+    assert len(statements) == 1
+    assert ContactSchema(**contact) == maximal_contact
+
+
+def test_get_contact_by_email_id_no_newsletters(dbsession):
+    """A contact without newsletters has an empty list of newsletters."""
+    contact = SAMPLE_CONTACTS[UUID("d1da1c99-fe09-44db-9c68-78a75752574d")]
+    assert contact.newsletters == []
+    create_contact(dbsession, contact.email.email_id, contact)
+    dbsession.commit()
+    data = get_contact_by_email_id(dbsession, contact.email.email_id)
+    assert data["newsletters"] == []
+
+
+def test_get_contact_by_email_id_not_found(dbsession):
+    """None is returned for an unknown email_id."""
+    email_id = UUID("cad092ec-a71a-4df5-aa92-517959caeecb")
+    assert get_contact_by_email_id(dbsession, email_id) is None
+
+
+def test_get_contacts_by_any_id_is_baked(dbsession, sample_contacts):
+    """Each combination of alternate IDs is compiled once, then reused."""
+    _, minimal = sample_contacts["minimal"]
+    _, maximal = sample_contacts["maximal"]
+    get_contacts_by_any_id(dbsession, sfdc_id=minimal.email.sfdc_id)
+    get_contact_by_email_id(dbsession, minimal.email.email_id)
+    cached = len(bakery.cache)
+
+    contacts = get_contacts_by_any_id(dbsession, sfdc_id=maximal.email.sfdc_id)
+    assert [c["email"].email_id for c in contacts] == [maximal.email.email_id]
+    assert get_contact_by_email_id(dbsession, maximal.email.email_id)
+    assert len(bakery.cache) == cached
+
+    get_contacts_by_any_id(
+        dbsession, sfdc_id=maximal.email.sfdc_id, fxa_id=maximal.fxa.fxa_id
+    )
+    assert len(bakery.cache) > cached
+
+
+def explain(dbsession, statement, parameters):
+    """Return the query plan for a statement, discouraging table scans."""
+    connection = dbsession.connection()
+    connection.execute("SET LOCAL enable_seqscan = off")
+    rows = connection.execute("EXPLAIN " + statement, parameters)
+    return "\n".join(row[0] for row in rows)
+
+
+@pytest.mark.parametrize(
+    "alt_id_name,alt_id_value,index_name",
+    [
+        ("email_id", "67e52c77-950f-4f28-accb-bb3ea1a2c51a", "emails_pkey"),
+        ("primary_email", "mozilla-fan@example.com", "emails_primary_email_key"),
+        ("amo_user_id", "123", "ix_amo_user_id"),
+        (
+            "basket_token",
+            "d9ba6182-f5dd-4728-a477-2cc11bf62b69",
+            "emails_basket_token_key",
+        ),
+        ("fxa_id", "611b6788-2bba-42a6-98c9-9ce6eb9cbd34", "fxa_fxa_id_key"),
+        ("fxa_primary_email", "fxa-firefox-fan@example.com", "ix_fxa_primary_email"),
+        ("sfdc_id", "001A000001aMozFan", "ix_emails_sfdc_id"),
+        ("mofo_id", "195207d2-63f2-4c9f-b149-80e9c408477a", "ix_emails_mofo_id"),
+    ],
+)
+def test_get_contacts_by_any_id_uses_index(
+    dbsession, maximal_contact, statements, alt_id_name, alt_id_value, index_name
+):
+    """Each alternate ID lookup is an index scan, as is the newsletters lookup."""
+    statements.clear()
+    contacts = get_contacts_by_any_id(dbsession, **{alt_id_name: alt_id_value})
+    assert len(contacts) == 1
+    (contacts_sql, contacts_params), (newsletters_sql, newsletters_params) = statements
+
+    contacts_plan = explain(dbsession, contacts_sql, contacts_params)
+    assert index_name in contacts_plan
+    newsletters_plan = explain(dbsession, newsletters_sql, newsletters_params)
+    assert "uix_email_name" in newsletters_plan
+
+
+def test_get_newsletter_subscribers_uses_index(dbsession, maximal_contact, statements):
+    """Listing a page of newsletter subscribers is an index range scan."""
+    after = UUID("00000000-0000-4000-8000-000000000000")
+    statements.clear()
+    email_ids = get_newsletter_subscribers(dbsession, "hubs", after=after)
+    assert email_ids == [maximal_contact.email.email_id]
+    ((sql, params),) = statements
+    plan = explain(dbsession, sql, params)
+    assert "ix_newsletters_name_subscribed_email_id" in plan
+    assert "Sort" not in plan
+
+
+def test_get_contact_updates_uses_indexes(dbsession, maximal_contact, statements):
+    """A page of changes reads at most limit rows from each table's index."""
+    since = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    after = UUID("00000000-0000-4000-8000-000000000000")
+    statements.clear()
+    updates = get_contact_updates(dbsession, since, after, limit=10)
+    assert [email_id for email_id, _ in updates] == [maximal_contact.email.email_id]
+    ((sql, params),) = statements
+    # The tables are tiny, so a bitmap scan and a sort would look cheaper
+    dbsession.execute("SET LOCAL enable_bitmapscan = off")
+    plan = explain(dbsession, sql, params)
+    for table in ("emails", "amo", "fxa", "vpn_waitlist", "newsletters"):
+        assert f"ix_{table}_update_timestamp_email_id" in plan
+    assert plan.count("Limit") == 5
+    assert "Sort" not in plan
+    assert "Aggregate" not in plan
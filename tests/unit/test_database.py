@@ -0,0 +1,194 @@
+"""Tests for the database engine and connection pool"""
+import pytest
+from sqlalchemy.exc import DBAPIError, OperationalError, TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import ctms.app
+from ctms.config import Settings
+from ctms.database import (
+    get_async_db_engine,
+    get_db_engine,
+    get_pool_status,
+    get_replica_pool,
+)
+
+
+@pytest.fixture
+def pool_engine(engine):
+    """Return an engine with a tiny pool, connected to the test database."""
+
+    def make_engine(**settings):
+        pool_engine, _ = get_db_engine(Settings(db_url=str(engine.url), **settings))
+        engines.append(pool_engine)
+        return pool_engine
+
+    engines = []
+    yield make_engine
+    for pool_engine in engines:
+        pool_engine.dispose()
+
+
+def test_pool_settings(pool_engine):
+    """The pool is sized by the settings."""
+    engine = pool_engine(db_pool_size=2, db_max_overflow=1, db_pool_timeout=7)
+    assert engine.pool.size() == 2
+    assert engine.pool._max_overflow == 1
+    assert engine.pool._timeout == 7
+
+
+def test_pool_status(pool_engine):
+    """The pool status counts connections in use and checkout waits."""
+    engine = pool_engine(db_pool_size=1, db_max_overflow=1, db_pool_timeout=1)
+    first = engine.connect()
+    second = engine.connect()
+    status = get_pool_status(engine)
+    assert status["size"] == 1
+    assert status["checked_out"] == 2
+    assert status["overflow"] == 1
+    assert status["checkouts"] == 2
+
+    with pytest.raises(TimeoutError):
+        engine.connect()
+    status = get_pool_status(engine)
+    assert status["checkout_timeouts"] == 1
+    assert status["wait_seconds_max"] >= 1.0
+    assert status["wait_seconds_total"] >= 1.0
+
+    first.close()
+    second.close()
+    status = get_pool_status(engine)
+    assert status["checked_out"] == 0
+    assert status["checked_in"] == 1
+
+
+def test_statement_timeout(pool_engine):
+    """The statement timeout is set on new connections."""
+    engine = pool_engine(db_statement_timeout=50)
+    with engine.connect() as connection:
+        assert connection.execute("SHOW statement_timeout").scalar() == "50ms"
+        with pytest.raises(OperationalError):
+            connection.execute("SELECT pg_sleep(1)")
+
+
+def test_async_engine(engine, run_async):
+    """The asyncpg engine uses the pool and timeout settings."""
+    pytest.importorskip("asyncpg")
+    settings = Settings(db_url=str(engine.url), db_pool_size=2, db_statement_timeout=50)
+    async_engine, _ = get_async_db_engine(settings)
+
+    async def check_timeout():
+        async with async_engine.connect() as connection:
+            result = await connection.exec_driver_sql("SHOW statement_timeout")
+            assert result.scalar() == "50ms"
+            with pytest.raises(DBAPIError):
+                await connection.exec_driver_sql("SELECT pg_sleep(1)")
+
+    try:
+        run_async(check_timeout())
+        status = get_pool_status(async_engine.sync_engine)
+        assert status["size"] == 2
+        assert status["checkouts"] == 1
+        assert status["checked_in"] == 1
+    finally:
+        run_async(async_engine.dispose())
+
+
+def test_pool_endpoint(client, pool_engine, monkeypatch):
+    """GET /pool returns the pool status."""
+    engine = pool_engine(db_pool_size=3)
+    monkeypatch.setattr(ctms.app, "engine", engine)
+    resp = client.get("/pool")
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "size": 3,
+        "checked_in": 0,
+        "checked_out": 0,
+        "overflow": -3,
+        "checkouts": 0,
+        "checkout_timeouts": 0,
+        "wait_seconds_total": 0.0,
+        "wait_seconds_max": 0.0,
+    }
+
+
+@pytest.fixture
+def replica_pool(engine, run_async):
+    """Return a function that creates a ReplicaPool for the test."""
+
+    def make_pool(urls, **settings):
+        pool = get_replica_pool(
+            Settings(db_url=str(engine.url), db_replica_urls=urls, **settings)
+        )
+        pools.append(pool)
+        return pool
+
+    pools = []
+    yield make_pool
+    for pool in pools:
+        for replica_engine in pool.engines:
+            if replica_engine.dialect.is_async:
+                run_async(AsyncEngine(replica_engine).dispose())
+            else:
+                replica_engine.dispose()
+
+
+def missing_database_url(engine):
+    """Return a URL on the test server for a database that doesn't exist."""
+    return str(engine.url.set(database="ctms_missing_replica"))
+
+
+def test_no_replicas():
+    """Without replica URLs, there is no replica pool."""
+    assert get_replica_pool(Settings()) is None
+
+
+def test_replica_session_connects_on_first_use(engine, replica_pool):
+    """A replica session doesn't check out a connection until it is used."""
+    pool = replica_pool([str(engine.url)])
+    db = pool.session(engine)
+    assert pool.status()[0]["checkouts"] == 0
+    assert db.execute("SELECT 1").scalar() == 1
+    assert db.get_bind() is pool.engines[0]
+    db.close()
+    assert pool.status()[0]["checkouts"] == 1
+
+
+def test_replica_pool_skips_failed_replica(engine, replica_pool):
+    """A replica that can't connect is skipped until the retry time."""
+    bad_url = missing_database_url(engine)
+    pool = replica_pool([bad_url, str(engine.url)], db_replica_retry=60)
+    for _ in range(3):
+        db = pool.session(engine)
+        assert db.execute("SELECT current_database()").scalar() == engine.url.database
+        assert db.get_bind() is pool.engines[1]
+        db.close()
+    status = pool.status()
+    assert [replica["down"] for replica in status] == [True, False]
+    assert status[0]["checkouts"] == 1
+
+
+def test_replica_pool_all_failed(engine, replica_pool):
+    """If no replica can connect, the session uses the primary."""
+    bad_url = missing_database_url(engine)
+    pool = replica_pool([bad_url])
+    for _ in range(2):
+        db = pool.session(engine)
+        assert db.execute("SELECT 1").scalar() == 1
+        assert db.get_bind() is engine
+        db.close()
+    assert pool.status()[0]["checkouts"] == 1
+
+
+def test_async_replica_session_connects_on_first_use(engine, replica_pool, run_async):
+    """In async mode, a replica AsyncSession connects on first use."""
+    pytest.importorskip("asyncpg")
+    pool = replica_pool([str(engine.url)], db_async=True)
+    db = pool.async_session(engine)
+    assert pool.status()[0]["checkouts"] == 0
+    bind = run_async(db.run_sync(lambda session: session.get_bind()))
+    assert bind is pool.engines[0]
+    assert bind.dialect.driver == "asyncpg"
+    result = run_async(db.execute("SELECT current_database()"))
+    assert result.scalar() == engine.url.database
+    run_async(db.close())
+    assert pool.status()[0]["checkouts"] == 1
@@ -0,0 +1,72 @@
+"""Tests for the Prometheus metrics"""
+import pytest
+from prometheus_client import REGISTRY, CollectorRegistry
+
+from ctms import metrics
+
+
+def sample(name, **labels):
+    """Return the current value of a metric sample, or 0 if not recorded yet."""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_request_metrics(client, minimal_contact):
+    """A request is counted and timed, labeled with the route's path template."""
+    labels = {"method": "GET", "path_template": "/ctms/{email_id}"}
+    ok_before = sample("ctms_requests_total", status_code="200", **labels)
+    missing_before = sample("ctms_requests_total", status_code="404", **labels)
+    timed_before = sample("ctms_request_duration_seconds_count", **labels)
+
+    resp = client.get(f"/ctms/{minimal_contact.email.email_id}")
+    assert resp.status_code == 200
+    resp = client.get("/ctms/cad092ec-a71a-4df5-aa92-517959caeecb")
+    assert resp.status_code == 404
+
+    assert sample("ctms_requests_total", status_code="200", **labels) == ok_before + 1
+    assert (
+        sample("ctms_requests_total", status_code="404", **labels) == missing_before + 1
+    )
+    assert sample("ctms_request_duration_seconds_count", **labels) == timed_before + 2
+
+
+def test_request_metrics_unknown_route(client):
+    """Paths without a route share one label."""
+    labels = {"method": "GET", "path_template": "unknown", "status_code": "404"}
+    before = sample("ctms_requests_total", **labels)
+    assert client.get("/not-a-route/12345").status_code == 404
+    assert sample("ctms_requests_total", **labels) == before + 1
+
+
+def test_request_db_metrics(client, minimal_contact, tracked_connection):
+    """The database statements of a request are counted and timed."""
+    labels = {"method": "GET", "path_template": "/contact/email/{email_id}"}
+    queries_before = sample("ctms_request_db_queries_sum", **labels)
+    seconds_before = sample("ctms_request_db_duration_seconds_sum", **labels)
+
+    resp = client.get(f"/contact/email/{minimal_contact.email.email_id}")
+    assert resp.status_code == 200
+
+    queries = sample("ctms_request_db_queries_sum", **labels) - queries_before
+    assert queries >= 1
+    assert sample("ctms_request_db_duration_seconds_sum", **labels) > seconds_before
+
+
+def test_metrics_endpoint(client, engine, monkeypatch):
+    """GET /metrics returns the metrics, including the pool gauges."""
+    monkeypatch.setattr(metrics, "_pools", {})
+    metrics.add_pool_metrics("primary", engine)
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert "ctms_requests_total" in resp.text
+    assert 'ctms_db_pool_size{pool="primary"}' in resp.text
+    assert sample("ctms_db_pool_size", pool="primary") == engine.pool.size()
+
+
+def test_metrics_registry_multiprocess(monkeypatch, tmp_path):
+    """With a multi-process directory, the metrics are read from the files."""
+    assert metrics.get_metrics_registry() is REGISTRY
+    monkeypatch.setenv("prometheus_multiproc_dir", str(tmp_path))
+    registry = metrics.get_metrics_registry()
+    assert isinstance(registry, CollectorRegistry)
+    assert registry is not REGISTRY
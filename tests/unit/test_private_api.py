@@ -1,7 +1,14 @@
 """Tests for the private APIs that may be removed."""
+import json
+import re
+from uuid import UUID
 
 import pytest
 
+from ctms.crud import create_contact
+from ctms.sample_data import SAMPLE_CONTACTS
+from ctms.schemas import ContactSchema
+
 
 def identity_response_for_contact(contact):
     """Construct the expected identity object for a contact."""
@@ -142,3 +149,189 @@ def test_get_subgroup_not_found(client, dbsession, subgroup):
     resp = client.get(f"/contact/{subgroup}/{email_id}")
     assert resp.status_code == 404
     assert resp.json() == {"detail": "Unknown email_id"}
+
+
+def select_tables(statements):
+    """Return the first table queried by each SELECT statement."""
+    tables = []
+    for statement, _ in statements:
+        if statement.startswith("SELECT"):
+            tables.append(re.search(r"\sFROM (\w+)", statement).group(1))
+    return tables
+
+
+@pytest.mark.parametrize(
+    "subgroup,table",
+    (
+        ("email", "emails"),
+        ("amo", "amo"),
+        ("vpn_waitlist", "vpn_waitlist"),
+        ("fxa", "fxa"),
+    ),
+)
+def test_get_subgroup_queries_one_table(
+    client, maximal_contact, statements, subgroup, table
+):
+    """GET /contact/{subgroup}/{email_id} only queries the subgroup's table."""
+    email_id = maximal_contact.email.email_id
+    statements.clear()
+    resp = client.get(f"/contact/{subgroup}/{email_id}")
+    assert resp.status_code == 200
+    assert select_tables(statements) == [table]
+
+
+@pytest.mark.parametrize(
+    "subgroup,table", (("amo", "amo"), ("vpn_waitlist", "vpn_waitlist"), ("fxa", "fxa"))
+)
+def test_get_empty_subgroup_checks_email(
+    client, minimal_contact, statements, subgroup, table
+):
+    """GET /contact/{subgroup}/{email_id} checks emails when the subgroup is empty."""
+    email_id = minimal_contact.email.email_id
+    statements.clear()
+    resp = client.get(f"/contact/{subgroup}/{email_id}")
+    assert resp.status_code == 200
+    assert select_tables(statements) == [table, "emails"]
+
+
+def test_export(client, sample_contacts, override_settings, statements):
+    """GET /export streams all contacts as NDJSON, loading them in chunks."""
+    override_settings(export_chunk_size=2)
+    statements.clear()
+    resp = client.get("/export")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    lines = resp.text.splitlines()
+    exported = [ContactSchema(**json.loads(line)) for line in lines]
+    expected = sorted(
+        (contact for _, contact in sample_contacts.values()),
+        key=lambda contact: str(contact.email.email_id),
+    )
+    assert [c.email.email_id for c in exported] == [c.email.email_id for c in expected]
+    for exported_contact, contact in zip(exported, expected):
+        assert exported_contact.email == contact.email
+        assert exported_contact.amo == contact.amo
+        assert exported_contact.fxa == contact.fxa
+        assert exported_contact.newsletters == contact.newsletters
+        assert exported_contact.vpn_waitlist == contact.vpn_waitlist
+
+    # One emails query, then four queries for each chunk of two contacts
+    assert select_tables(statements) == [
+        "emails",
+        "amo",
+        "fxa",
+        "vpn_waitlist",
+        "newsletters",
+        "amo",
+        "fxa",
+        "vpn_waitlist",
+        "newsletters",
+    ]
+
+
+def test_export_empty(client, dbsession):
+    """GET /export with no contacts returns an empty body."""
+    resp = client.get("/export")
+    assert resp.status_code == 200
+    assert resp.text == ""
+
+
+@pytest.mark.parametrize("ident", ("primary_email", "basket_token", "fxa_id"))
+def test_get_identities_cached(
+    client, maximal_contact, identity_cache, contact_cache, statements, ident
+):
+    """GET /identities resolves a cached alternate ID without querying."""
+    identity = identity_response_for_contact(maximal_contact)
+    resp = client.get(f"/identities?{ident}={identity[ident]}")
+    assert resp.json() == [identity]
+    assert identity_cache.get(ident, identity[ident]) == maximal_contact.email.email_id
+
+    statements.clear()
+    resp = client.get(f"/identities?{ident}={identity[ident]}")
+    assert resp.json() == [identity]
+    assert statements == []
+
+
+@pytest.mark.parametrize("ident", ("sfdc_id", "mofo_id", "amo_user_id"))
+def test_get_identities_shared_id_not_cached(
+    client, dbsession, maximal_contact, identity_cache, ident
+):
+    """GET /identities finds a contact given a shared ID after a lookup."""
+    identity = identity_response_for_contact(maximal_contact)
+    resp = client.get(f"/identities?{ident}={identity[ident]}")
+    assert resp.json() == [identity]
+    assert identity_cache.get(ident, identity[ident]) is None
+
+    # Added by another worker, so this worker's caches are not invalidated
+    sibling = SAMPLE_CONTACTS[UUID("d1da1c99-fe09-44db-9c68-78a75752574d")].copy(
+        deep=True
+    )
+    sibling.email.sfdc_id = maximal_contact.email.sfdc_id
+    sibling.email.mofo_id = maximal_contact.email.mofo_id
+    sibling.amo = maximal_contact.amo
+    create_contact(dbsession, sibling.email.email_id, sibling)
+    dbsession.commit()
+
+    resp = client.get(f"/identities?{ident}={identity[ident]}")
+    email_ids = {contact["email_id"] for contact in resp.json()}
+    assert email_ids == {
+        str(maximal_contact.email.email_id),
+        str(sibling.email.email_id),
+    }
+
+
+def test_get_identities_cached_email_id(
+    client, maximal_contact, identity_cache, statements
+):
+    """With the caches enabled, an email_id lookup is a primary key fetch."""
+    identity = identity_response_for_contact(maximal_contact)
+    statements.clear()
+    resp = client.get(f"/identities?email_id={identity['email_id']}")
+    assert resp.json() == [identity]
+    selects = [sql for sql, _ in statements if sql.startswith("SELECT")]
+    assert len(selects) == 1
+
+
+def test_get_identities_stale_cache(client, sample_contacts, identity_cache):
+    """A cached alternate ID is not trusted if the contact no longer has it."""
+    minimal_id, _ = sample_contacts["minimal"]
+    _, maximal = sample_contacts["maximal"]
+    identity_cache.set("fxa_id", maximal.fxa.fxa_id, minimal_id)
+    resp = client.get(f"/identities?fxa_id={maximal.fxa.fxa_id}")
+    assert resp.json() == [identity_response_for_contact(maximal)]
+    assert identity_cache.get("fxa_id", maximal.fxa.fxa_id) == maximal.email.email_id
+
+
+def test_create_invalidates_identity_cache(client, dbsession, identity_cache):
+    """POST /ctms removes the new contact's alternate IDs from the cache."""
+    email_id = UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+    contact = SAMPLE_CONTACTS[email_id]
+    stale_id = UUID("cad092ec-a71a-4df5-aa92-517959caeecb")
+    identity_cache.set("fxa_id", contact.fxa.fxa_id, stale_id)
+    resp = client.post("/ctms", contact.json())
+    assert resp.status_code == 200
+    assert identity_cache.get("fxa_id", contact.fxa.fxa_id) is None
+
+
+def test_get_identities_unknown_cached(client, dbsession, identity_cache, statements):
+    """GET /identities remembers an unknown alternate ID."""
+    resp = client.get("/identities?fxa_id=unknown")
+    assert resp.json() == []
+    statements.clear()
+    resp = client.get("/identities?fxa_id=unknown")
+    assert resp.json() == []
+    assert statements == []
+
+
+def test_create_clears_unknown_identity(
+    client, dbsession, identity_cache, contact_cache
+):
+    """POST /ctms makes a recently unknown alternate ID visible immediately."""
+    email_id = UUID("67e52c77-950f-4f28-accb-bb3ea1a2c51a")
+    contact = SAMPLE_CONTACTS[email_id]
+    resp = client.get(f"/identities?fxa_id={contact.fxa.fxa_id}")
+    assert resp.json() == []
+    resp = client.post("/ctms", contact.json())
+    assert resp.status_code == 200
+    resp = client.get(f"/identities?fxa_id={contact.fxa.fxa_id}")
+    assert [identity["email_id"] for identity in resp.json()] == [str(email_id)]
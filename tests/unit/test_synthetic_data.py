@@ -0,0 +1,67 @@
+"""Tests for the synthetic contact generator"""
+from collections import Counter
+from datetime import datetime, timezone
+
+import pytest
+
+from ctms.crud import get_contact_by_email_id
+from ctms.schemas import ContactSchema
+from ctms.synthetic_data import copy_contacts, copy_value, generate_chunk
+
+
+def test_generate_chunk_is_deterministic():
+    """A chunk has the same contacts for the same seed, whatever its size."""
+    contacts = generate_chunk(seed=1, chunk=2, size=20)
+    assert generate_chunk(seed=1, chunk=2, size=20) == contacts
+    assert generate_chunk(seed=1, chunk=2, size=5) == contacts[:5]
+    other_ids = {c["email"]["email_id"] for c in generate_chunk(1, 3, 20)}
+    assert not other_ids & {c["email"]["email_id"] for c in contacts}
+
+
+def test_generated_contacts_are_valid():
+    """The generated contacts are valid ContactSchemas."""
+    for contact in generate_chunk(seed=0, chunk=0, size=200):
+        ContactSchema(**contact)
+
+
+def test_generated_distribution():
+    """Contacts have a mix of groups, newsletter counts, and shared IDs."""
+    contacts = generate_chunk(seed=0, chunk=0, size=5000)
+    fxa_rate = sum(1 for c in contacts if c["fxa"]) / len(contacts)
+    amo_rate = sum(1 for c in contacts if c["amo"]) / len(contacts)
+    assert 0.55 < fxa_rate < 0.65
+    assert 0.03 < amo_rate < 0.07
+    assert any(c["vpn_waitlist"] for c in contacts)
+
+    newsletter_counts = Counter(len(c["newsletters"]) for c in contacts)
+    assert newsletter_counts[0] and newsletter_counts[1] and max(newsletter_counts) > 5
+
+    sfdc_ids = Counter(c["email"]["sfdc_id"] for c in contacts if c["email"]["sfdc_id"])
+    assert max(sfdc_ids.values()) > 1
+    assert len({c["email"]["primary_email"] for c in contacts}) == len(contacts)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    (
+        (None, "\\N"),
+        (True, "t"),
+        (False, "f"),
+        ("tab\there", "tab\\there"),
+        ("back\\slash\n", "back\\\\slash\\n"),
+        (datetime(2021, 1, 2, tzinfo=timezone.utc), "2021-01-02T00:00:00+00:00"),
+    ),
+)
+def test_copy_value(value, expected):
+    """Values are formatted for COPY's text format."""
+    assert copy_value(value) == expected
+
+
+def test_copy_contacts(dbsession):
+    """Copied contacts are read back as generated."""
+    contacts = generate_chunk(seed=0, chunk=0, size=50)
+    with dbsession.connection().connection.cursor() as cursor:
+        copy_contacts(cursor, contacts)
+    for contact in contacts:
+        data = get_contact_by_email_id(dbsession, contact["email"]["email_id"])
+        assert ContactSchema(**data) == ContactSchema(**contact)
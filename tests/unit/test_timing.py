@@ -0,0 +1,129 @@
+"""Tests for the Server-Timing headers and timing logs"""
+import json
+import logging
+
+import pytest
+
+from ctms.app import app
+from ctms.database import QueryStats
+from ctms.timing import (
+    RequestTimer,
+    ServerTimingMiddleware,
+    request_timer,
+    server_timing_header,
+    timed,
+)
+
+
+@pytest.fixture
+def server_timing():
+    """Add the ServerTimingMiddleware to the app for the test."""
+    user_middleware = list(app.user_middleware)
+    app.add_middleware(ServerTimingMiddleware)
+    yield
+    app.user_middleware = user_middleware
+    app.middleware_stack = app.build_middleware_stack()
+
+
+def parse_server_timing(header):
+    """Return the Server-Timing metrics as a dict of name to parameters."""
+    metrics = {}
+    for metric in header.split(", "):
+        name, *params = metric.split(";")
+        metrics[name] = dict(param.split("=", 1) for param in params)
+    return metrics
+
+
+def test_server_timing_header():
+    """The header has each phase in milliseconds, and the statement count."""
+    timer = RequestTimer()
+    timer.phases["validate"] = 0.002
+    stats = QueryStats()
+    stats.count = 3
+    stats.seconds = 0.0125
+    assert server_timing_header(timer, stats, 0.05) == (
+        'db;dur=12.500;desc="3 statements", validate;dur=2.000,'
+        " serialize;dur=0.000, total;dur=50.000"
+    )
+
+
+def test_timed_without_timer():
+    """Outside of a timed request, timed() does nothing."""
+    assert request_timer.get() is None
+    with timed("validate"):
+        pass
+
+
+def test_timed_adds_to_phase():
+    """timed() adds the time of each block to the phase."""
+    timer = RequestTimer()
+    token = request_timer.set(timer)
+    try:
+        with timed("serialize"):
+            pass
+        first = timer.phases["serialize"]
+        with timed("serialize"):
+            pass
+    finally:
+        request_timer.reset(token)
+    assert 0 < first < timer.phases["serialize"]
+
+
+def test_no_header_when_disabled(client, minimal_contact):
+    """Without the middleware, there is no Server-Timing header."""
+    resp = client.get(f"/ctms/{minimal_contact.email.email_id}")
+    assert resp.status_code == 200
+    assert "Server-Timing" not in resp.headers
+
+
+def test_get_ctms_server_timing(
+    client, minimal_contact, server_timing, tracked_connection, statements
+):
+    """GET /ctms/{email_id} returns the time in each phase."""
+    statements.clear()
+    resp = client.get(f"/ctms/{minimal_contact.email.email_id}")
+    assert resp.status_code == 200
+    metrics = parse_server_timing(resp.headers["Server-Timing"])
+    assert list(metrics) == ["db", "validate", "serialize", "total"]
+    # The statements include the test's SAVEPOINTs
+    assert metrics["db"]["desc"] == f'"{len(statements)} statements"'
+    for name in ("db", "validate", "serialize"):
+        assert float(metrics[name]["dur"]) > 0
+    assert float(metrics["total"]["dur"]) > float(metrics["db"]["dur"])
+
+
+def test_server_timing_log(
+    client, minimal_contact, server_timing, tracked_connection, caplog
+):
+    """Each request is logged as JSON, without the query string."""
+    email = minimal_contact.email.primary_email
+    with caplog.at_level(logging.INFO, logger="ctms.timing"):
+        resp = client.get(f"/ctms?primary_email={email}")
+    assert resp.status_code == 200
+    (record,) = [r for r in caplog.records if r.name == "ctms.timing"]
+    data = json.loads(record.getMessage())
+    assert data["method"] == "GET"
+    assert data["path"] == "/ctms"
+    assert data["status_code"] == 200
+    assert data["db_statements"] >= 1
+    assert set(data) == {
+        "method",
+        "path",
+        "status_code",
+        "total_ms",
+        "db_ms",
+        "db_statements",
+        "validate_ms",
+        "serialize_ms",
+    }
+    assert email not in record.getMessage()
+
+
+def test_get_ctms_server_timing_async(client, async_contacts, server_timing):
+    """In async mode, the statements run in the session's greenlet are counted."""
+    email_id = next(iter(async_contacts))
+    resp = client.get(f"/ctms/{email_id}")
+    assert resp.status_code == 200
+    metrics = parse_server_timing(resp.headers["Server-Timing"])
+    assert metrics["db"]["desc"] == '"1 statements"'
+    assert float(metrics["validate"]["dur"]) > 0